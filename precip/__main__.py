@@ -2,46 +2,250 @@
 
 This script executes all logic for the precip package. The package's purpose is to extract information
 from a file containing precipitation (rainfall) data and transform and load it into a sqlite database
-and a zipped json object.
+and a zipped json object, and optionally a parquet file.
+
+Run without arguments, the files are chosen in browser windows. Given a directory or glob pattern and an output
+directory, every matching file is loaded headlessly into one database:
+
+    python -m precip data/*.pre --output results --workers 4
 """
 
+import argparse
+import logging
 import os
-from precip.browser import get_user_input
-from precip.etl.transform import transform_data, convert_to_df
-from precip.etl.load_to_db import write_to_db, dump_to_json
+from precip.etl.transform import check_filepath, iter_rows
+from precip.etl.readers import open_input, read_header, MONTHS
+from precip.etl.extract import calculate_number_of_years
+from precip.etl.instrument import Instrumentation
+from precip.etl.load_to_db import export_json, write_to_parquet, JSON_LAYOUTS
+from precip.etl.ledger import ingest_file
+from precip.etl.pipeline import pipeline_file
+
+OUTPUTS = ("sqlite", "json", "parquet")
+DEFAULT_OUTPUTS = ("sqlite", "json")
+
+# precip.zip keeps the member name and millisecond dates that DataFrame.to_json wrote, unless iso_json is set
+_LEGACY_JSON = {"date_format": "epoch", "member_name": "precip"}
 
 
-def run():
-    """Executes the precip package."""
+def run(outputs=DEFAULT_OUTPUTS, pipelined=False, metrics=False, profile=False, aggregates=False, cache=False,
+        iso_json=False, json_layout="records"):
+    """Executes the precip package.
 
-    # Get the filepath information from the user
+    Parameters
+    ----------
+    outputs : sequence of str, optional
+        The outputs to write: any of 'sqlite' (precip.db), 'json' (precip.zip) and 'parquet' (precip.parquet).
+        The parquet file is always read by the vectorised parser of etl.arrays, which splits values with no space
+        between them by their columns. Unless cache is set, precip.db and precip.zip are read by the reference
+        per-line parser, which reads such values as one value, so the outputs disagree for the cells that have them.
+    pipelined : bool, optional
+        If True, the file is parsed once and the sqlite and json outputs are written concurrently by
+        pipeline.pipeline_file. Every cell is written, rather than only the cells changed since the last load.
+    metrics : bool, optional
+        If True, the wall time, CPU time, records and peak memory of each stage are written to
+        precip_metrics.json in the output folder. The metrics are always logged to the 'precip.metrics' logger.
+    profile : bool, optional
+        If True, the stages are also run under cProfile and tracemalloc, and the profile is written to
+        precip_profile.prof in the output folder.
+    aggregates : bool, optional
+        If True, the annual totals and monthly climatology of each cell are computed as the data is loaded and
+        stored in aggregate tables in precip.db.
+    cache : bool, optional
+        If True, every output reads the file's parsed blocks from the persistent cache in etl.cache, so the file is
+        only parsed the first time its content is loaded. The cache follows the vectorised parser, so values with
+        no space between them are split by their columns in every output, rather than read as one value, and
+        every output holds the same values.
+    iso_json : bool, optional
+        If True, precip.zip holds a member named precip.json with ISO 8601 dates. Otherwise the member is named
+        precip and dates are milliseconds since 1970, as written by earlier versions with DataFrame.to_json.
+    json_layout : str, optional
+        The layout of precip.zip, as for load_to_db.export_json: 'records' writes one object per value and 'cells'
+        writes one object per grid cell with its monthly values in a list, which is smaller and faster to write.
+    """
+
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        print("Unknown outputs: {}. Choose from: {}.".format(", ".join(sorted(unknown)), ", ".join(OUTPUTS)))
+        return
+
+    # Get the filepath information from the user. The browser is only imported here, so that the headless batch
+    # mode does not need tkinter.
+    from precip.browser import get_user_input
     filepath, output_path = get_user_input()
 
+    json_options = dict({} if iso_json else _LEGACY_JSON, layout=json_layout)
+    instrumentation = Instrumentation(profile=profile, trace_memory=profile)
+    try:
+        _run_stages(filepath, output_path, outputs, pipelined, instrumentation, aggregates,
+                    backend="cache" if cache else "mmap", json_options=json_options)
+    finally:
+        instrumentation.close()
+        if metrics or profile:
+            instrumentation.write_report(os.path.join(output_path, "precip_metrics.json"))
+        if profile:
+            instrumentation.write_profile(os.path.join(output_path, "precip_profile.prof"))
+
+
+def _run_stages(filepath, output_path, outputs, pipelined, instrumentation, aggregates=False, backend="mmap",
+                json_options=None):
+    """Extracts, transforms and loads a file to the selected outputs, recording each stage."""
+
     # Create the output filepaths where the data will be written to
     sql_path = os.path.join(output_path, "precip.db")
     json_path = os.path.join(output_path, "precip.zip")
+    parquet_path = os.path.join(output_path, "precip.parquet")
 
-    # Extract and transform the data
-    data = transform_data(filepath)
-    if not data:
+    # Extract and transform the data as it is written. The file is read once for each output so that only
+    # a single batch of records is held in memory, however large the file is. Only the header is read here, to
+    # check the file and find the size of its blocks.
+    try:
+        with instrumentation.stage("extract") as stage:
+            check_filepath(filepath)
+            with open_input(filepath, "rb") as f:
+                header, first_grid_ref = read_header(f)
+            block_size = calculate_number_of_years(header["start_date"], header["end_date"]) * MONTHS
+    except (FileNotFoundError, ValueError) as exc:
+        print(exc)
+        return
+    if not first_grid_ref:
         print("No data to write.")
         return
 
+    # Load the data to the selected outputs
     try:
-        df = convert_to_df(data)
-    except TypeError as exc:
+        if "parquet" in outputs:
+            # The vectorised parser needs NumPy, which the sqlite and json outputs do not. Without the cache, the
+            # other outputs use the reference parser, so values with no space between them differ (see run).
+            from precip.etl.arrays import iter_blocks
+            with instrumentation.stage("parquet") as stage:
+                header, blocks = iter_blocks(filepath, backend=backend)
+                blocks = instrumentation.track(blocks, stage, block_size, item_size=block_size)
+                stage["records"] = write_to_parquet(parquet_path, header, blocks)
+            print("Data written to {} successfully.".format(parquet_path))
+        if pipelined:
+            with instrumentation.stage("pipeline") as stage:
+                summary = pipeline_file(filepath, sql_path if "sqlite" in outputs else None,
+                                        json_path if "json" in outputs else None, backend=backend,
+                                        aggregates=aggregates, json_options=json_options,
+                                        progress=lambda rows: instrumentation.track(rows, stage, block_size))
+                stage["records"] = max(summary["results"].values(), default=0)
+            stages = ", ".join("{} {:.1f}s".format(name, timing["seconds"])
+                               for name, timing in summary["timings"].items())
+            print("Data written to {} successfully in {:.1f}s ({}).".format(output_path, summary["seconds"], stages))
+            return
+        if "json" in outputs:
+            with instrumentation.stage("json") as stage:
+                rows = iter_rows(filepath, backend if backend == "cache" else "text", month_index=True)
+                export_json(json_path, instrumentation.track(rows, stage, block_size), **(json_options or {}))
+        if "sqlite" not in outputs:
+            return
+
+        # Only the cells that changed since the file was last loaded are written to the database
+        with instrumentation.stage("sqlite") as stage:
+            summary = ingest_file(sql_path, filepath, aggregates=aggregates, backend=backend,
+                                  progress=lambda rows: instrumentation.track(rows, stage, block_size))
+            stage["records"] = summary["rows_written"]
+        elapsed = stage["wall_seconds"]
+    except FileNotFoundError:
+        print("Data could not be written to the database.")
+        return
+    except (ImportError, TypeError, ValueError) as exc:
         print(exc)
         return
 
-    # Load the data to db and json
-    dump_to_json(json_path, df)
-    success = write_to_db(sql_path, "precip_values", df)
+    if summary["status"] == "unchanged":
+        print("{} has already been loaded to {}. No changes written.".format(summary["source"], output_path))
+    else:
+        rows_written = summary["rows_written"]
+        print("Data written to {} successfully ({} rows, {:.0f} rows/sec, {} cells changed).".format(
+            output_path, rows_written, rows_written / elapsed if elapsed else 0, summary["cells_changed"]))
+
+
+def run_batch(source, output_path, workers=None, json=True, aggregates=False, cache=False, json_layout="records"):
+    """Loads every precipitation file in a directory or matching a glob pattern to one database.
 
-    if success:
-        print("Data written to {} successfully.".format(output_path))
+    Parameters
+    ----------
+    source : str
+        A directory of .pre files or a glob pattern.
+    output_path : str
+        The directory where precip.db and the json files are written.
+    workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs on the machine.
+    json : bool, optional
+        If True, each file is also exported to a zipped json file.
+    aggregates : bool, optional
+        If True, the aggregate tables are computed as the files are loaded.
+    cache : bool, optional
+        If True, the workers read each file's parsed blocks from the persistent cache in etl.cache, as in
+        interactive mode.
+    json_layout : str, optional
+        The layout of the json files, as for run.
+    """
+
+    from precip.etl.batch import find_files, batch_root, ingest_batch
+
+    try:
+        paths = find_files(source)
+        n_workers = os.cpu_count() or 1 if workers is None else workers
+        print("Loading {} files with {} workers.".format(len(paths), n_workers))
+        summary = ingest_batch(paths, output_path, workers=workers, json=json, aggregates=aggregates,
+                               backend="cache" if cache else "mmap", root=batch_root(source), json_layout=json_layout)
+    except (FileNotFoundError, ValueError) as exc:
+        print(exc)
+        return
+
+    seconds = summary["seconds"]
+    print("{} files written to {} successfully ({} rows, {:.0f} rows/sec), {} unchanged.".format(
+        summary["files_loaded"], output_path, summary["rows_written"],
+        summary["rows_written"] / seconds if seconds else 0, summary["files_unchanged"]))
+    for filepath, error in summary["files_failed"]:
+        print("{} could not be loaded: {}".format(filepath, error))
+
+
+def main(argv=None):
+    """Parses the command line and runs the package interactively or in batch mode."""
+
+    parser = argparse.ArgumentParser(prog="python -m precip", description="Load precipitation (.pre) files.")
+    parser.add_argument("source", nargs="?", help="A directory of .pre files or a glob pattern. If omitted, the "
+                                                  "file is chosen in a browser window.")
+    parser.add_argument("-o", "--output", help="The directory where the outputs are written.")
+    parser.add_argument("-w", "--workers", type=int, help="The number of worker processes.")
+    parser.add_argument("--no-json", action="store_true", help="Do not write the json exports.")
+    parser.add_argument("--pipelined", action="store_true", help="Write the sqlite and json outputs of a file "
+                                                                 "chosen in a browser window concurrently.")
+    parser.add_argument("--metrics", action="store_true", help="Write the time and memory of each stage to "
+                                                               "precip_metrics.json in the output folder.")
+    parser.add_argument("--profile", action="store_true", help="Also profile each stage with cProfile and "
+                                                               "tracemalloc.")
+    parser.add_argument("--aggregates", action="store_true", help="Store the annual totals and monthly "
+                                                                  "climatology of each cell in the database.")
+    parser.add_argument("--cache", action="store_true", help="Cache the parsed blocks of each file, so that "
+                                                             "files already loaded are not parsed again. Every "
+                                                             "output then uses the vectorised parser, which splits "
+                                                             "values with no space between them by their columns, "
+                                                             "as the parquet output always does.")
+    parser.add_argument("--iso-json", action="store_true", help="Write precip.zip with a precip.json member and "
+                                                                "ISO 8601 dates, rather than the precip member "
+                                                                "and millisecond dates of earlier versions.")
+    parser.add_argument("--json-layout", choices=JSON_LAYOUTS, default="records",
+                        help="The layout of the json exports: 'records' writes one object per value and 'cells' one "
+                             "object per grid cell with its monthly values in a list, which is smaller and faster.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log progress and stage metrics.")
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+    if args.source is None:
+        run(pipelined=args.pipelined, metrics=args.metrics, profile=args.profile, aggregates=args.aggregates,
+            cache=args.cache, iso_json=args.iso_json, json_layout=args.json_layout)
+    elif args.output is None:
+        parser.error("an output directory is required with a source")
     else:
-        print("Data could not be written to the database.")
+        run_batch(args.source, args.output, workers=args.workers, json=not args.no_json,
+                  aggregates=args.aggregates, cache=args.cache, json_layout=args.json_layout)
 
 
 if __name__ == "__main__":
-    run()
+    main()
@@ -0,0 +1,9 @@
+"""Script to run the precip benchmarks
+
+    python -m precip.benchmarks --boxes 67420 --output results.json
+"""
+
+from precip.benchmarks.bench import main
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""Benchmark the stages of the ETL
+
+This module contains benchmarks that time each stage of the ETL on its own. Every benchmark runs in a fresh worker
+process, so that the peak memory of one stage does not hide that of the next. A stage's inputs are prepared in the
+worker before the timer starts. The results are written as json so that runs can be compared between commits or
+between alternative engines. The startup benchmark times the command line starting up in a new interpreter, which
+dominates short runs on small files, and lists the heavy modules imported along the way.
+
+The module exports the following:
+
+    BENCHMARKS             The benchmarks that can be run, by name
+    run_benchmark          Times one benchmark on a precipitation file
+    run_benchmarks         Generates a synthetic file, runs a set of benchmarks on it and writes the results to json
+    run_startup_benchmark  Times the start up of the command line in a new interpreter
+    main                   Runs the benchmarks from the command line
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from precip.benchmarks.generate import generate_pre
+from precip.etl.arrays import transform_arrays
+from precip.etl.extract import calculate_number_of_years
+from precip.etl.instrument import peak_rss_mb
+from precip.etl.load_to_db import write_to_db, dump_to_json, export_json
+from precip.etl.transform import transform_data, convert_to_df, iter_rows, _read_text_header, _iter_text_blocks
+
+DEFAULT_STAGES = ("transform_data", "convert_to_df", "write_to_db", "dump_to_json")
+
+# The modules that are slow to import and should only be loaded by the code paths that need them
+HEAVY_MODULES = ("numpy", "pandas", "pyarrow", "tkinter")
+STARTUP_COMMAND = ("-m", "precip", "--help")
+STARTUP_REPEAT = 10
+
+
+def _no_setup(filepath, workdir):
+    """Returns no extra arguments, for stages that read the file themselves."""
+
+    return ()
+
+
+def _records(filepath, workdir):
+    """Returns the records of the file from transform_data."""
+
+    return (transform_data(filepath),)
+
+
+def _dataframe(filepath, workdir):
+    """Returns the DataFrame of the file from convert_to_df."""
+
+    return (convert_to_df(transform_data(filepath)),)
+
+
+def _rows(filepath, workdir):
+    """Returns the rows of the file from iter_rows."""
+
+    return (list(iter_rows(filepath, backend="mmap")),)
+
+
+def _transform_data(filepath, workdir):
+    """Parses the file to a list of records with the reference parser."""
+
+    return len(transform_data(filepath))
+
+
+def _transform_arrays(filepath, workdir):
+    """Parses the file to columnar arrays with the vectorised parser."""
+
+    return len(transform_arrays(filepath, backend="mmap")["Value"])
+
+
+def _text_blocks(filepath, workdir):
+    """Reads the data rows of every block with the text backend's tokenizer, without parsing the values.
+
+    The header is parsed once with the precompiled patterns of etl.extract, and each line after it is only checked
+    for 'Grid-ref=', whose fields are sliced.
+    """
+
+    n_rows = 0
+    with open(filepath) as f:
+        header, line = _read_text_header(f)
+        years = calculate_number_of_years(header["start_date"], header["end_date"])
+        for _, _, rows in _iter_text_blocks(f, line, years):
+            n_rows += len(rows)
+    return n_rows
+
+
+def _text_blocks_per_line(filepath, workdir):
+    """Reads the data rows of every block with the per-line loop the text tokenizer replaced, for comparison.
+
+    Every line is lowercased and searched for the 'Years=' and 'Missing=' flags with patterns compiled on each
+    call, and the grid reference is read with a regular expression after its whitespace is removed.
+    """
+
+    n_rows = 0
+    with open(filepath) as f:
+        for line in f:
+            if "years" in line.lower():
+                dates = re.compile(r"(?i)Years=\d{4}-\d{4}").search(line).group()[6:].split("-")
+                years = calculate_number_of_years(int(dates[0]), int(dates[1]))
+            if "missing" in line.lower():
+                re.compile(r"(?i)Missing=.\d+").search(line)
+            if line.startswith("Grid-ref"):
+                x, y = re.compile(r"\d+,\d+").search(re.sub(r"\s", "", line)).group().split(",")
+                n_rows += len([f.readline() for _ in range(years)])
+    return n_rows
+
+
+def _convert_to_df(filepath, workdir, records):
+    """Converts the records to a DataFrame."""
+
+    return len(convert_to_df(records))
+
+
+def _write_to_db(filepath, workdir, df):
+    """Writes the DataFrame to a new sqlite database."""
+
+    write_to_db(os.path.join(workdir, "precip.db"), "precip", df)
+    return len(df)
+
+
+def _dump_to_json(filepath, workdir, df):
+    """Writes the DataFrame to a zipped json file."""
+
+    dump_to_json(os.path.join(workdir, "precip.zip"), df)
+    return len(df)
+
+
+def _export_json(filepath, workdir, rows):
+    """Streams the rows to a compact zipped json file."""
+
+    return export_json(os.path.join(workdir, "precip.zip"), iter(rows))
+
+
+# Each benchmark is a (setup, stage) pair. setup(filepath, workdir) returns the extra arguments for
+# stage(filepath, workdir, *args), which returns the number of records processed. The text_blocks benchmarks
+# count data rows (one year of a cell) rather than values.
+BENCHMARKS = {
+    "transform_data": (_no_setup, _transform_data),
+    "transform_arrays": (_no_setup, _transform_arrays),
+    "text_blocks": (_no_setup, _text_blocks),
+    "text_blocks_per_line": (_no_setup, _text_blocks_per_line),
+    "convert_to_df": (_records, _convert_to_df),
+    "write_to_db": (_dataframe, _write_to_db),
+    "dump_to_json": (_dataframe, _dump_to_json),
+    "export_json": (_rows, _export_json),
+}
+
+
+def _time_benchmark(name, filepath, workdir):
+    """Runs one benchmark in the current process and returns its result."""
+
+    setup, stage = BENCHMARKS[name]
+    args = setup(filepath, workdir)
+    start_cpu, start = time.process_time(), time.perf_counter()
+    records = stage(filepath, workdir, *args)
+    seconds = time.perf_counter() - start
+    cpu_seconds = time.process_time() - start_cpu
+    return {
+        "stage": name,
+        "records": records,
+        "seconds": seconds,
+        "cpu_seconds": cpu_seconds,
+        "records_per_sec": records / seconds if seconds else None,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+def run_benchmark(name, filepath, workdir=None):
+    """Times one benchmark on a precipitation file in a fresh worker process.
+
+    Parameters
+    ----------
+    name : str
+        The name of the benchmark, one of BENCHMARKS.
+    filepath : str
+        The path of the precipitation file.
+    workdir : str, optional
+        The directory where the stage writes its outputs. Defaults to a temporary directory that is removed
+        afterwards.
+
+    Returns
+    -------
+    dict
+        The result, with the keys 'stage', 'records', 'seconds', 'cpu_seconds', 'records_per_sec' and
+        'peak_rss_mb'. The peak memory is the high-water mark of the worker process, so it includes the stage's
+        inputs, and is None where it cannot be measured.
+
+    Raises
+    ------
+    ValueError
+        If the benchmark name is not recognised.
+    """
+
+    if name not in BENCHMARKS:
+        raise ValueError("The benchmark must be one of: {}.".format(", ".join(BENCHMARKS)))
+    with tempfile.TemporaryDirectory() as tempdir, ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_time_benchmark, name, filepath, workdir or tempdir).result()
+
+
+def run_benchmarks(output_path=None, stages=DEFAULT_STAGES, filepath=None, boxes=10000, start_year=1991,
+                   end_year=2000, missing_density=0.0, repeat=1):
+    """Generates a synthetic precipitation file, runs a set of benchmarks on it and writes the results to json.
+
+    Parameters
+    ----------
+    output_path : str, optional
+        The path of the json results file. If None, the results are only returned.
+    stages : sequence of str, optional
+        The names of the benchmarks to run.
+    filepath : str, optional
+        An existing precipitation file to benchmark instead of generating one.
+    boxes, start_year, end_year, missing_density : optional
+        The arguments passed to generate_pre for the synthetic file.
+    repeat : int, optional
+        The number of times each benchmark is run. Every run is reported.
+
+    Returns
+    -------
+    dict
+        The results, with the keys 'created', 'machine', 'input' and 'results'.
+
+    Raises
+    ------
+    ValueError
+        If a benchmark name is not recognised or repeat is not a positive integer.
+    """
+
+    unknown = set(stages) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError("Unknown benchmarks: {}. Choose from: {}.".format(", ".join(sorted(unknown)),
+                                                                            ", ".join(BENCHMARKS)))
+    if not isinstance(repeat, int) or repeat < 1:
+        raise ValueError("The number of repeats must be a positive integer.")
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        if filepath is None:
+            filepath = generate_pre(os.path.join(tempdir, "synthetic.pre"), boxes=boxes, start_year=start_year,
+                                    end_year=end_year, missing_density=missing_density)
+            source = {"boxes": boxes, "start_year": start_year, "end_year": end_year,
+                      "missing_density": missing_density}
+        else:
+            source = {"file": os.path.abspath(filepath)}
+        source["bytes"] = os.path.getsize(filepath)
+        results = [run_benchmark(name, filepath) for name in stages for _ in range(repeat)]
+
+    report = {
+        "created": datetime.now().isoformat(" ", "seconds"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "processor": platform.processor(), "cpus": os.cpu_count()},
+        "input": source,
+        "results": results
+    }
+    if output_path is not None:
+        with open(output_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def run_startup_benchmark(repeat=STARTUP_REPEAT, command=STARTUP_COMMAND):
+    """Times the start up of the command line in a new interpreter.
+
+    Parameters
+    ----------
+    repeat : int, optional
+        The number of times the command is run.
+    command : sequence of str, optional
+        The arguments passed to the Python interpreter. Defaults to printing the command line help, which imports
+        everything the command line imports before it does any work.
+
+    Returns
+    -------
+    dict
+        The results, with the keys 'command', 'seconds' (the wall time of each run), 'median_seconds',
+        'min_seconds' and 'heavy_modules' (the modules of HEAVY_MODULES loaded by importing precip.__main__).
+
+    Raises
+    ------
+    ValueError
+        If repeat is not a positive integer.
+    subprocess.CalledProcessError
+        If the command fails.
+    """
+
+    if not isinstance(repeat, int) or repeat < 1:
+        raise ValueError("The number of repeats must be a positive integer.")
+
+    # Run from the directory that contains the package so that the command imports this copy of it
+    cwd = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run((sys.executable,) + tuple(command), cwd=cwd, stdout=subprocess.DEVNULL, check=True)
+        seconds.append(time.perf_counter() - start)
+
+    probe = "import sys, precip.__main__; print(' '.join(m for m in {!r} if m in sys.modules))".format(
+        HEAVY_MODULES)
+    loaded = subprocess.run((sys.executable, "-c", probe), cwd=cwd, capture_output=True, text=True, check=True)
+    return {
+        "command": " ".join(("python",) + tuple(command)),
+        "seconds": seconds,
+        "median_seconds": statistics.median(seconds),
+        "min_seconds": min(seconds),
+        "heavy_modules": loaded.stdout.split()
+    }
+
+
+def _year_range(value):
+    """Parses a 'YYYY-YYYY' year range from the command line into (start_year, end_year)."""
+
+    try:
+        start_year, end_year = (int(year) for year in value.split("-"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid year range {!r}, expected e.g. 1991-2000".format(value))
+    return start_year, end_year
+
+
+def main(argv=None):
+    """Runs the benchmarks from the command line and prints a summary of each stage."""
+
+    parser = argparse.ArgumentParser(prog="python -m precip.benchmarks", description="Benchmark the precip ETL.")
+    parser.add_argument("stages", nargs="*", default=list(DEFAULT_STAGES),
+                        help="The benchmarks to run, from: {}.".format(", ".join(BENCHMARKS)))
+    parser.add_argument("-o", "--output", help="The path of the json results file.")
+    parser.add_argument("-f", "--file", help="Benchmark an existing .pre file instead of a synthetic one.")
+    parser.add_argument("--boxes", type=int, default=10000, help="The number of boxes in the synthetic file.")
+    parser.add_argument("--years", type=_year_range, default=(1991, 2000),
+                        help="The year range of the synthetic file, e.g. 1991-2000.")
+    parser.add_argument("--missing", type=float, default=0.0, help="The fraction of missing values.")
+    parser.add_argument("--repeat", type=int, help="The number of runs of each benchmark. Defaults to 1, or {} "
+                                                   "with --startup.".format(STARTUP_REPEAT))
+    parser.add_argument("--startup", action="store_true", help="Time the start up of the command line instead.")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        try:
+            result = run_startup_benchmark(args.repeat or STARTUP_REPEAT)
+        except (subprocess.CalledProcessError, ValueError) as exc:
+            print(exc)
+            return
+        if args.output is not None:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+        print("{}: median {:.3f}s, min {:.3f}s over {} runs, heavy modules imported: {}".format(
+            result["command"], result["median_seconds"], result["min_seconds"], len(result["seconds"]),
+            ", ".join(result["heavy_modules"]) or "none"))
+        return
+
+    start_year, end_year = args.years
+    try:
+        report = run_benchmarks(args.output, args.stages, args.file, args.boxes, start_year, end_year,
+                                args.missing, args.repeat or 1)
+    except (FileNotFoundError, ValueError) as exc:
+        print(exc)
+        return
+
+    for result in report["results"]:
+        peak = "{:.0f} MB".format(result["peak_rss_mb"]) if result["peak_rss_mb"] is not None else "n/a"
+        print("{:<20} {:>9} records {:>8.2f}s {:>10.0f} records/sec  peak RSS {}".format(
+            result["stage"], result["records"], result["seconds"], result["records_per_sec"] or 0, peak))
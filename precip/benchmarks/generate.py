@@ -0,0 +1,87 @@
+"""Generate synthetic precipitation files
+
+This module contains a generator for .pre files in the CRU TS 2.1 format, so that the ETL can be benchmarked on
+files larger than the cut-down example in the resources folder.
+
+The module exports the following functions:
+
+    generate_pre  Writes a synthetic precipitation file with a chosen number of boxes, years and missing values
+"""
+
+import numpy as np
+
+_HEADER = (
+    "Tyndall Centre grim file created by precip.benchmarks.generate\n"
+    ".pre = precipitation (mm)\n"
+    "CRU TS 2.1\n"
+    "[Long=-180.00, 180.00] [Lati= -90.00,  90.00] [Grid X,Y={:>4d},{:>4d}]\n"
+    "[Boxes={:>8d}] [Years={}-{}] [Multi={:>10.4f}] [Missing={}]\n"
+)
+
+# Values are kept below 10000 so that every value is separated by at least one space in its five character field
+_MAX_VALUE = 9999
+
+
+def generate_pre(path, boxes=1000, start_year=1991, end_year=2000, missing_density=0.0, grid_size=(720, 360),
+                 multiplier=0.1, missing_value=-999, seed=0):
+    """Writes a synthetic precipitation file.
+
+    The boxes are distinct cells chosen at random from the grid and written in order of Xref then Yref, as in the
+    CRU files. Values are drawn from a gamma distribution and a random fraction of them are replaced with the
+    missing value.
+
+    Parameters
+    ----------
+    path : str
+        The path of the file to be written.
+    boxes : int, optional
+        The number of 'Grid-ref=' blocks in the file.
+    start_year : int, optional
+        The first year of the 'Years=' range.
+    end_year : int, optional
+        The last year of the 'Years=' range, inclusive.
+    missing_density : float, optional
+        The fraction of values, between 0 and 1, that are replaced with the missing value.
+    grid_size : tuple, optional
+        The (X, Y) size of the grid.
+    multiplier : float, optional
+        The value of the 'Multi=' flag.
+    missing_value : int, optional
+        The value of the 'Missing=' flag.
+    seed : int, optional
+        The seed for the random number generator, so that the same arguments always produce the same file.
+
+    Returns
+    -------
+    str
+        The path of the file.
+
+    Raises
+    ------
+    ValueError
+        If the number of boxes does not fit on the grid, the year range is reversed or missing_density is not
+        between 0 and 1.
+    """
+
+    n_x, n_y = grid_size
+    if not 0 <= boxes <= n_x * n_y:
+        raise ValueError("The number of boxes must be between 0 and {}.".format(n_x * n_y))
+    if end_year < start_year:
+        raise ValueError("The end year must not be before the start year.")
+    if not 0 <= missing_density <= 1:
+        raise ValueError("The missing value density must be between 0 and 1.")
+
+    rng = np.random.default_rng(seed)
+    n_years = end_year - start_year + 1
+    cells = np.sort(rng.choice(n_x * n_y, size=boxes, replace=False))
+    row_format = "%5d" * 12 + "\n"
+
+    with open(path, "w") as f:
+        f.write(_HEADER.format(n_x, n_y, boxes, start_year, end_year, multiplier, missing_value))
+        for cell in cells.tolist():
+            x, y = divmod(cell, n_y)
+            values = np.minimum(rng.gamma(2.0, 400.0, size=(n_years, 12)), _MAX_VALUE).astype(np.int32)
+            values[rng.random((n_years, 12)) < missing_density] = missing_value
+            f.write("Grid-ref={:>4d},{:>4d}\n".format(x + 1, y + 1))
+            f.writelines(row_format % tuple(row) for row in values.tolist())
+    return path
@@ -2,4 +2,31 @@ import os
 
 ROOT_PATH = os.path.dirname(__file__)
 RESOURCES = os.path.join(ROOT_PATH, "resources")
-TEST_FILE = [os.path.join(RESOURCES, file) for file in os.listdir(RESOURCES) if file.endswith(".pre")][0]
+
+
+def get_test_file():
+    """Returns the path of the first .pre file in the resources folder.
+
+    Returns
+    -------
+    str
+        The path of the test file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the resources folder has no .pre file.
+    """
+
+    files = sorted(file for file in os.listdir(RESOURCES) if file.endswith(".pre")) \
+        if os.path.isdir(RESOURCES) else []
+    if not files:
+        raise FileNotFoundError("No .pre file was found in {}.".format(RESOURCES))
+    return os.path.join(RESOURCES, files[0])
+
+
+def __getattr__(name):
+    # TEST_FILE is only looked up when it is used, so importing the package does not list the resources folder
+    if name == "TEST_FILE":
+        return get_test_file()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
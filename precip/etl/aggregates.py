@@ -0,0 +1,263 @@
+"""Precomputed aggregates of precipitation data
+
+This module contains side tables of per-cell aggregates that are computed as rows are loaded, so that annual totals
+and monthly climatologies are primary key lookups rather than scans of the precipitation table. For a table named
+precip_values the aggregates are kept in:
+
+    precip_values_annual   Xref, Yref, Year, Total, Count, Missing   one row for each cell and year
+    precip_values_monthly  Xref, Yref, Month, Total, Count, Missing  one row for each cell and calendar month
+
+Total is the sum of the non-missing values, Count the number of non-missing values and Missing the number of missing
+values, so a mean is Total / Count. The aggregates of each batch are updated in the same transaction as its rows.
+For the managed schema, sqlite aggregates the months of each cell in the batch by a primary key range scan, before
+the batch is inserted to subtract the values it replaces and afterwards to add the new values, so the aggregates stay
+exact when blocks are appended or loaded again. Rows of other tables are only ever appended and are aggregated in
+Python. Aggregate tables added to a table that already has rows are filled from those rows when they are created, so
+they always cover every cell.
+
+The module exports the following functions:
+
+    aggregate_tables          Returns the names of the aggregate tables for a precipitation table
+    create_aggregate_tables   Creates the aggregate tables if they do not exist
+    has_aggregate_tables      Returns True if the aggregate tables exist
+    cell_ranges               Returns the range of months of each cell in a batch of rows
+    aggregate_ranges          Adds or subtracts the rows of a managed table within cell ranges to the aggregates
+    aggregate_rows            Returns the aggregates of rows in Python, for tables without the managed schema
+    apply_aggregates          Adds aggregates computed in Python to the aggregate tables
+    delete_cell_aggregates    Removes the rows within cell ranges from the aggregates before they are deleted
+"""
+
+from collections import defaultdict
+from datetime import date
+from functools import lru_cache
+from itertools import groupby
+from operator import itemgetter
+from precip.etl.schema import PRECIP_TABLE, _quote
+
+# The year and calendar month of a Date, which is a month index in the managed schema and a date string otherwise
+_PERIOD_EXPRESSIONS = {
+    "Year": "CASE WHEN typeof(Date) = 'integer' THEN Date / 12 ELSE CAST(substr(Date, 1, 4) AS INTEGER) END",
+    "Month": "CASE WHEN typeof(Date) = 'integer' THEN Date % 12 + 1 ELSE CAST(substr(Date, 6, 2) AS INTEGER) END"
+}
+
+
+def aggregate_tables(table_name=PRECIP_TABLE):
+    """Returns the names of the aggregate tables for a precipitation table.
+
+    Parameters
+    ----------
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    annual : str
+        The name of the annual aggregate table.
+    monthly : str
+        The name of the monthly aggregate table.
+    """
+
+    return table_name + "_annual", table_name + "_monthly"
+
+
+def create_aggregate_tables(connection, table_name=PRECIP_TABLE):
+    """Creates the aggregate tables for a precipitation table if they do not exist.
+
+    If the precipitation table already has rows, a new aggregate table is filled from them, so that the cells that
+    are not loaded again are not left out of the aggregates.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    table_name : str, optional
+        The name of the precipitation table.
+    """
+
+    source_exists = _table_exists(connection, table_name)
+    for aggregate_table, period in zip(aggregate_tables(table_name), ("Year", "Month")):
+        if _table_exists(connection, aggregate_table):
+            continue
+        connection.execute(
+            "CREATE TABLE {} ("
+            "Xref INTEGER NOT NULL, "
+            "Yref INTEGER NOT NULL, "
+            "{} INTEGER NOT NULL, "
+            "Total INTEGER NOT NULL, "
+            "Count INTEGER NOT NULL, "
+            "Missing INTEGER NOT NULL, "
+            "PRIMARY KEY (Xref, Yref, {})) WITHOUT ROWID".format(_quote(aggregate_table), period, period)
+        )
+        if source_exists:
+            connection.execute(
+                "INSERT INTO {} SELECT Xref, Yref, {}, COALESCE(SUM(Value), 0), COUNT(Value), COUNT(*) - COUNT(Value) "
+                "FROM {} GROUP BY 1, 2, 3".format(_quote(aggregate_table), _PERIOD_EXPRESSIONS[period],
+                                                  _quote(table_name))
+            )
+
+
+def _table_exists(connection, name):
+    """Returns True if the database has a table with this name."""
+
+    return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() \
+        is not None
+
+
+def has_aggregate_tables(connection, table_name=PRECIP_TABLE):
+    """Returns True if both aggregate tables exist for a precipitation table.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    bool
+        Whether the aggregate tables exist.
+    """
+
+    names = aggregate_tables(table_name)
+    count = connection.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+                               names).fetchone()[0]
+    return count == len(names)
+
+
+def cell_ranges(rows):
+    """Returns the range of months of each cell in a batch of rows for the managed schema.
+
+    Parameters
+    ----------
+    rows : sequence
+        The (Xref, Yref, Date, Value) rows, where Date is an integer month index. Rows are grouped by consecutive
+        cells, as they are when read block by block.
+
+    Returns
+    -------
+    list
+        A list of (Xref, Yref, first month index, last month index) tuples.
+    """
+
+    ranges = []
+    for (x, y), cell_rows in groupby(rows, key=itemgetter(0, 1)):
+        month_indexes = [row[2] for row in cell_rows]
+        ranges.append((x, y, min(month_indexes), max(month_indexes)))
+    return ranges
+
+
+def aggregate_ranges(connection, table_name, ranges, sign=1):
+    """Adds (sign=1) or subtracts (sign=-1) the rows of a managed table within cell ranges to the aggregate tables.
+
+    Each range is aggregated by sqlite from a primary key range scan. Subtracting the ranges of a batch before it is
+    inserted and adding them back afterwards updates the aggregates by exactly the values the batch added or
+    replaced, as the other rows in the ranges cancel out.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database. The aggregates are updated in its current transaction.
+    table_name : str
+        The name of the managed precipitation table.
+    ranges : list
+        The (Xref, Yref, first month index, last month index) ranges returned by cell_ranges.
+    sign : int, optional
+        1 to add the rows or -1 to subtract them.
+    """
+
+    for aggregate_table, period, expression in zip(aggregate_tables(table_name), ("Year", "Month"),
+                                                   ("Date / 12", "Date % 12 + 1")):
+        connection.executemany(
+            "INSERT INTO {0} SELECT Xref, Yref, {2}, {3} * COALESCE(SUM(Value), 0), {3} * COUNT(Value), "
+            "{3} * (COUNT(*) - COUNT(Value)) FROM {4} WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ? "
+            "GROUP BY {2} ON CONFLICT (Xref, Yref, {1}) DO UPDATE SET Total = Total + excluded.Total, "
+            "Count = Count + excluded.Count, Missing = Missing + excluded.Missing".format(
+                _quote(aggregate_table), period, expression, int(sign), _quote(table_name)),
+            ranges
+        )
+
+
+@lru_cache(maxsize=4096)
+def _year_month(value):
+    """Returns the year and the month of a date or a 'YYYY-MM-DD' string."""
+
+    if isinstance(value, date):
+        return value.year, value.month
+    return int(value[:4]), int(value[5:7])
+
+
+def aggregate_rows(rows):
+    """Returns the aggregates of rows in Python, for tables without the managed schema.
+
+    Parameters
+    ----------
+    rows : iterable
+        The (Xref, Yref, Date, Value) rows, where Date is a date or a 'YYYY-MM-DD' string and missing values are
+        None or NaN.
+
+    Returns
+    -------
+    annual : dict
+        A dictionary mapping each (Xref, Yref, Year) to its [Total, Count, Missing].
+    monthly : dict
+        A dictionary mapping each (Xref, Yref, Month) to its [Total, Count, Missing], with months from 1 to 12.
+    """
+
+    annual, monthly = defaultdict(lambda: [0, 0, 0]), defaultdict(lambda: [0, 0, 0])
+    for x, y, row_date, value in rows:
+        year, month = _year_month(row_date)
+        for totals in (annual[(x, y, year)], monthly[(x, y, month)]):
+            # NaN is the only value not equal to itself, and is stored by sqlite as NULL
+            if value is None or value != value:
+                totals[2] += 1
+            else:
+                totals[0] += value
+                totals[1] += 1
+    return annual, monthly
+
+
+def apply_aggregates(connection, table_name, annual, monthly):
+    """Adds aggregates computed in Python to the aggregate tables.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database. The aggregates are added in its current transaction.
+    table_name : str
+        The name of the precipitation table.
+    annual, monthly : dict
+        The aggregates returned by aggregate_rows.
+    """
+
+    for aggregate_table, period, deltas in zip(aggregate_tables(table_name), ("Year", "Month"), (annual, monthly)):
+        connection.executemany(
+            "INSERT INTO {0} VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (Xref, Yref, {1}) DO UPDATE SET "
+            "Total = Total + excluded.Total, Count = Count + excluded.Count, "
+            "Missing = Missing + excluded.Missing".format(_quote(aggregate_table), period),
+            [key + tuple(totals) for key, totals in deltas.items() if any(totals)]
+        )
+
+
+def delete_cell_aggregates(connection, ranges, table_name=PRECIP_TABLE):
+    """Removes the rows of a managed table within cell ranges from the aggregates, before the rows are deleted.
+
+    The rows are subtracted with aggregate_ranges, so the aggregates of the cells' other months are kept, and
+    aggregate rows left with no values are deleted.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database. The aggregates are updated in its current transaction.
+    ranges : list
+        The (Xref, Yref, first month index, last month index) ranges whose rows are about to be deleted.
+    table_name : str, optional
+        The name of the managed precipitation table.
+    """
+
+    ranges = list(ranges)
+    aggregate_ranges(connection, table_name, ranges, -1)
+    cells = sorted({(x, y) for x, y, _, _ in ranges})
+    for aggregate_table in aggregate_tables(table_name):
+        connection.executemany("DELETE FROM {} WHERE Xref = ? AND Yref = ? AND Count = 0 AND Missing = 0".format(
+            _quote(aggregate_table)), cells)
@@ -0,0 +1,289 @@
+"""Parse precipitation data to NumPy arrays
+
+This module contains a vectorised parser for .pre files. Each 'Grid-ref=' block is read as one fixed-width
+N x 12 integer matrix and converted with NumPy, so no Python object is created per value. The per-line functions
+in the extract module remain the reference implementation.
+
+The module exports the following functions:
+
+    read_header      Reads the header of a precipitation file up to the first 'Grid-ref=' line (from readers)
+    parse_block      Converts the fixed-width rows of one 'Grid-ref=' block to an N x 12 integer matrix
+    iter_blocks      Yields the grid reference and value matrix of each block in a precipitation file
+    compact_values   Returns integer values in the smallest of int16 and int32 that holds them
+    scale_values     Converts raw integer values to float32 millimetres using the 'Multi=' scale factor
+    transform_arrays Transforms a precipitation file to columnar Xref, Yref, Date, Value and Missing arrays
+    arrays_to_df     Converts columnar arrays to a pandas DataFrame
+"""
+
+import os
+import numpy as np
+from precip.etl.extract import get_grid_ref_values, calculate_number_of_years
+from precip.etl.readers import check_backend, iter_mmap_blocks, open_input, read_header, MONTHS
+
+FIELD_WIDTH = 5
+UNITS = ("raw", "mm")
+
+_ZERO, _NINE, _MINUS, _SPACE = ord("0"), ord("9"), ord("-"), ord(" ")
+_PLACE_VALUES = 10 ** np.arange(FIELD_WIDTH - 1, -1, -1, dtype=np.int32)
+_INT16 = np.iinfo(np.int16)
+
+
+def parse_block(rows, n_rows):
+    """Converts the fixed-width data rows of one 'Grid-ref=' block to an integer matrix.
+
+    Parameters
+    ----------
+    rows : bytes-like
+        The raw rows of the block, including line endings. Each row holds twelve right-aligned five character fields.
+    n_rows : int
+        The number of rows (years) in the block.
+
+    Returns
+    -------
+    numpy.ndarray
+        An int32 array with shape (n_rows, 12).
+
+    Raises
+    ------
+    ValueError
+        If the rows do not contain n_rows lines of fixed-width integers.
+    """
+
+    row_width = MONTHS * FIELD_WIDTH
+    buffer = np.frombuffer(rows, dtype=np.uint8)
+    line_length = len(buffer) // n_rows if n_rows else 0
+
+    # Rows of equal length can be viewed in place. Otherwise each line is padded to the field width first.
+    if n_rows and line_length >= row_width and line_length * n_rows == len(buffer) \
+            and (buffer[line_length - 1::line_length] == ord("\n")).all():
+        chars = buffer.reshape(n_rows, line_length)[:, :row_width]
+    else:
+        lines = bytes(rows).splitlines()
+        if len(lines) != n_rows:
+            raise ValueError("Data values could not be parsed.")
+        padded = b"".join(line[:row_width].rstrip(b"\r").ljust(row_width) for line in lines)
+        chars = np.frombuffer(padded, dtype=np.uint8).reshape(n_rows, row_width)
+
+    chars = chars.reshape(n_rows, MONTHS, FIELD_WIDTH)
+    is_digit = (chars >= _ZERO) & (chars <= _NINE)
+    is_minus = chars == _MINUS
+    if not (is_digit | is_minus | (chars == _SPACE)).all() or not is_digit.any(axis=2).all():
+        raise ValueError("Data values could not be parsed.")
+
+    # Leading spaces and the minus sign count as zero digits, then the sign is applied
+    digits = np.where(is_digit, chars - _ZERO, 0).astype(np.int32)
+    values = digits @ _PLACE_VALUES
+    return np.where(is_minus.any(axis=2), -values, values)
+
+
+def _generate_blocks(header, first_grid_ref, f):
+    """Yields the grid reference and value matrix for each block, starting from the first 'Grid-ref=' line."""
+
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+    line = first_grid_ref
+    while line:
+        if line.startswith(b"Grid-ref"):
+            x, y = get_grid_ref_values(line.decode("ascii"))
+            rows = b"".join(f.readline() for _ in range(n_rows))
+            yield x, y, parse_block(rows, n_rows)
+        line = f.readline()
+
+
+def _parse_mmap_blocks(header, raw_blocks):
+    """Yields the grid reference and value matrix for each raw block read by the mmap backend."""
+
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+    for x, y, rows in raw_blocks:
+        yield x, y, parse_block(rows, n_rows)
+
+
+def iter_blocks(filepath, backend="text"):
+    """Returns the header of a precipitation file and an iterator over its 'Grid-ref=' blocks.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be parsed.
+    backend : str, optional
+        The input backend: 'text' reads the file line by line, 'mmap' parses each block's rows in place in the
+        memory-mapped file without copying them and 'cache' reads the parsed blocks from the cache in etl.cache,
+        parsing the file only if its content is not already cached.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    blocks : iterator
+        An iterator of (x, y, values) tuples, where values is the (years, 12) int32 matrix for the grid cell. With
+        the 'cache' backend, the matrix is a read-only view of the cached array, which is int16 if the values fit.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the backend is not recognised or the header cannot be parsed. Errors in the blocks are raised during
+        iteration.
+    """
+
+    check_backend(backend)
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("The precipitation file entered could not be found.")
+    if backend == "mmap":
+        header, raw_blocks = iter_mmap_blocks(filepath)
+        return header, _parse_mmap_blocks(header, raw_blocks)
+    if backend == "cache":
+        from precip.etl.cache import iter_cached_blocks
+        return iter_cached_blocks(filepath)
+
+    f = open_input(filepath, "rb")
+    try:
+        header, first_grid_ref = read_header(f)
+    except ValueError:
+        f.close()
+        raise
+
+    def blocks():
+        with f:
+            yield from _generate_blocks(header, first_grid_ref, f)
+
+    return header, blocks()
+
+
+def compact_values(values):
+    """Returns integer values as int16 if they all fit, otherwise as int32.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        An integer array.
+
+    Returns
+    -------
+    numpy.ndarray
+        The values as int16 or int32.
+    """
+
+    if values.size == 0 or (values.min() >= _INT16.min and values.max() <= _INT16.max):
+        return values.astype(np.int16)
+    return values.astype(np.int32)
+
+
+def scale_values(values, missing, multiplier):
+    """Converts raw integer values to millimetres.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The raw integer values from the file.
+    missing : numpy.ndarray
+        A boolean mask of the missing values.
+    multiplier : float
+        The scale factor from the 'Multi=' flag.
+
+    Returns
+    -------
+    numpy.ndarray
+        A float32 array of millimetres, with NaN where values are missing.
+    """
+
+    scaled = values.astype(np.float32) * np.float32(multiplier)
+    scaled[missing] = np.nan
+    return scaled
+
+
+def _columns_from_blocks(header, blocks, units="raw"):
+    """Concatenates (x, y, values) blocks into the columnar output of transform_arrays."""
+
+    xs, ys, matrices = [], [], []
+    for x, y, values in blocks:
+        xs.append(x)
+        ys.append(y)
+        matrices.append(values)
+
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+    cell_size = n_rows * MONTHS
+    values = np.concatenate(matrices).ravel() if matrices else np.empty(0, dtype=np.int32)
+    missing = values == header["missing_value"]
+
+    # Every block covers the same months, so the date vector is built once and tiled
+    first_month = np.datetime64("{}-01".format(header["start_date"]), "M")
+    dates = first_month + np.arange(cell_size)
+
+    return {
+        "Xref": np.repeat(compact_values(np.asarray(xs, dtype=np.int32)), cell_size),
+        "Yref": np.repeat(compact_values(np.asarray(ys, dtype=np.int32)), cell_size),
+        "Date": np.tile(dates, len(matrices)),
+        "Value": scale_values(values, missing, header["multiplier"]) if units == "mm" else compact_values(values),
+        "Missing": missing
+    }
+
+
+def transform_arrays(filepath, backend="text", units="raw"):
+    """Transforms a precipitation file to columnar NumPy arrays.
+
+    This is the vectorised equivalent of transform_data. Values flagged as missing are kept in the Value array and
+    marked in the Missing mask rather than replaced with None.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    backend : str, optional
+        The input backend, as for iter_blocks.
+    units : str, optional
+        'raw' returns the integer values as they are stored in the file. 'mm' returns float32 millimetres, scaled
+        by the 'Multi=' factor in the header, with NaN for missing values.
+
+    Returns
+    -------
+    dict
+        A dictionary of equal length arrays: 'Xref' and 'Yref' (int16), 'Date' (datetime64[M]), 'Value' (int16, or
+        int32 if a value does not fit, or float32 millimetres) and 'Missing' (bool).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the backend or units are not recognised, or the header, a grid reference or a block of values cannot be
+        parsed.
+
+    Notes
+    -----
+    Values are read by their fixed five character columns, so adjacent values with no space between them are
+    separated correctly.
+    """
+
+    if units not in UNITS:
+        raise ValueError("The units must be one of: {}.".format(", ".join(UNITS)))
+    header, blocks = iter_blocks(filepath, backend)
+    return _columns_from_blocks(header, blocks, units)
+
+
+def arrays_to_df(arrays):
+    """Creates a pandas DataFrame from the columnar arrays returned by transform_arrays.
+
+    Parameters
+    ----------
+    arrays : dict
+        A dictionary with the keys 'Xref', 'Yref', 'Date', 'Value' and 'Missing'.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame with the Xref, Yref, Date and Value columns, keeping the dtypes of the arrays. Raw values are
+        held as a nullable integer column and millimetres as a float32 column with NaN for missing values.
+    """
+
+    import pandas as pd
+
+    values = arrays["Value"]
+    if np.issubdtype(values.dtype, np.integer):
+        values = pd.arrays.IntegerArray(values, arrays["Missing"])
+    return pd.DataFrame({
+        "Xref": arrays["Xref"],
+        "Yref": arrays["Yref"],
+        "Date": arrays["Date"].astype("datetime64[s]"),
+        "Value": values
+    })
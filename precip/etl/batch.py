@@ -0,0 +1,333 @@
+"""Batch ingest of many precipitation files
+
+This module contains functions to load a directory or glob of .pre files into one sqlite database. Each file is
+compared with the ingest ledger of etl.ledger in a pool of worker processes, which parse the rows of the cells that
+changed with the same parser as ledger.ingest_file and also write the file's json export. The rows are written in
+batches to a temporary file that the parent process reads back, so neither process holds a whole file's rows in
+memory. The parent is the only writer to the database, so the files are loaded without contending for sqlite's
+write lock. The workers only read the ledger.
+
+Each file is recorded in the ledger, and exported, under its path relative to the root of the batch, so files
+with the same name in different folders of a recursive glob are kept apart.
+
+The module exports the following functions:
+
+    find_files    Returns the precipitation files in a directory or matching a glob pattern
+    batch_root    Returns the directory that the files found for a directory or glob pattern are named relative to
+    array_rows    Converts columnar arrays to (Xref, Yref, Date, Value) rows
+    ingest_batch  Loads many precipitation files to one sqlite database using a pool of worker processes
+"""
+
+import glob
+import os
+import pickle
+import tempfile
+import time
+from contextlib import closing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import numpy as np
+from precip.etl.ledger import create_ledger, plan_ingest, changed_rows, apply_ingest
+from precip.etl.load_to_db import _create_connection, export_json, DEFAULT_BATCH_SIZE, JSON_LAYOUTS
+from precip.etl.readers import COMPRESSION_SUFFIXES, check_backend
+from precip.etl.schema import PRECIP_TABLE, create_precip_table
+from precip.etl.transform import iter_rows
+
+# Each worker has a second file queued so it is not left idle while the parent collects a result. Parsed files
+# wait on disk until they are written, so this also bounds the temporary space used when the writer falls behind.
+FILES_PER_WORKER = 2
+
+# The characters that start a wildcard in a glob pattern
+_GLOB_MAGIC = ("*", "?", "[")
+
+
+def find_files(source):
+    """Returns the precipitation files in a directory or matching a glob pattern.
+
+    Parameters
+    ----------
+    source : str
+        A directory, in which case every .pre file directly inside it is returned, including compressed files such
+        as .pre.gz (see readers.COMPRESSION_SUFFIXES), or a glob pattern such as 'data/**/*.pre'.
+
+    Returns
+    -------
+    list
+        The paths of the files, sorted.
+
+    Raises
+    ------
+    FileNotFoundError
+        If no files are found.
+    """
+
+    if os.path.isdir(source):
+        suffixes = (".pre",) + tuple(".pre" + suffix for suffix in COMPRESSION_SUFFIXES)
+        paths = [os.path.join(source, file) for file in os.listdir(source) if file.endswith(suffixes)]
+    else:
+        paths = glob.glob(source, recursive=True)
+    paths = sorted(path for path in paths if os.path.isfile(path))
+    if not paths:
+        raise FileNotFoundError("No precipitation files were found for {}.".format(source))
+    return paths
+
+
+def batch_root(source):
+    """Returns the directory that the files found for a directory or glob pattern are named relative to.
+
+    Parameters
+    ----------
+    source : str
+        A directory or glob pattern, as for find_files.
+
+    Returns
+    -------
+    str
+        The directory itself, or the leading folders of the pattern before the first wildcard.
+    """
+
+    if os.path.isdir(source):
+        return source
+    parts = []
+    for part in os.path.dirname(source).split(os.sep):
+        if any(magic in part for magic in _GLOB_MAGIC):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def _source_names(paths, root=None):
+    """Returns the ledger source of each path: its path relative to root, or to the deepest folder shared by every
+    path, with '/' separators."""
+
+    paths = [os.path.abspath(path) for path in paths]
+    if root is None:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else os.curdir
+    root = os.path.abspath(root)
+    return [os.path.relpath(path, root).replace(os.sep, "/") for path in paths]
+
+
+def array_rows(arrays, month_index=False):
+    """Converts columnar arrays to (Xref, Yref, Date, Value) rows.
+
+    Parameters
+    ----------
+    arrays : dict
+        The output of transform_arrays.
+    month_index : bool, optional
+        If True, Date is the integer month index of the managed sqlite schema, computed for the whole column at
+        once, rather than a date.
+
+    Returns
+    -------
+    iterator
+        An iterator of (Xref, Yref, Date, Value) tuples, where Date is a datetime.date on the first day of the
+        month or a month index and missing values are None.
+    """
+
+    values = [None if missing else value for value, missing in zip(arrays["Value"].tolist(),
+                                                                     arrays["Missing"].tolist())]
+    dates = arrays["Date"].astype("datetime64[M]")
+    if month_index:
+        # datetime64[M] counts months from January 1970
+        dates = dates.astype(np.int64) + 1970 * 12
+    return zip(arrays["Xref"].tolist(), arrays["Yref"].tolist(), dates.tolist(), values)
+
+
+def _export_path(json_dir, source):
+    """Returns the path of the json export of a source, without its compression suffix or .pre extension, in the
+    same folders below json_dir as the source is below the root of the batch."""
+
+    name = source
+    if name.endswith(COMPRESSION_SUFFIXES):
+        name = os.path.splitext(name)[0]
+    return os.path.join(json_dir, *os.path.splitext(name)[0].split("/")) + ".zip"
+
+
+def _write_rows(rows, rows_path, batch_size):
+    """Writes rows to a temporary file in pickled batches of batch_size and returns the number of rows written."""
+
+    count = 0
+    with open(rows_path, "wb") as f:
+        batch = list(islice(rows, batch_size))
+        while batch:
+            pickle.dump(batch, f, pickle.HIGHEST_PROTOCOL)
+            count += len(batch)
+            batch = list(islice(rows, batch_size))
+    return count
+
+
+def _read_rows(rows_path):
+    """Yields the rows written by _write_rows, one batch at a time."""
+
+    with open(rows_path, "rb") as f:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+
+
+def _parse_file(filepath, source, db_path, json_dir, rows_path, backend="mmap", batch_size=DEFAULT_BATCH_SIZE,
+                json_layout="records"):
+    """Compares one file with the ledger in a worker process, writes the rows of its changed cells to rows_path and
+    writes its json export if json_dir is given.
+
+    Returns the filepath, the source, the plan from ledger.plan_ingest (None if the file is unchanged), the number
+    of rows written to rows_path, the error message (or None) and the time taken.
+    """
+
+    start = time.perf_counter()
+    try:
+        connection = _create_connection(db_path)
+        try:
+            plan = plan_ingest(connection, filepath, source, backend)
+        finally:
+            connection.close()
+        n_rows = 0 if plan is None else _write_rows(changed_rows(filepath, plan["changed"], backend), rows_path,
+                                                    batch_size)
+        if json_dir is not None:
+            # The json export is read by the same parser as the database, as in interactive mode
+            json_path = _export_path(json_dir, source)
+            os.makedirs(os.path.dirname(json_path), exist_ok=True)
+            export_json(json_path, iter_rows(filepath, backend if backend == "cache" else "text", month_index=True),
+                        layout=json_layout)
+    except (FileNotFoundError, ValueError) as exc:
+        return filepath, source, None, 0, str(exc), time.perf_counter() - start
+    return filepath, source, plan, n_rows, None, time.perf_counter() - start
+
+
+def _iter_parsed(paths, sources, workers, db_path, json_dir, rows_dir, backend="mmap",
+                 batch_size=DEFAULT_BATCH_SIZE, json_layout="records"):
+    """Yields the result of _parse_file and the path of its rows file for each path in the order the files finish,
+    keeping at most FILES_PER_WORKER files per worker in flight."""
+
+    jobs = enumerate(zip(paths, sources))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+
+        def submit(job):
+            i, (path, source) = job
+            rows_path = os.path.join(rows_dir, "{}.rows".format(i))
+            future = executor.submit(_parse_file, path, source, db_path, json_dir, rows_path, backend, batch_size,
+                                     json_layout)
+            pending[future] = rows_path
+
+        for job in islice(jobs, workers * FILES_PER_WORKER):
+            submit(job)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result(), pending.pop(future)
+                job = next(jobs, None)
+                if job is not None:
+                    submit(job)
+
+
+def ingest_batch(paths, output_path, workers=None, json=True, table_name=PRECIP_TABLE,
+                 batch_size=DEFAULT_BATCH_SIZE, report=print, aggregates=False, backend="mmap", root=None,
+                 json_layout="records"):
+    """Loads many precipitation files to one sqlite database using a pool of worker processes.
+
+    Each file is loaded as ledger.ingest_file would load it, to the managed precipitation table in
+    output_path/precip.db: a file that is unchanged since its last load is skipped, and otherwise only the rows of
+    its changed cells are replaced. The files are compared with the ledger and parsed in parallel, and their rows
+    are written one file at a time by the parent process.
+
+    Parameters
+    ----------
+    paths : sequence of str
+        The paths of the precipitation files, e.g. from find_files. Each file is recorded in the ledger under its
+        path relative to root.
+    output_path : str
+        The directory where the database and json files are written.
+    workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs on the machine.
+    json : bool, optional
+        If True, each file is also exported to output_path/<relative path>.zip by its worker, where the relative
+        path is the file's path below root without its extension.
+    table_name : str, optional
+        The name of the precipitation table.
+    batch_size : int, optional
+        The number of rows inserted in each transaction.
+    report : callable, optional
+        Called with a progress message after each file is parsed. Defaults to print.
+    aggregates : bool, optional
+        If True, the aggregate tables of etl.aggregates are updated as the rows are loaded.
+    backend : str, optional
+        The input backend, as for ledger.ingest_file. Use 'cache' to read files that have been parsed before from
+        the persistent cache, with the vectorised parser.
+    root : str, optional
+        The directory the files are named relative to, e.g. from batch_root. Defaults to the deepest folder that
+        contains every file, so a batch of files in one folder is recorded under their file names.
+    json_layout : str, optional
+        The layout of the json files, as for load_to_db.export_json.
+
+    Returns
+    -------
+    dict
+        A summary with the keys 'files_loaded', 'files_unchanged', 'files_failed' (a list of (path, error)
+        tuples), 'rows_written' and 'seconds'.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the output path does not exist or the database connection could not be made.
+    ValueError
+        If the number of workers is not a positive integer, or the backend or json layout is not recognised.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError("The number of workers must be a positive integer.")
+    check_backend(backend)
+    if json_layout not in JSON_LAYOUTS:
+        raise ValueError("The json layout must be one of: {}.".format(", ".join(JSON_LAYOUTS)))
+    if not os.path.isdir(output_path):
+        raise FileNotFoundError("The output location {} could not be found.".format(output_path))
+
+    summary = {"files_loaded": 0, "files_unchanged": 0, "files_failed": [], "rows_written": 0, "seconds": 0.0}
+    start = time.perf_counter()
+
+    # The tables are created before the workers start, so that they only read the database. The Date index is
+    # built after the first file is loaded.
+    db_path = os.path.join(output_path, "precip.db")
+    connection = _create_connection(db_path)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        create_ledger(connection)
+        create_precip_table(connection, table_name, without_rowid=True, date_index=False)
+        connection.commit()
+    finally:
+        connection.close()
+
+    json_dir = output_path if json else None
+    sources = _source_names(paths, root)
+    rows_parsed = 0
+    # The rows files are kept next to the database rather than in the system's temporary folder, which may be small
+    with tempfile.TemporaryDirectory(prefix=".precip-rows-", dir=output_path) as rows_dir, \
+            closing(_iter_parsed(paths, sources, workers, db_path, json_dir, rows_dir, backend, batch_size,
+                                 json_layout)) as parsed:
+        for done, ((filepath, name, plan, n_rows, error, seconds), rows_path) in enumerate(parsed, 1):
+            if error is not None:
+                summary["files_failed"].append((filepath, error))
+                report("[{}/{}] {}: failed ({})".format(done, len(paths), name, error))
+                continue
+            if plan is None:
+                summary["files_unchanged"] += 1
+                report("[{}/{}] {}: unchanged".format(done, len(paths), name))
+                continue
+            rows_parsed += n_rows
+            elapsed = time.perf_counter() - start
+            report("[{}/{}] {}: {} rows parsed in {:.2f}s ({:.0f} rows/sec), {:.0f} rows/sec overall".format(
+                done, len(paths), name, n_rows, seconds, n_rows / seconds if seconds else 0,
+                rows_parsed / elapsed if elapsed else 0))
+            summary["rows_written"] += apply_ingest(db_path, plan, _read_rows(rows_path), table_name, batch_size,
+                                                    aggregates, build_indexes=True)
+            summary["files_loaded"] += 1
+            os.remove(rows_path)
+
+    summary["seconds"] = time.perf_counter() - start
+    return summary
@@ -0,0 +1,301 @@
+"""Persistent cache of parsed precipitation blocks
+
+This module contains an on-disk cache of the parsed 'Grid-ref=' blocks of precipitation files, used by the 'cache'
+input backend. The first time a file is read, its blocks are parsed by the vectorised parser and saved as .npy
+arrays. Later reads of the same content memory-map the arrays instead of parsing the text again, whatever the file
+is called or wherever it is.
+
+Each entry is a directory named by the SHA-256 hash of the file's content and PARSER_VERSION, holding:
+
+    header.json  The header values returned by get_header_values
+    cells.npy    An (n, 2) int32 array of the (Xref, Yref) of each block, in file order
+    values.npy   An (n, years, 12) array of the values of each block, int16 unless a value does not fit
+
+PARSER_VERSION is increased whenever the parser's output changes, so entries written by an older parser are never
+read. The total size of the cache is bounded: when an entry is added, the least recently used entries are removed
+until the cache fits. The location and size of the cache default to the PRECIP_CACHE_DIR and PRECIP_CACHE_MAX_MB
+environment variables, or ~/.cache/precip and 2048 MB.
+
+The module exports the following functions:
+
+    default_cache_dir   Returns the directory of the cache
+    cache_key           Returns the cache key of a precipitation file
+    load_cached         Returns the parsed blocks of a file from the cache, parsing and storing them on a miss
+    iter_cached_blocks  Returns the header of a file and an iterator over its cached blocks
+    evict               Removes the least recently used entries until the cache fits in a size
+    cache_info          Returns the number of entries in the cache and their total size
+    clear_cache         Removes every entry from the cache
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from precip.etl.arrays import iter_blocks, compact_values, MONTHS
+from precip.etl.extract import calculate_number_of_years
+from precip.etl.ledger import file_fingerprint
+
+# Increase this whenever the parsed output of a file changes, so that older entries are not used
+PARSER_VERSION = 1
+
+DEFAULT_MAX_MB = 2048
+_HEADER_FILE, _CELLS_FILE, _VALUES_FILE = "header.json", "cells.npy", "values.npy"
+_TEMP_PREFIX = ".tmp-"
+# Temporary directories older than this, in seconds, were left by a writer that did not finish
+_STALE_TEMP_SECONDS = 3600
+
+
+def default_cache_dir():
+    """Returns the directory of the cache: PRECIP_CACHE_DIR if it is set, otherwise ~/.cache/precip."""
+
+    return os.environ.get("PRECIP_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "precip")
+
+
+def _default_max_bytes():
+    """Returns the size limit of the cache: PRECIP_CACHE_MAX_MB if it is set, otherwise DEFAULT_MAX_MB."""
+
+    return int(float(os.environ.get("PRECIP_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024)
+
+
+def cache_key(filepath):
+    """Returns the cache key of a precipitation file.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    str
+        The SHA-256 hash of the file's content followed by the parser version.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    """
+
+    return "{}-v{}".format(file_fingerprint(filepath), PARSER_VERSION)
+
+
+def _entry_size(path):
+    """Returns the total size of the files in a cache entry."""
+
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _entries(cache_dir):
+    """Returns the (last used time, size, path) of every entry in the cache, least recently used first."""
+
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = [(entry.stat().st_mtime, _entry_size(entry.path), entry.path) for entry in os.scandir(cache_dir)
+               if entry.is_dir() and not entry.name.startswith(_TEMP_PREFIX)]
+    return sorted(entries)
+
+
+def _remove_stale_temps(cache_dir):
+    """Removes the temporary directories left in the cache by writers that did not finish, e.g. after a crash.
+
+    Returns the paths that were removed.
+    """
+
+    if not os.path.isdir(cache_dir):
+        return []
+    cutoff = time.time() - _STALE_TEMP_SECONDS
+    stale = [entry.path for entry in os.scandir(cache_dir)
+             if entry.is_dir() and entry.name.startswith(_TEMP_PREFIX) and entry.stat().st_mtime < cutoff]
+    for path in stale:
+        shutil.rmtree(path, ignore_errors=True)
+    return stale
+
+
+def _parse(filepath):
+    """Parses a file with the vectorised parser and returns its header, cells and values."""
+
+    header, blocks = iter_blocks(filepath, backend="mmap")
+    cells, matrices = [], []
+    for x, y, values in blocks:
+        cells.append((x, y))
+        matrices.append(values)
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+    values = np.stack(matrices) if matrices else np.empty((0, n_rows, MONTHS), dtype=np.int32)
+    return header, np.array(cells, dtype=np.int32).reshape(-1, 2), compact_values(values)
+
+
+def _store(cache_dir, key, header, cells, values):
+    """Writes an entry to a temporary directory and renames it into place, so readers never see a partial entry."""
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = tempfile.mkdtemp(prefix=_TEMP_PREFIX + key, dir=cache_dir)
+    try:
+        with open(os.path.join(temp_path, _HEADER_FILE), "w") as f:
+            json.dump(header, f)
+        np.save(os.path.join(temp_path, _CELLS_FILE), cells)
+        np.save(os.path.join(temp_path, _VALUES_FILE), values)
+        os.rename(temp_path, os.path.join(cache_dir, key))
+    except OSError:
+        # Another process stored the same entry first
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not os.path.isdir(os.path.join(cache_dir, key)):
+            raise
+
+
+def _read(path):
+    """Reads an entry, memory-mapping its values."""
+
+    with open(os.path.join(path, _HEADER_FILE)) as f:
+        header = json.load(f)
+    header["grid_size"] = tuple(header["grid_size"])
+    cells = np.load(os.path.join(path, _CELLS_FILE))
+    values = np.load(os.path.join(path, _VALUES_FILE), mmap_mode="r")
+    return header, cells, values
+
+
+def load_cached(filepath, cache_dir=None, max_bytes=None):
+    """Returns the parsed blocks of a precipitation file from the cache, parsing and storing them on a miss.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    cache_dir : str, optional
+        The directory of the cache. Defaults to default_cache_dir().
+    max_bytes : int, optional
+        The size limit of the cache, enforced when an entry is added. Defaults to PRECIP_CACHE_MAX_MB or
+        DEFAULT_MAX_MB.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    cells : numpy.ndarray
+        An (n, 2) int32 array of the (Xref, Yref) of each block, in file order.
+    values : numpy.ndarray
+        A read-only memory-mapped (n, years, 12) array of the values of each block.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be parsed.
+    """
+
+    cache_dir = cache_dir or default_cache_dir()
+    key = cache_key(filepath)
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        try:
+            cached = _read(path)
+        except (OSError, ValueError):
+            # A damaged entry is parsed again
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            # The modification time of the entry records when it was last used
+            os.utime(path)
+            return cached
+    _store(cache_dir, key, *_parse(filepath))
+    evict(cache_dir, max_bytes if max_bytes is not None else _default_max_bytes(), keep=path)
+    return _read(path)
+
+
+def iter_cached_blocks(filepath, cache_dir=None):
+    """Returns the header of a precipitation file and an iterator over its cached 'Grid-ref=' blocks.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    cache_dir : str, optional
+        The directory of the cache. Defaults to default_cache_dir().
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    blocks : iterator
+        An iterator of (x, y, values) tuples, as for arrays.iter_blocks, where values is a view of the cached
+        (years, 12) matrix for the grid cell.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be parsed.
+    """
+
+    header, cells, values = load_cached(filepath, cache_dir)
+    return header, ((x, y, matrix) for (x, y), matrix in zip(cells.tolist(), values))
+
+
+def evict(cache_dir=None, max_bytes=None, keep=None):
+    """Removes the least recently used entries until the cache fits in a size.
+
+    Temporary directories left by writers that did not finish are removed first. A temporary directory is only
+    treated as abandoned once it is an hour old, so entries being written by other processes are not removed.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        The directory of the cache. Defaults to default_cache_dir().
+    max_bytes : int, optional
+        The size limit of the cache. Defaults to PRECIP_CACHE_MAX_MB or DEFAULT_MAX_MB.
+    keep : str, optional
+        The path of an entry that is never removed, e.g. the entry that has just been added.
+
+    Returns
+    -------
+    list
+        The paths of the entries and temporary directories that were removed.
+    """
+
+    cache_dir = cache_dir or default_cache_dir()
+    max_bytes = max_bytes if max_bytes is not None else _default_max_bytes()
+    removed = _remove_stale_temps(cache_dir)
+    entries = _entries(cache_dir)
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        if keep is not None and os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append(path)
+    return removed
+
+
+def cache_info(cache_dir=None):
+    """Returns the number of entries in the cache and their total size.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        The directory of the cache. Defaults to default_cache_dir().
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'entries' and 'bytes'.
+    """
+
+    entries = _entries(cache_dir or default_cache_dir())
+    return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+
+def clear_cache(cache_dir=None):
+    """Removes every entry from the cache.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        The directory of the cache. Defaults to default_cache_dir().
+    """
+
+    for _, _, path in _entries(cache_dir or default_cache_dir()):
+        shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,234 @@
+"""Dense grid cube of precipitation data
+
+This module contains the PrecipCube class, which holds the values of a precipitation file as one dense
+(months, Y, X) NumPy array with the file's missing value as a sentinel. On the 720 x 360 CRU grid this is far
+smaller than the long Xref/Yref/Date/Value table and gives constant time access to a cell's series or a month's grid.
+
+The module exports the following:
+
+    PrecipCube      A dense (months, Y, X) array of precipitation values
+    transform_cube  Transforms a precipitation file directly to a PrecipCube
+"""
+
+import json
+import numpy as np
+from precip.etl.arrays import iter_blocks, arrays_to_df, compact_values, scale_values, MONTHS
+from precip.etl.extract import calculate_number_of_years
+
+
+class PrecipCube:
+    """A dense (months, Y, X) array of precipitation values.
+
+    Grid references are 1-based, as in the .pre file, so the value for Xref x and Yref y in month t is
+    values[t, y - 1, x - 1]. Cells and months with no data hold missing_value.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        An integer array with shape (months, Y, X).
+    start_date : int
+        The year of the first month in the cube. The first month is always January.
+    missing_value : int
+        The sentinel for missing values.
+    cells : numpy.ndarray
+        An (n, 2) integer array of the (Xref, Yref) cells that were in the file, in file order.
+    multiplier : float, optional
+        The 'Multi=' scale factor that converts the values to millimetres.
+    """
+
+    def __init__(self, values, start_date, missing_value, cells, multiplier=1.0):
+        self.values = values
+        self.start_date = start_date
+        self.missing_value = missing_value
+        self.cells = np.asarray(cells, dtype=np.int32).reshape(-1, 2)
+        self.multiplier = multiplier
+
+    @property
+    def dates(self):
+        """numpy.ndarray: The datetime64[M] month of each index of the time axis."""
+
+        return np.datetime64("{}-01".format(self.start_date), "M") + np.arange(self.values.shape[0])
+
+    def _time_index(self, date):
+        """Returns the index on the time axis of the month containing date."""
+
+        index = (date.year - self.start_date) * MONTHS + date.month - 1
+        if not 0 <= index < self.values.shape[0]:
+            raise IndexError("The date is outside the range of the cube.")
+        return index
+
+    def _grid_index(self, x, y):
+        """Returns the (row, column) of a cell in the grid."""
+
+        n_y, n_x = self.values.shape[1:]
+        if not (1 <= x <= n_x and 1 <= y <= n_y):
+            raise IndexError("The grid reference ({}, {}) is outside the grid of the cube.".format(x, y))
+        return y - 1, x - 1
+
+    def cell(self, x, y):
+        """Returns the monthly series for a grid cell.
+
+        Parameters
+        ----------
+        x : int
+            The Xref of the cell.
+        y : int
+            The Yref of the cell.
+
+        Returns
+        -------
+        numpy.ndarray
+            A view of the cell's values, one for each month.
+
+        Raises
+        ------
+        IndexError
+            If the cell is outside the grid.
+        """
+
+        return self.values[(slice(None),) + self._grid_index(x, y)]
+
+    def time_slice(self, date):
+        """Returns the grid of values for one month.
+
+        Parameters
+        ----------
+        date : datetime.date or datetime.datetime
+            Any date in the month.
+
+        Returns
+        -------
+        numpy.ndarray
+            A (Y, X) view of the values for the month.
+
+        Raises
+        ------
+        IndexError
+            If the month is not in the cube.
+        """
+
+        return self.values[self._time_index(date)]
+
+    def value(self, x, y, date):
+        """Returns the value for one cell and month, or None if it is missing.
+
+        Raises
+        ------
+        IndexError
+            If the cell is outside the grid or the month is not in the cube.
+        """
+
+        value = int(self.values[(self._time_index(date),) + self._grid_index(x, y)])
+        return None if value == self.missing_value else value
+
+    def to_arrays(self, units="raw"):
+        """Returns the cube as columnar arrays in the format of arrays.transform_arrays.
+
+        Only the cells that were in the file are included, in file order, so the arrays match transform_arrays.
+        Use units='mm' for float32 millimetres.
+        """
+
+        n_months = self.values.shape[0]
+        xs, ys = self.cells[:, 0], self.cells[:, 1]
+        values = self.values[:, ys - 1, xs - 1].T.ravel()
+        missing = values == self.missing_value
+        return {
+            "Xref": np.repeat(compact_values(xs), n_months),
+            "Yref": np.repeat(compact_values(ys), n_months),
+            "Date": np.tile(self.dates, len(self.cells)),
+            "Value": scale_values(values, missing, self.multiplier) if units == "mm" else values,
+            "Missing": missing
+        }
+
+    def to_df(self, units="raw"):
+        """Returns the cube as the long Xref, Yref, Date, Value DataFrame used by write_to_db."""
+
+        return arrays_to_df(self.to_arrays(units))
+
+    def save(self, path):
+        """Saves the cube to a .npy file, with its metadata in a .json file alongside it.
+
+        Parameters
+        ----------
+        path : str
+            The path of the .npy file. The metadata is written to the same path with a .json extension added.
+        """
+
+        np.save(path, self.values)
+        metadata = {"start_date": self.start_date, "missing_value": self.missing_value,
+                    "multiplier": self.multiplier, "cells": self.cells.tolist()}
+        with open(_metadata_path(path), "w") as f:
+            json.dump(metadata, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Loads a cube saved with save.
+
+        Parameters
+        ----------
+        path : str
+            The path of the .npy file.
+        mmap_mode : str or None, optional
+            The mmap mode passed to numpy.load. With the default 'r', the values are memory-mapped read-only and
+            only the parts that are accessed are read from disk. Use None to read the whole array into memory.
+
+        Returns
+        -------
+        PrecipCube
+            The loaded cube.
+        """
+
+        with open(_metadata_path(path)) as f:
+            metadata = json.load(f)
+        return cls(np.load(path, mmap_mode=mmap_mode), metadata["start_date"], metadata["missing_value"],
+                   metadata["cells"], metadata.get("multiplier", 1.0))
+
+
+def _metadata_path(path):
+    """Returns the path of the metadata file for a saved cube."""
+
+    return (path[:-4] if path.endswith(".npy") else path) + ".json"
+
+
+def transform_cube(filepath, backend="text"):
+    """Transforms a precipitation file directly to a PrecipCube.
+
+    Each block is parsed by the vectorised parser and written straight into the cube, without building the long
+    table. The cube is int16 unless a value or the 'Missing=' sentinel, which fills the cells with no block, does
+    not fit, in which case it is int32.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    backend : str, optional
+        The input backend, as for arrays.iter_blocks.
+
+    Returns
+    -------
+    PrecipCube
+        The cube, with the shape given by the 'Grid X,Y=' flag and the 'Years=' range.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be parsed or a grid reference is outside the grid.
+    """
+
+    header, blocks = iter_blocks(filepath, backend)
+    n_x, n_y = header["grid_size"]
+    n_months = calculate_number_of_years(header["start_date"], header["end_date"]) * MONTHS
+    missing_value = header["missing_value"]
+
+    values = np.full((n_months, n_y, n_x), missing_value, dtype=compact_values(np.array([missing_value])).dtype)
+    cells = []
+    for x, y, block in blocks:
+        if not (1 <= x <= n_x and 1 <= y <= n_y):
+            raise ValueError("Grid reference {}, {} is outside the {} x {} grid.".format(x, y, n_x, n_y))
+        if values.dtype == np.int16 and compact_values(block).dtype == np.int32:
+            values = values.astype(np.int32)
+        values[:, y - 1, x - 1] = block.ravel()
+        cells.append((x, y))
+    return PrecipCube(values, header["start_date"], missing_value, cells, header["multiplier"])
@@ -10,10 +10,25 @@ The module exports the following functions:
     get_missing_data_value     Gets the fill value from the file
     get_grid_ref_values        Gets the X and Y values from a grid-ref line
     get_data_values            Returns a list of rainfall values from a line
+    get_grid_size              Gets the number of X and Y grid cells from the file
+    get_multiplier             Gets the scale factor that converts stored values to millimetres
+    get_header_values          Gets the year range, fill value, grid size and scale factor from the file header
 """
 
 import re
 
+# The patterns are compiled once, when the module is imported, rather than on every call
+_WHITESPACE = re.compile(r"\s")
+# Case insensitive search for 'years=1991-2000' where the years can be any numbers
+_YEAR_RANGE = re.compile(r"(?i)Years=\d{4}-\d{4}")
+# Case insensitive search for 'Missing=-999' where 999 can be any digits
+_MISSING_VALUE = re.compile(r"(?i)Missing=.\d+")
+_GRID_REF = re.compile(r"\d+,\d+")
+# Case insensitive search for 'Grid X,Y= 720, 360' where the sizes can be any numbers
+_GRID_SIZE = re.compile(r"(?i)Grid X,Y=\s*(\d+),\s*(\d+)")
+# Case insensitive search for 'Multi=    0.1000' where the factor can be any decimal number
+_MULTIPLIER = re.compile(r"(?i)Multi=\s*([-+]?\d*\.?\d+)")
+
 
 def remove_whitespace(line):
     """Removes all whitespace characters from a string.
@@ -36,7 +51,7 @@ def remove_whitespace(line):
 
     if not isinstance(line, str):
         raise TypeError("The argument passed must be a string.")
-    return re.sub("\s", "", line)
+    return _WHITESPACE.sub("", line)
 
 
 def calculate_number_of_years(start_date, end_date):
@@ -87,9 +102,7 @@ def get_year_range(line):
         If the 'Years=' flag could not be found in the argument.
     """
 
-    # Case insensitive search for 'years=1991-2000' where the years can be any numbers
-    pattern = re.compile("(?i)Years=\d{4}-\d{4}")
-    match = pattern.search(line)
+    match = _YEAR_RANGE.search(line)
     if match:
         dates = match.group()[6:].split("-")  # removes unnecessary text
         start_date = int(dates[0])
@@ -117,9 +130,7 @@ def get_missing_data_value(line):
     If the 'Missing=' flag cannot be found, the missing data value is assumed to be -999.
     """
 
-    # Case insensitive search for 'Missing=-999' where 999 can be any digits
-    pattern = re.compile("(?i)Missing=.\d+")
-    match = pattern.search(line)
+    match = _MISSING_VALUE.search(line)
     if match:
         return int(match.group()[8:])
     else:
@@ -153,8 +164,7 @@ def get_grid_ref_values(line):
     except TypeError as exc:
         return None, None
     else:
-        pattern = re.compile("\d+,\d+")
-        match = pattern.search(no_whitespace)
+        match = _GRID_REF.search(no_whitespace)
         if match:
             split_by_comma = match.group().split(",")
             return int(split_by_comma[0]), int(split_by_comma[1])
@@ -192,3 +202,88 @@ def get_data_values(line, missing_value):
             if value == missing_value:
                 values[ix] = None
         return values
+
+
+def get_grid_size(line):
+    """Extracts the grid dimensions from the 'Grid X,Y=' flag in a precipitation file.
+
+    Parameters
+    ----------
+    line : str
+        The string containing the 'Grid X,Y=' flag.
+
+    Returns
+    -------
+    x : int
+        The number of grid cells in the X direction.
+    y : int
+        The number of grid cells in the Y direction.
+
+    Notes
+    -----
+    If the 'Grid X,Y=' flag cannot be found, the grid is assumed to be the 720 x 360 half degree CRU grid.
+    """
+
+    match = _GRID_SIZE.search(line)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    else:
+        print("Grid size could not be found. Assume grid to be 720 x 360.")
+        return 720, 360
+
+
+def get_multiplier(line):
+    """Extracts the scale factor in the 'Multi=' flag from a precipitation file.
+
+    Values in the file are integers. Multiplying them by the scale factor gives millimetres.
+
+    Parameters
+    ----------
+    line : str
+        The string containing the 'Multi=' flag.
+
+    Returns
+    -------
+    float
+        The scale factor.
+
+    Notes
+    -----
+    If the 'Multi=' flag cannot be found, the scale factor is assumed to be 1.
+    """
+
+    match = _MULTIPLIER.search(line)
+    if match:
+        return float(match.group(1))
+    else:
+        print("Scale factor could not be found. Assume value to be 1.")
+        return 1.0
+
+
+def get_header_values(header):
+    """Extracts the year range, missing data value, grid size and scale factor from a precipitation file header.
+
+    Parameters
+    ----------
+    header : str
+        The header text of the file, i.e. every line before the first 'Grid-ref=' flag.
+
+    Returns
+    -------
+    dict
+        A dictionary with the keys 'start_date', 'end_date', 'missing_value', 'grid_size' and 'multiplier'.
+
+    Raises
+    ------
+    ValueError
+        If the 'Years=' flag could not be found in the header.
+    """
+
+    start_date, end_date = get_year_range(header)
+    return {
+        "start_date": start_date,
+        "end_date": end_date,
+        "missing_value": get_missing_data_value(header),
+        "grid_size": get_grid_size(header),
+        "multiplier": get_multiplier(header)
+    }
@@ -0,0 +1,229 @@
+"""Random access to precipitation files through a block index
+
+This module contains functions to index the 'Grid-ref=' blocks of a .pre file and read individual grid cells
+without scanning the rest of the file. The index is written to a sidecar file next to the precipitation file
+(<file>.idx) and maps the (Xref, Yref) of each block to the byte offset of its 'Grid-ref=' line, its length in bytes
+and its number of data rows. Readers seek to the requested blocks and parse only those with get_data_values.
+
+The sidecar is a json file holding INDEX_VERSION, the size and modification time of the indexed file, its header
+values and the blocks in file order. An index whose file has since changed is rebuilt when it is loaded. If the
+sidecar cannot be written, e.g. in a read-only data directory, the index is kept in memory for the current read.
+
+The module exports the following functions:
+
+    index_path   Returns the default sidecar path of a precipitation file
+    build_index  Indexes the blocks of a precipitation file and writes the sidecar
+    load_index   Reads the sidecar of a precipitation file, building it if it is missing or out of date
+    read_cells   Returns the records of the requested grid cells
+    read_bbox    Returns the records of the grid cells inside a bounding box
+"""
+
+import json
+import os
+import tempfile
+from precip.etl.extract import calculate_number_of_years
+from precip.etl.readers import iter_block_spans
+from precip.etl.transform import check_filepath, parse_grid_ref, records_from_block
+
+# Increase this whenever the layout of the sidecar changes, so that older sidecars are rebuilt
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+
+
+def index_path(filepath):
+    """Returns the default sidecar path of a precipitation file, i.e. the filepath followed by INDEX_SUFFIX.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    str
+        The path of the sidecar.
+    """
+
+    return filepath + INDEX_SUFFIX
+
+
+def _file_state(filepath):
+    """Returns the size and modification time of a file, which identify the version of the file an index describes."""
+
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_index(filepath, path=None):
+    """Indexes the 'Grid-ref=' blocks of a precipitation file and writes the index to a sidecar file.
+
+    The index is returned even if the sidecar cannot be written, in which case it is built again by the next load.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    path : str, optional
+        The path of the sidecar. Defaults to index_path(filepath).
+
+    Returns
+    -------
+    dict
+        The index, with the keys 'header' (the header values returned by get_header_values), 'rows' (the number of
+        data rows in each block) and 'blocks' (a dictionary mapping each (Xref, Yref) to the (offset, length) of its
+        block in bytes).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file is compressed, or the header or a grid reference cannot be parsed.
+    """
+
+    check_filepath(filepath)
+    size, mtime_ns = _file_state(filepath)
+    header, spans = iter_block_spans(filepath)
+    blocks = [list(span) for span in spans]
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+
+    path = path or index_path(filepath)
+    temp_path = None
+    try:
+        # The sidecar is written to a unique temporary file and renamed into place, so that readers never load a
+        # partial index and concurrent builds do not write to the same file
+        fd, temp_path = tempfile.mkstemp(suffix=".tmp", prefix=os.path.basename(path) + ".",
+                                         dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": INDEX_VERSION, "size": size, "mtime_ns": mtime_ns, "header": header,
+                       "rows": n_rows, "blocks": blocks}, f)
+        os.replace(temp_path, path)
+    except OSError:
+        if temp_path is not None and os.path.exists(temp_path):
+            os.remove(temp_path)
+    return _index_from_json(header, n_rows, blocks)
+
+
+def _index_from_json(header, n_rows, blocks):
+    """Returns the index described by the contents of a sidecar."""
+
+    header = dict(header, grid_size=tuple(header["grid_size"]))
+    return {"header": header, "rows": n_rows, "blocks": {(x, y): (offset, length) for x, y, offset, length in blocks}}
+
+
+def load_index(filepath, path=None, build=True):
+    """Reads the block index of a precipitation file from its sidecar.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    path : str, optional
+        The path of the sidecar. Defaults to index_path(filepath).
+    build : bool, optional
+        If True, the index is built and written if the sidecar is missing, unreadable or describes an older version
+        of the file. If False, a ValueError is raised instead.
+
+    Returns
+    -------
+    dict
+        The index, as returned by build_index.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If build is False and there is no up to date sidecar, or the file cannot be indexed.
+    """
+
+    check_filepath(filepath)
+    path = path or index_path(filepath)
+    try:
+        with open(path) as f:
+            sidecar = json.load(f)
+        if sidecar["version"] == INDEX_VERSION \
+                and (sidecar["size"], sidecar["mtime_ns"]) == _file_state(filepath):
+            return _index_from_json(sidecar["header"], sidecar["rows"], sidecar["blocks"])
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    if not build:
+        raise ValueError("The precipitation file has no up to date index.")
+    return build_index(filepath, path)
+
+
+def _read_blocks(filepath, index, cells):
+    """Seeks to the block of each cell in file order and returns the records parsed from its rows."""
+
+    header = index["header"]
+    spans = sorted(index["blocks"][cell] + cell for cell in cells)
+    records = []
+    with open(filepath, "rb") as f:
+        for offset, length, x, y in spans:
+            f.seek(offset)
+            lines = f.read(length).splitlines()
+            if len(lines) != index["rows"] + 1 or parse_grid_ref(lines[0].decode("ascii", errors="replace")) != (x, y):
+                raise ValueError("The index does not match the precipitation file.")
+            records.extend(records_from_block(x, y, lines[1:], header["start_date"], header["missing_value"]))
+    return records
+
+
+def read_cells(filepath, cells, path=None):
+    """Returns the records of the requested grid cells, reading only their blocks from the file.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    cells : iterable
+        The (Xref, Yref) of each grid cell to read. Cells that are not in the file are ignored.
+    path : str, optional
+        The path of the sidecar, as for load_index. The index is built on the first read.
+
+    Returns
+    -------
+    list
+        A list of dictionaries in the same format as transform_data, in the order the cells appear in the file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be indexed, a line of values cannot be parsed or the index does not match the file.
+    """
+
+    index = load_index(filepath, path)
+    return _read_blocks(filepath, index, {tuple(cell) for cell in cells} & index["blocks"].keys())
+
+
+def read_bbox(filepath, x_min, x_max, y_min, y_max, path=None):
+    """Returns the records of the grid cells inside a bounding box, reading only their blocks from the file.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    x_min, x_max : int
+        The inclusive range of Xref.
+    y_min, y_max : int
+        The inclusive range of Yref.
+    path : str, optional
+        The path of the sidecar, as for load_index. The index is built on the first read.
+
+    Returns
+    -------
+    list
+        A list of dictionaries in the same format as transform_data, in the order the cells appear in the file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be indexed, a line of values cannot be parsed or the index does not match the file.
+    """
+
+    index = load_index(filepath, path)
+    cells = [(x, y) for x, y in index["blocks"] if x_min <= x <= x_max and y_min <= y <= y_max]
+    return _read_blocks(filepath, index, cells)
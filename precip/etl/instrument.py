@@ -0,0 +1,214 @@
+"""Per-stage timing and memory instrumentation
+
+This module contains the Instrumentation class, which records the wall time, CPU time, records processed and peak
+memory of each stage of a run, and logs progress in blocks per second while an iterator of records is consumed.
+Stages are logged as json lines to the 'precip.metrics' logger and can be written together as a json report.
+
+Timing a stage costs two clock reads, so instrumentation can be left on in production. cProfile and tracemalloc
+are opt-in, as they slow the run down. For example, transform_data with progress logging is:
+
+    metrics = Instrumentation()
+    with metrics.stage("transform_data") as stage:
+        records = list(metrics.track(iter_records(filepath), stage, block_size=months))
+
+The module exports the following:
+
+    peak_rss_mb      Returns the peak resident set size of the process in MB
+    Instrumentation  Records metrics for each stage of a run
+"""
+
+import cProfile
+import json
+import logging
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    # The resource module is only available on Unix, so the peak RSS is not reported on Windows
+    resource = None
+
+logger = logging.getLogger("precip.metrics")
+
+# The number of records between checks of whether a progress message is due
+_PROGRESS_CHECK = 10000
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of the current process in MB.
+
+    Returns
+    -------
+    float or None
+        The high-water mark of the process's memory, or None if it cannot be measured on this platform.
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class Instrumentation:
+    """Records the wall time, CPU time, records processed and peak memory of each stage of a run.
+
+    Parameters
+    ----------
+    profile : bool, optional
+        If True, every stage is run under cProfile. The statistics are written with write_profile.
+    trace_memory : bool, optional
+        If True, tracemalloc is started and the peak Python memory allocated during each stage is recorded.
+        Otherwise only the process's peak RSS is recorded, which never decreases between stages.
+    progress_interval : float, optional
+        The minimum number of seconds between progress messages from track.
+    """
+
+    def __init__(self, profile=False, trace_memory=False, progress_interval=1.0):
+        self.stages = []
+        self.progress_interval = progress_interval
+        self.trace_memory = trace_memory
+        self.profiler = cProfile.Profile() if profile else None
+        self.created = datetime.now()
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """Records the metrics of the code run inside the context.
+
+        Parameters
+        ----------
+        name : str
+            The name of the stage.
+
+        Yields
+        ------
+        dict
+            The metrics of the stage. Set 'records' to the number of records the stage processed, or use track.
+        """
+
+        metrics = {"name": name, "records": 0}
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        if self.profiler is not None:
+            self.profiler.enable()
+        start_cpu, start = time.process_time(), time.perf_counter()
+        try:
+            yield metrics
+        finally:
+            wall_seconds = time.perf_counter() - start
+            cpu_seconds = time.process_time() - start_cpu
+            if self.profiler is not None:
+                self.profiler.disable()
+            metrics.update(wall_seconds=wall_seconds, cpu_seconds=cpu_seconds,
+                           records_per_sec=metrics["records"] / wall_seconds if wall_seconds else None,
+                           peak_rss_mb=peak_rss_mb())
+            if self.trace_memory:
+                metrics["peak_traced_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+            self.stages.append(metrics)
+            logger.info(json.dumps(metrics))
+
+    def track(self, iterable, metrics, block_size=None, item_size=1):
+        """Yields the items of an iterable, counting them in a stage's records and logging progress.
+
+        Parameters
+        ----------
+        iterable : iterable
+            The records consumed by the stage.
+        metrics : dict
+            The metrics yielded by stage.
+        block_size : int, optional
+            The number of records in each 'Grid-ref=' block. If given, progress is logged in blocks per second as
+            well as records per second.
+        item_size : int, optional
+            The number of records in each item, e.g. block_size when the iterable yields whole blocks.
+
+        Yields
+        ------
+        object
+            Each item of the iterable.
+        """
+
+        start = last_report = time.perf_counter()
+        first, items = metrics["records"], 0
+        check = max(1, _PROGRESS_CHECK // item_size)
+        try:
+            for items, item in enumerate(iterable, 1):
+                yield item
+                if items % check == 0:
+                    now = time.perf_counter()
+                    if now - last_report >= self.progress_interval:
+                        last_report = now
+                        self._log_progress(metrics["name"], items * item_size, now - start, block_size)
+        finally:
+            metrics["records"] = first + items * item_size
+
+    @staticmethod
+    def _log_progress(name, records, seconds, block_size):
+        """Logs the progress of a stage."""
+
+        message = "{}: {} records ({:.0f} records/sec)".format(name, records, records / seconds)
+        if block_size:
+            blocks = records // block_size
+            message += ", {} blocks ({:.0f} blocks/sec)".format(blocks, blocks / seconds)
+        logger.info(message)
+
+    def report(self):
+        """Returns the metrics of every stage.
+
+        Returns
+        -------
+        dict
+            A report with the keys 'created', 'stages' (the metrics of each stage in the order they finished) and
+            'wall_seconds' and 'cpu_seconds' (the totals of the stages).
+        """
+
+        return {
+            "created": self.created.isoformat(" ", "seconds"),
+            "stages": self.stages,
+            "wall_seconds": sum(stage["wall_seconds"] for stage in self.stages),
+            "cpu_seconds": sum(stage["cpu_seconds"] for stage in self.stages)
+        }
+
+    def write_report(self, path):
+        """Writes the report to a json file.
+
+        Parameters
+        ----------
+        path : str
+            The path of the json file.
+        """
+
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_profile(self, path):
+        """Writes the cProfile statistics of every stage to a file that can be read with pstats.
+
+        Parameters
+        ----------
+        path : str
+            The path of the statistics file.
+
+        Raises
+        ------
+        ValueError
+            If the instrumentation was not created with profile=True.
+        """
+
+        if self.profiler is None:
+            raise ValueError("Profiling was not enabled.")
+        self.profiler.dump_stats(path)
+
+    def close(self):
+        """Stops tracemalloc if it was started for this run."""
+
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
@@ -0,0 +1,387 @@
+"""Incremental ingest of precipitation files
+
+This module contains an ingest ledger kept in the same sqlite database as the precipitation table. The ledger
+records the content hash, 'Years=' range and 'Multi=' scale factor of every source file that has been loaded, and
+a hash of every 'Grid-ref=' block it contained. Loading a file again is skipped if the file is unchanged, otherwise
+only the blocks whose content changed are replaced.
+
+The module exports the following functions:
+
+    file_fingerprint    Returns the content hash of a file
+    block_fingerprints  Returns the content hash of every 'Grid-ref=' block in a file
+    create_ledger       Creates the ledger tables if they do not exist
+    changed_rows        Yields the rows of the changed cells of a file
+    plan_ingest         Compares a file with the ledger and returns the cells that have changed
+    apply_ingest        Replaces the rows of the changed cells of a file and updates the ledger
+    ingest_file         Loads a precipitation file to the database, skipping cells that have not changed
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from precip.etl.aggregates import has_aggregate_tables, delete_cell_aggregates
+from precip.etl.load_to_db import _create_connection, load_to_sqlite, DEFAULT_BATCH_SIZE
+from precip.etl.readers import check_backend, iter_mmap_blocks, split_rows
+from precip.etl.schema import PRECIP_TABLE, _quote, create_precip_table
+from precip.etl.transform import check_filepath, _index_rows_from_raw_block, _index_rows_from_values
+
+FILES_TABLE = "ingest_files"
+CELLS_TABLE = "ingest_cells"
+
+_READ_SIZE = 1 << 20
+
+# The columns of the files table that ledgers created by earlier versions may not have, with their definitions
+_ADDED_COLUMNS = (("Multi", "REAL NOT NULL DEFAULT 1"), ("Parser", "TEXT NOT NULL DEFAULT 'reference'"))
+
+
+def file_fingerprint(filepath):
+    """Returns the SHA-256 hash of the content of a file.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the file.
+
+    Returns
+    -------
+    str
+        The hash as a hexadecimal string.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    """
+
+    check_filepath(filepath)
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(_READ_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _parser(backend):
+    """Returns the name of the parser whose values a backend loads: the cache follows the vectorised parser."""
+
+    return "vectorised" if backend == "cache" else "reference"
+
+
+def _block_hash(header_key, rows):
+    """Returns the hexadecimal hash of the data rows of one block, seeded with the header values that decode them."""
+
+    digest = hashlib.blake2b(header_key, digest_size=16)
+    digest.update(rows)
+    return digest.hexdigest()
+
+
+def block_fingerprints(filepath, backend="mmap"):
+    """Returns the content hash of the data rows of every 'Grid-ref=' block in a precipitation file.
+
+    The 'Years=', 'Missing=' and 'Multi=' values of the header are included in each hash, as they change the rows
+    that are loaded from the same data rows. So is the parser used by the backend, as the 'cache' backend follows
+    the vectorised parser, which splits values with no space between them differently.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    backend : str, optional
+        The input backend the rows are loaded with, as for ingest_file.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    fingerprints : dict
+        A dictionary mapping each (Xref, Yref) cell to the hexadecimal hash of its block.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be parsed.
+    """
+
+    header, blocks = iter_mmap_blocks(filepath)
+    header_key = "{start_date}-{end_date}|{missing_value}|{multiplier}|{parser}".format(
+        parser=_parser(backend), **header).encode("ascii")
+    return header, {(x, y): _block_hash(header_key, rows) for x, y, rows in blocks}
+
+
+def create_ledger(connection):
+    """Creates the ledger tables if they do not exist, adding any columns a ledger from an earlier version lacks.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    """
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS {} ("
+        "Source TEXT PRIMARY KEY, "
+        "FileHash TEXT NOT NULL, "
+        "StartYear INTEGER NOT NULL, "
+        "EndYear INTEGER NOT NULL, "
+        "Multi REAL NOT NULL, "
+        "Cells INTEGER NOT NULL, "
+        "LoadedAt TEXT NOT NULL, "
+        "Parser TEXT NOT NULL DEFAULT 'reference')".format(FILES_TABLE)
+    )
+    # Columns added since the first version of the ledger are added to ledgers created before them
+    existing = {row[1] for row in connection.execute("PRAGMA table_info({})".format(FILES_TABLE))}
+    for column, definition in _ADDED_COLUMNS:
+        if column not in existing:
+            connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(FILES_TABLE, column, definition))
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS {} ("
+        "Source TEXT NOT NULL, "
+        "Xref INTEGER NOT NULL, "
+        "Yref INTEGER NOT NULL, "
+        "BlockHash TEXT NOT NULL, "
+        "PRIMARY KEY (Source, Xref, Yref)) WITHOUT ROWID".format(CELLS_TABLE)
+    )
+
+
+def changed_rows(filepath, changed, backend="mmap"):
+    """Yields the rows of the blocks in a precipitation file whose cell has changed.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    changed : set
+        The (Xref, Yref) of the cells to read, e.g. plan['changed'] from plan_ingest.
+    backend : str, optional
+        The input backend, as for ingest_file. It must be the backend the plan was made with, so that the rows
+        are read by the parser the block hashes were computed for.
+
+    Yields
+    ------
+    tuple
+        The (Xref, Yref, Date, Value) rows of the changed cells, with Date as an integer month index.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file cannot be parsed.
+    """
+
+    if backend == "cache":
+        from precip.etl.cache import iter_cached_blocks
+        header, blocks = iter_cached_blocks(filepath)
+        for x, y, values in blocks:
+            if (x, y) in changed:
+                yield from _index_rows_from_values(x, y, values.tolist(), header["start_date"],
+                                                   header["missing_value"])
+        return
+    header, blocks = iter_mmap_blocks(filepath)
+    for x, y, rows in blocks:
+        if (x, y) in changed:
+            yield from _index_rows_from_raw_block(x, y, split_rows(rows), header["start_date"],
+                                                  header["missing_value"])
+
+
+def plan_ingest(connection, filepath, source=None, backend="mmap"):
+    """Compares a precipitation file with the ledger and returns the cells that have changed since its last load.
+
+    The file is unchanged if its hash and parser match the last load of the same source. Otherwise each block is
+    hashed and compared with the hashes recorded for the source. Only the ledger is read, so plans can be made in
+    other processes while the database is written.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to a database with the ledger tables, e.g. from create_ledger.
+    filepath : str
+        The path of the precipitation file.
+    source : str, optional
+        The name the file is recorded under in the ledger. Defaults to the file name.
+    backend : str, optional
+        The input backend the rows are loaded with, as for ingest_file.
+
+    Returns
+    -------
+    dict or None
+        None if the file is unchanged. Otherwise a plan with the keys 'source', 'file_hash', 'parser', 'header',
+        'fingerprints', 'changed', 'removed' and 'loaded' (sets of the (Xref, Yref) cells that changed, are no
+        longer in the file and were recorded for the source) and 'previous' (the (FileHash, StartYear, EndYear,
+        Parser) of the last load, or None).
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the backend is not recognised or the file cannot be parsed.
+    """
+
+    check_backend(backend)
+    source = source or os.path.basename(filepath)
+    file_hash = file_fingerprint(filepath)
+    previous = connection.execute("SELECT FileHash, StartYear, EndYear, Parser FROM {} WHERE Source = ?".format(
+        FILES_TABLE), (source,)).fetchone()
+    if previous and previous[0] == file_hash and previous[3] == _parser(backend):
+        return None
+
+    header, fingerprints = block_fingerprints(filepath, backend)
+    loaded = dict(((x, y), block_hash) for x, y, block_hash in connection.execute(
+        "SELECT Xref, Yref, BlockHash FROM {} WHERE Source = ?".format(CELLS_TABLE), (source,)))
+    changed = {cell for cell, block_hash in fingerprints.items() if loaded.get(cell) != block_hash}
+    return {"source": source, "file_hash": file_hash, "parser": _parser(backend), "header": header,
+            "fingerprints": fingerprints, "changed": changed, "removed": loaded.keys() - fingerprints.keys(),
+            "loaded": set(loaded), "previous": previous}
+
+
+def apply_ingest(db_path, plan, rows, table_name=PRECIP_TABLE, batch_size=DEFAULT_BATCH_SIZE, aggregates=False,
+                 build_indexes=False):
+    """Replaces the rows of the changed and removed cells of a plan and records the file in the ledger.
+
+    The rows of changed and removed cells are deleted within the years of the source's previous load, so that rows
+    loaded from other sources for the same cells are kept. The rows are then loaded with load_to_sqlite and the
+    ledger is updated. If a load is interrupted, the ledger is not updated and the changed cells are loaded again
+    by the next run. If the table has aggregate tables, the deleted rows are subtracted from them and the changed
+    cells are added back as they are loaded.
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the sqlite database, with the ledger and precipitation tables.
+    plan : dict
+        The plan returned by plan_ingest.
+    rows : iterable
+        The (Xref, Yref, Date, Value) rows of the changed cells, with Date as a month index, e.g. from changed_rows.
+    table_name : str, optional
+        The name of the precipitation table.
+    batch_size : int, optional
+        The number of rows inserted in each transaction.
+    aggregates : bool, optional
+        If True, the aggregate tables are created if they do not exist and updated as the cells are loaded.
+    build_indexes : bool, optional
+        Passed to load_to_sqlite. If True and the table does not exist yet, its Date index is built after the rows
+        are loaded.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the database connection could not be made.
+    """
+
+    source, previous = plan["source"], plan["previous"]
+    connection = _create_connection(db_path)
+    try:
+        # Clear the old rows first so that months no longer covered by a changed block do not remain. Only the months
+        # of this source's previous load are cleared, as other sources may cover other years of the same cells.
+        deleted = [cell for cell in plan["changed"] | plan["removed"] if cell in plan["loaded"]]
+        if deleted and previous:
+            first_month, last_month = previous[1] * 12, previous[2] * 12 + 11
+            ranges = [(x, y, first_month, last_month) for x, y in deleted]
+            with connection:
+                # The aggregates are taken from the rows, so they are updated before the rows are deleted
+                if has_aggregate_tables(connection, table_name):
+                    delete_cell_aggregates(connection, ranges, table_name)
+                connection.executemany(
+                    "DELETE FROM {} WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ?".format(_quote(table_name)),
+                    ranges)
+    finally:
+        connection.close()
+
+    rows_written = load_to_sqlite(db_path, table_name, rows, batch_size=batch_size, build_indexes=build_indexes,
+                                  managed_schema=True, without_rowid=True, month_index=True, aggregates=aggregates)
+    if rows_written is None:
+        raise FileNotFoundError("Database connection could not be made.")
+
+    header, fingerprints = plan["header"], plan["fingerprints"]
+    connection = _create_connection(db_path)
+    try:
+        with connection:
+            connection.executemany("DELETE FROM {} WHERE Source = ? AND Xref = ? AND Yref = ?".format(CELLS_TABLE),
+                                   [(source, x, y) for x, y in plan["removed"]])
+            connection.executemany("INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)".format(CELLS_TABLE),
+                                   [(source, x, y, fingerprints[(x, y)]) for x, y in plan["changed"]])
+            connection.execute("INSERT OR REPLACE INTO {} (Source, FileHash, StartYear, EndYear, Multi, Cells, "
+                               "LoadedAt, Parser) VALUES (?, ?, ?, ?, ?, ?, ?, ?)".format(FILES_TABLE),
+                               (source, plan["file_hash"], header["start_date"], header["end_date"],
+                                header["multiplier"], len(fingerprints), datetime.now().isoformat(" ", "seconds"),
+                                plan["parser"]))
+    finally:
+        connection.close()
+    return rows_written
+
+
+def ingest_file(db_path, filepath, table_name=PRECIP_TABLE, source=None, batch_size=DEFAULT_BATCH_SIZE,
+                aggregates=False, backend="mmap", progress=None):
+    """Loads a precipitation file to the managed precipitation table, skipping cells that have not changed.
+
+    The file is compared with the ledger by plan_ingest. If it has changed, the rows of its changed cells are read
+    by changed_rows and loaded by apply_ingest.
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the sqlite database. If the path does not exist, a new database will be created.
+    filepath : str
+        The path of the precipitation file to be loaded.
+    table_name : str, optional
+        The name of the precipitation table.
+    source : str, optional
+        The name the file is recorded under in the ledger. Defaults to the file name, so that an updated copy of a
+        file replaces the cells loaded from the previous copy.
+    batch_size : int, optional
+        The number of rows inserted in each transaction.
+    aggregates : bool, optional
+        If True, the aggregate tables of etl.aggregates are created if they do not exist and updated as the cells
+        are loaded.
+    backend : str, optional
+        'cache' loads the values of the changed cells from the persistent cache in etl.cache, which follows the
+        vectorised parser. Otherwise they are parsed from the file by the reference per-line parser. Loading a
+        source with a different parser than its last load reloads every cell.
+    progress : callable, optional
+        Called with the iterator of changed rows before they are loaded and returns an iterator of the same rows,
+        e.g. to log progress with Instrumentation.track.
+
+    Returns
+    -------
+    dict
+        A summary with the keys 'source', 'status' ('unchanged' or 'loaded'), 'cells_changed', 'cells_removed'
+        and 'rows_written'.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found or the database connection could not be made.
+    ValueError
+        If the backend is not recognised or the file cannot be parsed.
+    """
+
+    check_backend(backend)
+    check_filepath(filepath)
+    source = source or os.path.basename(filepath)
+    summary = {"source": source, "status": "unchanged", "cells_changed": 0, "cells_removed": 0, "rows_written": 0}
+
+    connection = _create_connection(db_path)
+    try:
+        create_ledger(connection)
+        create_precip_table(connection, table_name, without_rowid=True)
+        connection.commit()
+        plan = plan_ingest(connection, filepath, source, backend)
+    finally:
+        connection.close()
+    if plan is None:
+        return summary
+
+    rows = changed_rows(filepath, plan["changed"], backend)
+    rows_written = apply_ingest(db_path, plan, progress(rows) if progress else rows, table_name, batch_size,
+                                aggregates)
+    summary.update(status="loaded", cells_changed=len(plan["changed"]), cells_removed=len(plan["removed"]),
+                   rows_written=rows_written)
+    return summary
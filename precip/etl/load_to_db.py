@@ -1,16 +1,54 @@
 """Load precipitation data to database
 
 This module contains functions to load precipitation information to a sqlite database and a zipped json file.
+NumPy and pandas are only imported by the functions that read DataFrames or write parquet, so that loading rows with
+load_to_sqlite and export_json does not import them.
 
 The module exports the following functions:
 
     _create_connection  Establishes a connection to a sqlite database
+    _iter_dataframes    Converts each batch of records in an iterator to a pandas DataFrame
+    load_to_sqlite      Bulk loads rows of precipitation data to a sqlite table in batched transactions
     write_to_db         Writes the precipitation data to the sqlite database
     dump_to_json        Writes the precipitation data to a zipped json file
+    export_json         Streams rows of precipitation data to a compact, compressed json or ndjson file
+    write_to_parquet    Writes blocks of precipitation data to a columnar parquet file
 """
 
+import bz2
+import gzip
+import lzma
+import os
 import sqlite3
-import pandas as pd
+import zipfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from functools import lru_cache
+from itertools import chain, groupby, islice
+from operator import itemgetter
+from precip.etl.aggregates import create_aggregate_tables, has_aggregate_tables, cell_ranges, aggregate_ranges, \
+    aggregate_rows, apply_aggregates
+from precip.etl.schema import _quote, create_precip_table, create_date_index, to_month_index, from_month_index
+
+DEFAULT_BATCH_SIZE = 100000
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL")
+
+# Column types for the precipitation table. Columns not listed here are created without a declared type.
+COLUMN_TYPES = {"Xref": "INTEGER", "Yref": "INTEGER", "Date": "TIMESTAMP", "Value": "INTEGER"}
+
+# Store dates as text in the same format pandas used when writing with DataFrame.to_sql
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+JSON_LAYOUTS = ("records", "cells")
+JSON_DATE_FORMATS = ("iso", "epoch")
+COMPRESSIONS = ("zip", "gzip", "bz2", "xz", None)
+
+# The number of json objects joined into one string before it is written to the archive
+_JSON_CHUNK_SIZE = 10000
+
+PARQUET_PARTITIONS = ("xref", "year")
 
 
 def _create_connection(db_path):
@@ -39,12 +77,82 @@ def _create_connection(db_path):
     return connection
 
 
-def write_to_db(db_path, table_name, data):
-    """Writes the precipitation data to a sqlite database.
+def _iter_dataframes(batches):
+    """Converts each batch of records in an iterator to a pandas DataFrame.
 
-    This function writes the information in the data parameter to a sqlite database, based on the db_path parameter.
-    The data is written to a new table, defined in the table_name parameter. If the table already exists, the data
-    is appended to the table.
+    Parameters
+    ----------
+    batches : iterable
+        An iterable of pandas DataFrames or lists of dictionaries, such as the output of iter_batches.
+
+    Yields
+    ------
+    pandas.DataFrame
+        The DataFrame for each non-empty batch.
+    """
+
+    import pandas as pd
+
+    for batch in batches:
+        if isinstance(batch, pd.DataFrame):
+            yield batch
+        elif batch:
+            yield pd.DataFrame(data=batch, columns=list(batch[0].keys()))
+
+
+@lru_cache(maxsize=4096)
+def _date_text(date):
+    """Formats a datetime as sqlite text. A file only holds a few hundred distinct months, so the text is cached."""
+
+    return date.strftime(DATE_FORMAT)
+
+
+def _date_text_rows(rows):
+    """Replaces the datetimes in each row with their text in DATE_FORMAT.
+
+    The columns holding datetimes are found from the first row, and rows without datetimes are passed through as
+    they are.
+    """
+
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return
+    positions = [i for i, value in enumerate(first) if isinstance(value, datetime)]
+    if not positions:
+        yield first
+        yield from rows
+        return
+    for row in chain([first], rows):
+        row = list(row)
+        for i in positions:
+            if isinstance(row[i], datetime):
+                row[i] = _date_text(row[i])
+        yield row
+
+
+def _month_index_rows(rows):
+    """Replaces the Date in each (Xref, Yref, Date, Value) row with its integer month index."""
+
+    for x, y, date, value in rows:
+        yield x, y, to_month_index(date), value
+
+
+def load_to_sqlite(db_path, table_name, rows, columns=("Xref", "Yref", "Date", "Value"),
+                   batch_size=DEFAULT_BATCH_SIZE, synchronous="NORMAL", cache_size=-64000, build_indexes=False,
+                   managed_schema=False, without_rowid=False, month_index=False, aggregates=False):
+    """Bulk loads rows of precipitation data to a sqlite table.
+
+    The rows are inserted with executemany in explicit transactions of batch_size rows, with the database in WAL
+    journal mode and the given synchronous and cache_size pragmas. The table is created if it does not exist and the
+    rows are appended to it.
+
+    With managed_schema, the table is created by schema.create_precip_table with integer columns and an (Xref, Yref,
+    Date) primary key. Dates are stored as integer month indexes and a row for a cell and month that is already in
+    the table replaces it.
+
+    With aggregates, the annual and monthly aggregate tables of etl.aggregates are updated from each batch in the
+    same transaction as its rows. They are also kept up to date whenever they already exist for the table.
 
     Parameters
     ----------
@@ -52,25 +160,183 @@ def write_to_db(db_path, table_name, data):
         The path of the sqlite database. If the path does not exist, a new database will be created.
     table_name : str
         The name of the table to write the data to.
-    data : pandas.DataFrame
-        A pandas dataframe containing the data to be written to the table.
+    rows : iterable
+        An iterable of tuples in the order of the columns parameter, e.g. from transform.iter_rows.
+    columns : sequence of str, optional
+        The column names of the table.
+    batch_size : int, optional
+        The number of rows inserted in each transaction.
+    synchronous : str, optional
+        The sqlite synchronous pragma: 'OFF', 'NORMAL' or 'FULL'. 'OFF' is fastest but the database can be corrupted
+        if the machine loses power during the load.
+    cache_size : int, optional
+        The sqlite cache_size pragma. Negative values are in KiB, positive values in pages.
+    build_indexes : bool, optional
+        If True, the indexes are built once all of the rows have been loaded, which is faster than maintaining them
+        during the load. This is an (Xref, Yref, Date) index, or the Date index with managed_schema.
+    managed_schema : bool, optional
+        If True, the rows must be in the order Xref, Yref, Date, Value and are loaded to the managed schema.
+    without_rowid : bool, optional
+        If True, the managed table is created WITHOUT ROWID.
+    month_index : bool, optional
+        If True, the Date of each row for the managed schema is already an integer month index (e.g. from
+        iter_rows(month_index=True)) and is loaded as it is, rather than converted from a date.
+    aggregates : bool, optional
+        If True, the aggregate tables are created if they do not exist and updated as the rows are loaded. The
+        columns must be Xref, Yref, Date and Value.
 
     Returns
     -------
-    boolean
-        True if the data is written successfully. Otherwise, False.
+    int or None
+        The number of rows written, or None if the database connection could not be made.
+
+    Raises
+    ------
+    ValueError
+        If batch_size is not a positive integer, synchronous is not a valid mode or aggregates are requested for
+        columns other than Xref, Yref, Date and Value.
     """
 
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("The batch size must be a positive integer.")
+    if str(synchronous).upper() not in SYNCHRONOUS_MODES:
+        raise ValueError("The synchronous mode must be one of: {}.".format(", ".join(SYNCHRONOUS_MODES)))
+    if aggregates and not managed_schema and tuple(columns) != ("Xref", "Yref", "Date", "Value"):
+        raise ValueError("Aggregates can only be computed for the columns Xref, Yref, Date and Value.")
+
     try:
         connection = _create_connection(db_path)
     except FileNotFoundError as exc:
         print(exc)
-        return False
+        return None
+
+    # Transactions are opened and committed explicitly rather than by the sqlite3 module
+    connection.isolation_level = None
+    table = _quote(table_name)
+    if managed_schema:
+        insert = "INSERT OR REPLACE INTO {} VALUES (?, ?, ?, ?)".format(table)
+        if not month_index:
+            rows = _month_index_rows(rows)
     else:
-        data.to_sql(table_name, connection, if_exists="append", index=False)
+        insert = "INSERT INTO {} VALUES ({})".format(table, ", ".join("?" * len(columns)))
+        rows = _date_text_rows(rows)
+
+    rows_written = 0
+    rows = iter(rows)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous={}".format(str(synchronous).upper()))
+        connection.execute("PRAGMA cache_size={}".format(int(cache_size)))
+        if managed_schema:
+            create_precip_table(connection, table_name, without_rowid=without_rowid, date_index=not build_indexes)
+        else:
+            column_definitions = ", ".join("{} {}".format(_quote(column), COLUMN_TYPES.get(column, "")).strip()
+                                           for column in columns)
+            connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, column_definitions))
+        if aggregates:
+            create_aggregate_tables(connection, table_name)
+        else:
+            aggregates = has_aggregate_tables(connection, table_name)
+
+        batch = list(islice(rows, batch_size))
+        while batch:
+            connection.execute("BEGIN")
+            try:
+                if aggregates and managed_schema:
+                    # Subtract the values the batch replaces, then add the batch's cells and months back
+                    ranges = cell_ranges(batch)
+                    aggregate_ranges(connection, table_name, ranges, -1)
+                connection.executemany(insert, batch)
+                if aggregates and managed_schema:
+                    aggregate_ranges(connection, table_name, ranges)
+                elif aggregates:
+                    apply_aggregates(connection, table_name, *aggregate_rows(batch))
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            rows_written += len(batch)
+            batch = list(islice(rows, batch_size))
+
+        if build_indexes and managed_schema:
+            create_date_index(connection, table_name)
+        elif build_indexes:
+            index = _quote("idx_{}_xref_yref_date".format(table_name))
+            connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} (Xref, Yref, Date)".format(index, table))
+    finally:
         connection.close()
+    return rows_written
+
+
+def _dataframe_rows(df):
+    """Returns the rows of a DataFrame as tuples, with datetime columns formatted as sqlite text.
+
+    Nullable columns (e.g. Int32) are converted to Python objects with None for missing values, which sqlite3 can
+    bind, rather than pandas.NA.
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            # A file only covers a few hundred months, so only the distinct dates are formatted. Missing dates
+            # have the code -1, which takes the None appended to the end.
+            codes, dates = pd.factorize(df[column])
+            df[column] = np.append(np.asarray(dates.strftime(DATE_FORMAT), dtype=object), None).take(codes)
+        elif pd.api.types.is_extension_array_dtype(df[column]):
+            df[column] = df[column].astype(object).where(df[column].notna(), None)
+    return df.itertuples(index=False, name=None)
+
+
+def write_to_db(db_path, table_name, data, aggregates=False):
+    """Writes the precipitation data to a sqlite database.
+
+    This function writes the information in the data parameter to a sqlite database, based on the db_path parameter.
+    The data is written to a new table, defined in the table_name parameter. If the table already exists, the data
+    is appended to the table.
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the sqlite database. If the path does not exist, a new database will be created.
+    table_name : str
+        The name of the table to write the data to.
+    data : pandas.DataFrame or iterable
+        A pandas dataframe containing the data to be written to the table, or an iterable of dataframes or lists of
+        dictionaries (e.g. from iter_batches) which are written one batch at a time.
+    aggregates : bool, optional
+        If True, the annual totals and monthly climatology of each cell are computed as the data is written and
+        stored in the aggregate tables of etl.aggregates. The columns must be Xref, Yref, Date and Value.
+
+    Returns
+    -------
+    boolean
+        True if the data is written successfully. Otherwise, False.
+
+    Notes
+    -----
+    The data is written with load_to_sqlite in batched transactions.
+    """
+
+    import pandas as pd
+
+    dataframes = iter([data]) if isinstance(data, pd.DataFrame) else _iter_dataframes(data)
+    first = next(dataframes, None)
+    if first is None:
+        # There is nothing to write, but a database that cannot be opened is still reported as a failure
+        try:
+            _create_connection(db_path).close()
+        except FileNotFoundError as exc:
+            print(exc)
+            return False
         return True
 
+    # The columns of the table are taken from the first batch and every batch is loaded through one connection
+    rows = chain.from_iterable(_dataframe_rows(df) for df in chain([first], dataframes))
+    return load_to_sqlite(db_path, table_name, rows, columns=list(first.columns), aggregates=aggregates) is not None
+
 
 def dump_to_json(json_path, data):
     """Writes precipitation data to a zipped json file.
@@ -79,19 +345,331 @@ def dump_to_json(json_path, data):
     ----------
     json_path : str
         The path of the json file to be created.
-    data : pandas.DataFrame
-        A pandas dataframe object containing the data to be written.
+    data : pandas.DataFrame or iterator
+        A pandas dataframe object containing the data to be written, or an iterator of dataframes or lists of
+        dictionaries (e.g. from iter_batches) which are written to the archive one batch at a time.
 
     Raises
     ------
     TypeError
-        If the data argument passed is not a pandas dataframe.
+        If the data argument passed is not a pandas dataframe or an iterator.
 
     Notes
     ----
-    The output json file is compressed to avoid potentially large files being written unzipped.
+    The output json file is compressed to avoid potentially large files being written unzipped. Batches from an
+    iterator are written to the same single json array as a dataframe would be.
+    """
+
+    import pandas as pd
+
+    if isinstance(data, pd.DataFrame):
+        data.to_json(path_or_buf=json_path, orient="records", indent=4, compression="zip")
+    elif isinstance(data, Iterator):
+        # Name the archive member the same way pandas does for a zip compressed json file
+        archive_name = os.path.splitext(os.path.basename(json_path))[0]
+        with zipfile.ZipFile(json_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(archive_name, "w", force_zip64=True) as member:
+                member.write(b"[")
+                separator = b""
+                for df in _iter_dataframes(data):
+                    # Strip the enclosing brackets so the batches form one json array
+                    records = df.to_json(orient="records", indent=4)[1:-1]
+                    member.write(separator + records.encode("utf-8"))
+                    separator = b","
+                member.write(b"]")
+    else:
+        raise TypeError("Data input must be a pandas dataframe object or an iterator.")
+
+
+@lru_cache(maxsize=4096)
+@lru_cache(maxsize=4096)
+def _json_date(date):
+    """Formats a date, or an integer month index, as a quoted ISO 8601 date for json output."""
+
+    if isinstance(date, int):
+        date = from_month_index(date)
+    return date.strftime('"%Y-%m-%d"')
+
+
+@lru_cache(maxsize=4096)
+def _json_epoch_date(date):
+    """Formats a date, or an integer month index, as milliseconds since 1970, as DataFrame.to_json writes dates."""
+
+    if isinstance(date, int):
+        date = from_month_index(date)
+    days = (datetime(date.year, date.month, date.day) - datetime(1970, 1, 1)).days
+    return str(days * 86400000)
+
+
+def _json_value(value):
+    """Formats a precipitation value for json output, with missing values as null."""
+
+    return "null" if value is None else str(value)
+
+
+def _json_millimetres(multiplier):
+    """Returns a function that formats raw values as millimetres, to the number of decimal places in multiplier."""
+
+    decimals = max(0, -Decimal(str(multiplier)).as_tuple().exponent)
+    value_format = "{:.%df}" % decimals
+    return lambda value: "null" if value is None else value_format.format(value * multiplier)
+
+
+def _as_month_index(date):
+    """Returns the month index of a date, or the value itself if it is already an integer month index."""
+
+    return date if isinstance(date, int) else to_month_index(date)
+
+
+def _json_records(rows, format_value=_json_value, format_date=_json_date, separator=","):
+    """Yields the compact json objects of the (Xref, Yref, Date, Value) rows of each cell, joined by separator, and
+    the number of objects.
+
+    The text of a cell is built by one join of its parts: the formatted dates and values are placed between the
+    parts that are the same for every object of the cell by slice assignment, so no string is formatted for each
+    row. Raw values are converted by str, and the 'None' of missing values is replaced by null once for the cell.
+    """
+
+    for (x, y), cell_rows in groupby(rows, key=itemgetter(0, 1)):
+        _, _, dates, values = zip(*cell_rows)
+        prefix = '{{"Xref":{},"Yref":{},"Date":'.format(x, y)
+        n_objects = len(dates)
+        parts = [',"Value":'] * (4 * n_objects)
+        parts[0::4] = ["}" + separator + prefix] * n_objects
+        parts[0] = prefix
+        parts[1::4] = map(format_date, dates)
+        if format_value is _json_value:
+            parts[3::4] = map(str, values)
+            yield ("".join(parts) + "}").replace(":None}", ":null}"), n_objects
+        else:
+            parts[3::4] = map(format_value, values)
+            yield "".join(parts) + "}", n_objects
+
+
+def _json_cells(rows, format_value=_json_value, format_date=_json_date, separator=","):
+    """Yields a compact json object for each cell, with the cell's monthly values in one list, and the number of
+    objects (always 1).
+
+    The rows of a cell must be consecutive and in date order. A month with no row is written as null so that the
+    position of each value in the list is its offset in months from the start date.
+    """
+
+    cell, start, values = None, None, []
+    for x, y, date, value in chain(rows, [(None, None, None, None)]):
+        if (x, y) != cell:
+            if cell is not None:
+                yield '{{"x":{},"y":{},"start":{},"values":[{}]}}'.format(
+                    cell[0], cell[1], format_date(start), ",".join(values)), 1
+            if x is None:
+                return
+            cell, start, values = (x, y), date, []
+        offset = _as_month_index(date) - _as_month_index(start)
+        values.extend(["null"] * (offset - len(values)))
+        values.append(format_value(value))
+
+
+@contextmanager
+def _open_compressed(path, compression, compresslevel, member_name):
+    """Opens a binary stream to write to a file with the given compression."""
+
+    if compression == "zip":
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+            with archive.open(member_name, "w", force_zip64=True) as member:
+                yield member
+    elif compression == "gzip":
+        with gzip.open(path, "wb", compresslevel=6 if compresslevel is None else compresslevel) as f:
+            yield f
+    elif compression == "bz2":
+        with bz2.open(path, "wb", compresslevel=9 if compresslevel is None else compresslevel) as f:
+            yield f
+    elif compression == "xz":
+        with lzma.open(path, "wb", preset=compresslevel) as f:
+            yield f
+    else:
+        with open(path, "wb") as f:
+            yield f
+
+
+def export_json(json_path, rows, layout="records", lines=False, compression="zip", compresslevel=None,
+                multiplier=None, date_format="iso", member_name=None):
+    """Streams precipitation data to a compact, compressed json file.
+
+    Unlike dump_to_json, the rows are written as they are read, so the document is never held in memory, and
+    no indentation or whitespace is written.
+
+    Parameters
+    ----------
+    json_path : str
+        The path of the file to be created.
+    rows : iterable
+        An iterable of (Xref, Yref, Date, Value) tuples, e.g. from transform.iter_rows. Date may be a date or an
+        integer month index.
+    layout : str, optional
+        'records' writes one object per value with the keys Xref, Yref, Date and Value. 'cells' writes one object
+        per grid cell with the keys x, y, start and values, where values is the list of monthly values from the
+        start date. The rows of a cell must be consecutive to use 'cells'.
+    lines : bool, optional
+        If True, the objects are written as newline delimited json (ndjson) instead of a json array.
+    compression : str or None, optional
+        The compression codec: 'zip', 'gzip', 'bz2', 'xz' or None.
+    compresslevel : int, optional
+        The compression level for the codec. Defaults to the codec's default level.
+    multiplier : float, optional
+        The 'Multi=' scale factor of the file. If given, values are written in millimetres with as many decimal
+        places as the factor (e.g. 302.0 for 3020 with a factor of 0.1). Otherwise the raw integers are written.
+    date_format : str, optional
+        'iso' writes dates as ISO 8601 strings (e.g. '1991-01-01'). 'epoch' writes them as milliseconds since
+        1970, as DataFrame.to_json and dump_to_json do.
+    member_name : str, optional
+        The name of the member of a zip archive. Defaults to the file name with a .json or .ndjson extension.
+
+    Returns
+    -------
+    int
+        The number of json objects written.
+
+    Raises
+    ------
+    ValueError
+        If the layout, compression or date format is not recognised.
+
+    Notes
+    -----
+    Missing values are written as null. When compression is 'zip', the archive contains a single member.
     """
 
-    if not isinstance(data, pd.DataFrame):
-        raise TypeError("Data input must be a pandas dataframe object.")
-    data.to_json(path_or_buf=json_path, orient="records", indent=4, compression="zip")
+    if layout not in JSON_LAYOUTS:
+        raise ValueError("The json layout must be one of: {}.".format(", ".join(JSON_LAYOUTS)))
+    if compression not in COMPRESSIONS:
+        raise ValueError("The compression must be one of: {}.".format(", ".join(str(c) for c in COMPRESSIONS)))
+    if date_format not in JSON_DATE_FORMATS:
+        raise ValueError("The date format must be one of: {}.".format(", ".join(JSON_DATE_FORMATS)))
+
+    format_value = _json_value if multiplier is None else _json_millimetres(multiplier)
+    format_date = _json_date if date_format == "iso" else _json_epoch_date
+    separator = "\n" if lines else ","
+    objects = (_json_records if layout == "records" else _json_cells)(rows, format_value, format_date, separator)
+    if member_name is None:
+        member_name = os.path.splitext(os.path.basename(json_path))[0] + (".ndjson" if lines else ".json")
+
+    written = 0
+    with _open_compressed(json_path, compression, compresslevel, member_name) as f:
+        if not lines:
+            f.write(b"[")
+        # The text of whole cells is collected until a chunk holds at least _JSON_CHUNK_SIZE objects
+        chunk, chunk_objects = [], 0
+        for text, count in chain(objects, [(None, 0)]):
+            if text is not None:
+                chunk.append(text)
+                chunk_objects += count
+            if chunk and (chunk_objects >= _JSON_CHUNK_SIZE or text is None):
+                prefix = separator if written and not lines else ""
+                suffix = "\n" if lines else ""
+                f.write((prefix + separator.join(chunk) + suffix).encode("utf-8"))
+                written += chunk_objects
+                chunk, chunk_objects = [], 0
+        if not lines:
+            f.write(b"]")
+    return written
+
+
+def _parquet_table(pa, schema, blocks, start_date, missing_value):
+    """Builds a pyarrow Table from a list of (x, y, values) blocks."""
+
+    import numpy as np
+
+    n_values = blocks[0][2].size
+    values = np.concatenate([block[2].ravel() for block in blocks])
+    first_month = np.datetime64("{}-01".format(start_date), "M")
+    dates = (first_month + np.arange(n_values)).astype("datetime64[D]")
+    return pa.Table.from_arrays([
+        pa.array(np.repeat(np.array([block[0] for block in blocks], dtype=np.int16), n_values)),
+        pa.array(np.repeat(np.array([block[1] for block in blocks], dtype=np.int16), n_values)),
+        pa.array(np.tile(dates, len(blocks))),
+        pa.array(values, mask=values == missing_value)
+    ], schema=schema)
+
+
+def write_to_parquet(parquet_path, header, blocks, partition="xref", xref_bin_size=10, compression="zstd"):
+    """Writes precipitation data to a columnar parquet file.
+
+    Each row group holds either a range of Xref values or one year, so readers can skip row groups by their
+    statistics. Xref, Yref and Date are dictionary encoded and Value is delta encoded. Missing values are null.
+    Values are stored as raw integers and the 'Multi=' scale factor is stored in the file metadata.
+
+    Parameters
+    ----------
+    parquet_path : str
+        The path of the parquet file to be created.
+    header : dict
+        The header values of the file, as returned by arrays.iter_blocks.
+    blocks : iterable
+        An iterable of (x, y, values) tuples, where values is a (years, 12) integer matrix, as returned by
+        arrays.iter_blocks.
+    partition : str, optional
+        'xref' writes a row group for every xref_bin_size Xref values. Blocks are written as they are read. 'year'
+        writes a row group for each year, which requires all of the blocks to be read first.
+    xref_bin_size : int, optional
+        The width of the Xref range in each row group when partition is 'xref'.
+    compression : str, optional
+        The parquet compression codec, e.g. 'zstd', 'snappy' or 'none'.
+
+    Returns
+    -------
+    int
+        The number of rows written.
+
+    Raises
+    ------
+    ImportError
+        If pyarrow is not installed.
+    ValueError
+        If the partition is not recognised or xref_bin_size is not a positive integer.
+
+    Notes
+    -----
+    The file can be read with pandas.read_parquet, with the columns and filters arguments to read only the
+    columns and row groups that are needed.
+    """
+
+    if partition not in PARQUET_PARTITIONS:
+        raise ValueError("The partition must be one of: {}.".format(", ".join(PARQUET_PARTITIONS)))
+    if not isinstance(xref_bin_size, int) or xref_bin_size < 1:
+        raise ValueError("The Xref bin size must be a positive integer.")
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("pyarrow must be installed to write parquet files.")
+
+    schema = pa.schema([("Xref", pa.int16()), ("Yref", pa.int16()), ("Date", pa.date32()), ("Value", pa.int32())],
+                       metadata={"multiplier": str(header.get("multiplier", 1.0))})
+    start_date, missing_value = header["start_date"], header["missing_value"]
+    rows_written = 0
+
+    with pq.ParquetWriter(parquet_path, schema, compression=compression, use_dictionary=["Xref", "Yref", "Date"],
+                          column_encoding={"Value": "DELTA_BINARY_PACKED"}) as writer:
+        if partition == "xref":
+            # Blocks are grouped until a block falls in a different Xref bin
+            group, group_bin = [], None
+            for block in chain(blocks, [None]):
+                block_bin = block[0] // xref_bin_size if block is not None else None
+                if group and block_bin != group_bin:
+                    table = _parquet_table(pa, schema, group, start_date, missing_value)
+                    writer.write_table(table, row_group_size=table.num_rows)
+                    rows_written += table.num_rows
+                    group = []
+                if block is not None:
+                    group.append(block)
+                    group_bin = block_bin
+        else:
+            blocks = list(blocks)
+            if blocks:
+                table = _parquet_table(pa, schema, blocks, start_date, missing_value)
+                years = pc.year(table.column("Date"))
+                for year in range(start_date, header["end_date"] + 1):
+                    year_table = table.filter(pc.equal(years, year))
+                    writer.write_table(year_table, row_group_size=max(year_table.num_rows, 1))
+                rows_written = table.num_rows
+    return rows_written
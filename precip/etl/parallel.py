@@ -0,0 +1,173 @@
+"""Parse a precipitation file in parallel
+
+This module contains functions to split a single .pre file into chunks on 'Grid-ref=' block boundaries and parse the
+chunks in a pool of worker processes. The header is read once and passed to every worker, and the results are
+merged in the original order of the file, so the output is the same as the serial parsers.
+
+The module exports the following functions:
+
+    scan_block_offsets  Returns the byte offset of every 'Grid-ref=' line in a precipitation file
+    split_chunks        Groups block offsets into contiguous byte ranges
+    transform_parallel  Transforms a precipitation file using a pool of worker processes
+"""
+
+import io
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from precip.etl.arrays import read_header, transform_arrays, _generate_blocks, _columns_from_blocks
+from precip.etl.extract import calculate_number_of_years
+from precip.etl.readers import detect_compression, _GRID_REF_LINE
+from precip.etl.transform import iter_records, check_filepath, records_from_block, _iter_text_blocks
+
+# Each worker is given several chunks so that a slow chunk does not leave the other workers idle
+CHUNKS_PER_WORKER = 4
+
+
+def scan_block_offsets(filepath):
+    """Returns the byte offset of the start of every 'Grid-ref=' line in a precipitation file.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    list
+        The offsets in ascending order. The list is empty if the file contains no blocks.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file is compressed, as offsets into the decompressed content cannot be seeked to.
+    """
+
+    check_filepath(filepath)
+    if detect_compression(filepath) is not None:
+        raise ValueError("A compressed file cannot be split into byte ranges.")
+    if os.path.getsize(filepath) == 0:
+        return []
+    with open(filepath, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return [match.start() for match in _GRID_REF_LINE.finditer(mm)]
+
+
+def split_chunks(offsets, file_size, n_chunks):
+    """Groups block offsets into at most n_chunks contiguous byte ranges.
+
+    Parameters
+    ----------
+    offsets : list
+        The byte offsets of the 'Grid-ref=' lines, as returned by scan_block_offsets.
+    file_size : int
+        The size of the file in bytes. The final chunk ends here.
+    n_chunks : int
+        The maximum number of chunks to create.
+
+    Returns
+    -------
+    list
+        A list of (start, end) byte ranges. Every range starts on a 'Grid-ref=' line and contains whole blocks.
+
+    Raises
+    ------
+    ValueError
+        If n_chunks is not a positive integer.
+    """
+
+    if not isinstance(n_chunks, int) or n_chunks < 1:
+        raise ValueError("The number of chunks must be a positive integer.")
+    if not offsets:
+        return []
+
+    # Split on block boundaries with roughly the same number of blocks per chunk
+    indices = np.linspace(0, len(offsets), min(n_chunks, len(offsets)) + 1).astype(int)
+    starts = [offsets[ix] for ix in indices[:-1]]
+    return list(zip(starts, starts[1:] + [file_size]))
+
+
+def _read_chunk(filepath, start, end):
+    """Returns the raw bytes of a file between two offsets."""
+
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def _parse_chunk_records(filepath, start, end, header):
+    """Parses one chunk of a precipitation file with the reference per-line functions."""
+
+    date_range = calculate_number_of_years(header["start_date"], header["end_date"])
+    lines = io.StringIO(_read_chunk(filepath, start, end).decode("ascii"))
+    records = []
+    for x, y, rows in _iter_text_blocks(lines, lines.readline(), date_range):
+        records.extend(records_from_block(x, y, rows, header["start_date"], header["missing_value"]))
+    return records
+
+
+def _parse_chunk_arrays(filepath, start, end, header):
+    """Parses one chunk of a precipitation file with the vectorised block parser."""
+
+    f = io.BytesIO(_read_chunk(filepath, start, end))
+    return _columns_from_blocks(header, _generate_blocks(header, f.readline(), f))
+
+
+def transform_parallel(filepath, workers=None, parser="records"):
+    """Transforms a precipitation file by parsing chunks of it in a pool of worker processes.
+
+    The file is pre-scanned for 'Grid-ref=' offsets and split into chunks of whole blocks. The header is parsed once
+    and each chunk is parsed in a worker process. The chunks are merged in the order they appear in the file.
+    Compressed files cannot be split into byte ranges, so they are streamed through the serial parser instead.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    workers : int, optional
+        The number of worker processes. Defaults to the number of CPUs on the machine.
+    parser : str, optional
+        'records' to return a list of dictionaries identical to transform_data, or 'arrays' to return columnar
+        arrays identical to transform_arrays.
+
+    Returns
+    -------
+    list or dict
+        The transformed data in the format of the chosen parser.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the parser or worker count is not valid, or the file cannot be parsed.
+    """
+
+    if parser not in ("records", "arrays"):
+        raise ValueError("The parser must be either 'records' or 'arrays'.")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    elif not isinstance(workers, int) or workers < 1:
+        raise ValueError("The number of workers must be a positive integer.")
+    check_filepath(filepath)
+    if detect_compression(filepath) is not None:
+        return list(iter_records(filepath)) if parser == "records" else transform_arrays(filepath)
+
+    offsets = scan_block_offsets(filepath)
+    with open(filepath, "rb") as f:
+        header, _ = read_header(f)
+    chunks = split_chunks(offsets, os.path.getsize(filepath), workers * CHUNKS_PER_WORKER)
+
+    parse_chunk = _parse_chunk_records if parser == "records" else _parse_chunk_arrays
+    n_chunks = len(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(parse_chunk, [filepath] * n_chunks, [start for start, _ in chunks],
+                                    [end for _, end in chunks], [header] * n_chunks))
+
+    if parser == "records":
+        return [record for result in results for record in result]
+    if not results:
+        return _columns_from_blocks(header, [])
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
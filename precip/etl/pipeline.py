@@ -0,0 +1,222 @@
+"""Pipelined extract, transform and load
+
+This module contains a runner that connects the parser and the output writers with bounded queues, so the file is
+read once and the sqlite and json writers run at the same time as the parser. Each writer runs in its own thread.
+Disk reads, compression and database commits release the GIL, so they overlap with each other and with parsing,
+and the wall time of a run approaches the time of its slowest stage. A full queue blocks the stage in front of it,
+which caps the number of rows held in memory however large the file is.
+
+The module exports the following functions:
+
+    run_pipeline   Streams rows to several writers at once through bounded queues
+    pipeline_file  Parses a precipitation file once and writes it to sqlite and json concurrently
+"""
+
+import queue
+import threading
+import time
+from itertools import islice
+from precip.etl.load_to_db import load_to_sqlite, export_json
+from precip.etl.schema import PRECIP_TABLE
+from precip.etl.transform import iter_rows
+
+PIPELINE_BATCH_SIZE = 10000
+QUEUE_SIZE = 8
+
+# How often a blocked stage checks whether another stage has failed, in seconds
+_POLL_INTERVAL = 0.1
+
+_END = object()
+
+
+class _StageFailed(Exception):
+    """Raised into a writer's rows when another stage fails, so the writer stops rather than finishing its output."""
+
+
+def _put(stage_queue, item, failed):
+    """Puts an item on a queue, waiting while it is full. Returns False if a stage fails while waiting."""
+
+    while not failed.is_set():
+        try:
+            stage_queue.put(item, timeout=_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _drain(stage_queue, failed, timing):
+    """Yields the rows of each batch on a queue until the end of the input.
+
+    The time spent waiting for batches is added to timing['waiting']. If a stage fails, _StageFailed is raised so
+    that the writer does not treat the rows so far as the whole input and complete its output.
+    """
+
+    while not failed.is_set():
+        start = time.perf_counter()
+        try:
+            batch = stage_queue.get(timeout=_POLL_INTERVAL)
+        except queue.Empty:
+            continue
+        finally:
+            timing["waiting"] += time.perf_counter() - start
+        if batch is _END:
+            return
+        yield from batch
+    raise _StageFailed()
+
+
+def _run_writer(name, writer, stage_queue, failed, results, errors, timings):
+    """Runs one writer on the rows from its queue and records its result, error and timings."""
+
+    timing = timings[name]
+    start = time.perf_counter()
+    try:
+        rows = _drain(stage_queue, failed, timing)
+        results[name] = writer(rows)
+        # A writer that returns before the end of its rows would leave the parser waiting on a full queue
+        for _ in rows:
+            pass
+    except _StageFailed:
+        pass
+    except Exception as exc:
+        errors.append(exc)
+        failed.set()
+    finally:
+        timing["seconds"] = time.perf_counter() - start
+
+
+def run_pipeline(rows, writers, batch_size=PIPELINE_BATCH_SIZE, queue_size=QUEUE_SIZE):
+    """Streams rows to several writers at once through bounded queues.
+
+    The rows are read in the calling thread and put on one queue per writer in batches. Each writer runs in its own
+    thread and is called with an iterator over the rows from its queue. If the rows or any writer raise an
+    exception, the iterators of the other writers raise an exception at their next batch, so no writer completes
+    its output, and the first exception is raised once every thread has finished. The rest of the rows of a writer
+    that returns early are read and discarded.
+
+    Parameters
+    ----------
+    rows : iterable
+        The rows to be written, e.g. from transform.iter_rows.
+    writers : dict
+        A dictionary mapping a stage name to a callable that takes an iterator of rows and returns a result.
+    batch_size : int, optional
+        The number of rows passed between stages at a time.
+    queue_size : int, optional
+        The maximum number of batches waiting for each writer. At most about batch_size * (queue_size + 2) rows
+        are held in memory at once.
+
+    Returns
+    -------
+    dict
+        A summary with the keys 'results' (the return value of each writer by name), 'timings' (for 'parse' and
+        each writer, a dict of the stage's total 'seconds' and the seconds spent 'waiting' on a neighbouring stage)
+        and 'seconds' (the wall time of the run).
+
+    Raises
+    ------
+    ValueError
+        If batch_size or queue_size is not a positive integer.
+    """
+
+    for name, value in (("batch size", batch_size), ("queue size", queue_size)):
+        if not isinstance(value, int) or value < 1:
+            raise ValueError("The {} must be a positive integer.".format(name))
+
+    failed = threading.Event()
+    queues = {name: queue.Queue(maxsize=queue_size) for name in writers}
+    timings = {name: {"seconds": 0.0, "waiting": 0.0} for name in ("parse",) + tuple(writers)}
+    results, errors = {}, []
+    threads = [threading.Thread(target=_run_writer, name="precip-{}".format(name),
+                                args=(name, writer, queues[name], failed, results, errors, timings), daemon=True)
+               for name, writer in writers.items()]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        rows = iter(rows)
+        batch = list(islice(rows, batch_size))
+        while batch and not failed.is_set():
+            put_start = time.perf_counter()
+            for stage_queue in queues.values():
+                _put(stage_queue, batch, failed)
+            timings["parse"]["waiting"] += time.perf_counter() - put_start
+            batch = list(islice(rows, batch_size))
+        for stage_queue in queues.values():
+            _put(stage_queue, _END, failed)
+    except Exception as exc:
+        errors.insert(0, exc)
+        failed.set()
+    finally:
+        timings["parse"]["seconds"] = time.perf_counter() - start
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return {"results": results, "timings": timings, "seconds": time.perf_counter() - start}
+
+
+def pipeline_file(filepath, sql_path=None, json_path=None, table_name=PRECIP_TABLE, backend="mmap",
+                  batch_size=PIPELINE_BATCH_SIZE, queue_size=QUEUE_SIZE, aggregates=False, json_options=None,
+                  progress=None):
+    """Parses a precipitation file once and writes it to a sqlite database and a json file concurrently.
+
+    The rows are loaded to the managed precipitation table with load_to_sqlite, replacing any rows already loaded
+    for the same cells and months, and exported with export_json. Dates are passed between the stages as integer
+    month indexes, which are stored as they are in sqlite and only formatted once per month for json.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+    sql_path : str, optional
+        The path of the sqlite database. If None, the database is not written.
+    json_path : str, optional
+        The path of the zipped json file. If None, the json file is not written.
+    table_name : str, optional
+        The name of the precipitation table.
+    backend : str, optional
+        The input backend, as for transform.iter_rows.
+    batch_size : int, optional
+        The number of rows passed between stages at a time.
+    queue_size : int, optional
+        The maximum number of batches waiting for each writer.
+    aggregates : bool, optional
+        If True, the aggregate tables of etl.aggregates are updated by the sqlite writer as the rows are loaded.
+    json_options : dict, optional
+        Keyword arguments passed to export_json, e.g. date_format and member_name.
+    progress : callable, optional
+        Called with the iterator of parsed rows before they are passed to the writers and returns an iterator of the
+        same rows, e.g. to log progress with Instrumentation.track.
+
+    Returns
+    -------
+    dict
+        The summary returned by run_pipeline. The results are the number of rows written by each of the 'sqlite'
+        and 'json' stages.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found or the database connection could not be made.
+    ValueError
+        If the file cannot be parsed.
+    """
+
+    def write_sqlite(rows):
+        rows_written = load_to_sqlite(sql_path, table_name, rows, build_indexes=True, managed_schema=True,
+                                      without_rowid=True, month_index=True, aggregates=aggregates)
+        if rows_written is None:
+            raise FileNotFoundError("Database connection could not be made.")
+        return rows_written
+
+    writers = {}
+    if sql_path is not None:
+        writers["sqlite"] = write_sqlite
+    if json_path is not None:
+        writers["json"] = lambda rows: export_json(json_path, rows, **(json_options or {}))
+    rows = iter_rows(filepath, backend, month_index=True)
+    return run_pipeline(progress(rows) if progress else rows, writers, batch_size, queue_size)
@@ -0,0 +1,220 @@
+"""Query precipitation data in the managed sqlite schema
+
+This module contains functions to read precipitation values back from a table created with
+schema.create_precip_table. Each query is a range scan of the (Xref, Yref, Date) primary key or the Date index,
+rather than a scan of the whole table. If the table has the aggregate tables of etl.aggregates, climatologies and
+annual totals are read from them rather than computed from the monthly values.
+
+The module exports the following functions:
+
+    get_value                Returns the value for one cell and month
+    get_cell_series          Returns the monthly series for one cell
+    get_bounding_box         Returns the values for every cell in a bounding box
+    get_monthly_climatology  Returns the mean value of each calendar month for one cell
+    get_annual_totals        Returns the total of each year for one cell
+"""
+
+from precip.etl.aggregates import aggregate_tables, has_aggregate_tables
+from precip.etl.schema import PRECIP_TABLE, _quote, to_month_index, from_month_index
+
+
+def _date_range(start_date, end_date):
+    """Returns the month index bounds for an optional date range."""
+
+    start = to_month_index(start_date) if start_date is not None else -1
+    end = to_month_index(end_date) if end_date is not None else 2 ** 62
+    return start, end
+
+
+def _year_range(start_year, end_year):
+    """Returns the month index bounds for an optional range of years."""
+
+    start = start_year * 12 if start_year is not None else -1
+    end = end_year * 12 + 11 if end_year is not None else 2 ** 62
+    return start, end
+
+
+def _cell_series_rows(connection, x, y, start_date, end_date, table_name):
+    """Returns a cursor over the (Date, Value) rows of one cell in date order, with Date as a month index."""
+
+    return connection.execute(
+        "SELECT Date, Value FROM {} WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ? "
+        "ORDER BY Date".format(_quote(table_name)),
+        (x, y) + _date_range(start_date, end_date)
+    )
+
+
+def _bounding_box_rows(connection, x_min, x_max, y_min, y_max, start_date, end_date, table_name):
+    """Returns a cursor over the (Xref, Yref, Date, Value) rows of a bounding box, with Date as a month index."""
+
+    return connection.execute(
+        "SELECT Xref, Yref, Date, Value FROM {} WHERE Xref BETWEEN ? AND ? AND Yref BETWEEN ? AND ? "
+        "AND Date BETWEEN ? AND ? ORDER BY Xref, Yref, Date".format(_quote(table_name)),
+        (x_min, x_max, y_min, y_max) + _date_range(start_date, end_date)
+    )
+
+
+def get_value(connection, x, y, date, table_name=PRECIP_TABLE):
+    """Returns the precipitation value for one cell and month.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    date : datetime.date or datetime.datetime
+        Any date in the month.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    int or None
+        The value, or None if the value is missing or the cell and month are not in the table.
+    """
+
+    row = connection.execute(
+        "SELECT Value FROM {} WHERE Xref = ? AND Yref = ? AND Date = ?".format(_quote(table_name)),
+        (x, y, to_month_index(date))
+    ).fetchone()
+    return row[0] if row else None
+
+
+def get_cell_series(connection, x, y, start_date=None, end_date=None, table_name=PRECIP_TABLE):
+    """Returns the monthly precipitation series for one cell.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_date : datetime.date or datetime.datetime, optional
+        The first month to return. Defaults to the start of the series.
+    end_date : datetime.date or datetime.datetime, optional
+        The last month to return, inclusive. Defaults to the end of the series.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    list
+        A list of (date, value) tuples in date order, where date is a datetime on the first day of the month.
+    """
+
+    rows = _cell_series_rows(connection, x, y, start_date, end_date, table_name)
+    return [(from_month_index(date), value) for date, value in rows]
+
+
+def get_bounding_box(connection, x_min, x_max, y_min, y_max, start_date=None, end_date=None,
+                     table_name=PRECIP_TABLE):
+    """Returns the precipitation values for every cell in a bounding box.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    x_min, x_max : int
+        The inclusive range of Xref values.
+    y_min, y_max : int
+        The inclusive range of Yref values.
+    start_date : datetime.date or datetime.datetime, optional
+        The first month to return. Defaults to the start of the series.
+    end_date : datetime.date or datetime.datetime, optional
+        The last month to return, inclusive. Defaults to the end of the series.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    list
+        A list of (Xref, Yref, date, value) tuples ordered by cell and date.
+    """
+
+    rows = _bounding_box_rows(connection, x_min, x_max, y_min, y_max, start_date, end_date, table_name)
+    return [(x, y, from_month_index(date), value) for x, y, date, value in rows]
+
+
+def get_monthly_climatology(connection, x, y, start_year=None, end_year=None, table_name=PRECIP_TABLE):
+    """Returns the mean value of each calendar month for one cell.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_year, end_year : int, optional
+        The inclusive range of years to average over. Defaults to every year in the table.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    list
+        The mean of the non-missing values of each month from January to December, or None for a month with no
+        values.
+    """
+
+    if start_year is None and end_year is None and has_aggregate_tables(connection, table_name):
+        rows = connection.execute(
+            "SELECT Month, CAST(Total AS REAL) / NULLIF(Count, 0) FROM {} WHERE Xref = ? AND Yref = ?".format(
+                _quote(aggregate_tables(table_name)[1])),
+            (x, y)
+        )
+    else:
+        rows = connection.execute(
+            "SELECT Date % 12 + 1, AVG(Value) FROM {} WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ? "
+            "GROUP BY Date % 12".format(_quote(table_name)),
+            (x, y) + _year_range(start_year, end_year)
+        )
+    means = [None] * 12
+    for month, mean in rows:
+        means[month - 1] = mean
+    return means
+
+
+def get_annual_totals(connection, x, y, start_year=None, end_year=None, table_name=PRECIP_TABLE):
+    """Returns the total of each year for one cell.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_year, end_year : int, optional
+        The inclusive range of years to return. Defaults to every year in the table.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    list
+        A list of (year, total, missing) tuples in year order, where total is the sum of the non-missing values and
+        missing is the number of missing months in the table.
+    """
+
+    if has_aggregate_tables(connection, table_name):
+        rows = connection.execute(
+            "SELECT Year, Total, Missing FROM {} WHERE Xref = ? AND Yref = ? AND Year BETWEEN ? AND ? "
+            "ORDER BY Year".format(_quote(aggregate_tables(table_name)[0])),
+            (x, y, start_year if start_year is not None else -1, end_year if end_year is not None else 2 ** 62)
+        )
+    else:
+        rows = connection.execute(
+            "SELECT Date / 12, CAST(TOTAL(Value) AS INTEGER), COUNT(*) - COUNT(Value) FROM {} "
+            "WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ? GROUP BY Date / 12 "
+            "ORDER BY Date / 12".format(_quote(table_name)),
+            (x, y) + _year_range(start_year, end_year)
+        )
+    return rows.fetchall()
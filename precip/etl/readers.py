@@ -0,0 +1,446 @@
+"""Read precipitation files through selectable input backends
+
+This module contains the input backends used by transform_data and transform_arrays. The 'text' backend reads the
+file line by line through Python's text layer. The 'mmap' backend maps the file into memory and scans the header
+flags and 'Grid-ref=' lines directly in the mapped bytes, handing each block of data rows to the parser as a
+memoryview of the mapping rather than as decoded lines. The 'cache' backend reads the blocks parsed by the
+vectorised parser from the persistent cache in etl.cache, so a file is only parsed the first time its content is
+read. Like transform_arrays, it follows the vectorised parser.
+
+Files compressed with gzip, bz2 or xz, or stored in a zip archive, are read without being extracted to disk. The
+compression is recognised from the first bytes of the file, and the file is decompressed in large blocks by a
+background thread while the caller parses the blocks already decompressed. A compressed file cannot be mapped, so
+the 'mmap' backend reads it through the same stream.
+
+The module exports the following functions:
+
+    check_backend       Raises a ValueError if an input backend name is not recognised
+    detect_compression  Returns the compression of a precipitation file, or None if it is not compressed
+    open_input          Opens a precipitation file, decompressing it in a background thread if it is compressed
+    read_header         Reads the header of a precipitation file opened in binary mode
+    iter_mmap_blocks    Returns the header of a file and an iterator over its raw blocks using mmap
+    iter_block_spans    Returns the header of a file and an iterator over the byte span of each block using mmap
+    split_rows          Splits the raw rows of a block into lines
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import queue
+import re
+import threading
+import zipfile
+from precip.etl.extract import get_header_values, get_grid_ref_values, calculate_number_of_years
+
+BACKENDS = ("text", "mmap", "cache")
+MONTHS = 12
+
+# The first bytes of each supported compressed format
+COMPRESSIONS = {"gzip": b"\x1f\x8b", "bz2": b"BZh", "xz": b"\xfd7zXZ\x00", "zip": b"PK\x03\x04"}
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zip")
+# Compressed files are decompressed in blocks of this many bytes, and at most QUEUE_BLOCKS blocks are held ahead of
+# the parser
+DEFAULT_BLOCK_SIZE = 1 << 20
+QUEUE_BLOCKS = 4
+
+# How often a blocked decompression thread checks whether the stream has been closed, in seconds
+_POLL_INTERVAL = 0.1
+
+_GRID_REF_LINE = re.compile(rb"^Grid-ref", re.MULTILINE)
+_END = object()
+
+
+def check_backend(backend):
+    """Raises a ValueError if an input backend name is not recognised.
+
+    Parameters
+    ----------
+    backend : str
+        The name of the input backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is not one of BACKENDS.
+    """
+
+    if backend not in BACKENDS:
+        raise ValueError("The input backend must be one of: {}.".format(", ".join(BACKENDS)))
+
+
+def detect_compression(filepath):
+    """Returns the compression of a precipitation file, recognised from its first bytes.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    str or None
+        One of the keys of COMPRESSIONS, or None if the file is not compressed.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    """
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("The precipitation file entered could not be found.")
+    with open(filepath, "rb") as f:
+        magic = f.read(6)
+    for compression, prefix in COMPRESSIONS.items():
+        if magic.startswith(prefix):
+            return compression
+    return None
+
+
+def _open_member(filepath):
+    """Opens the precipitation file stored in a zip archive: its only member, or its only .pre member."""
+
+    try:
+        archive = zipfile.ZipFile(filepath)
+    except zipfile.BadZipFile as exc:
+        raise ValueError("The zip archive could not be read: {}".format(exc)) from exc
+    members = [info for info in archive.infolist() if not info.is_dir()]
+    if len(members) > 1:
+        members = [info for info in members if info.filename.endswith(".pre")]
+    if len(members) != 1:
+        archive.close()
+        raise ValueError("The zip archive must contain a single precipitation file.")
+    try:
+        member = archive.open(members[0])
+    except zipfile.BadZipFile as exc:
+        archive.close()
+        raise ValueError("The zip archive could not be read: {}".format(exc)) from exc
+    # The member keeps its own reference to the archive's file, which is closed when the member is closed
+    archive.close()
+    return member
+
+
+_OPENERS = {"gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open, "zip": _open_member}
+
+
+class _DecompressedStream(io.RawIOBase):
+    """A read-only stream of the decompressed bytes of a file, decompressed ahead of the reader by a thread.
+
+    The thread reads blocks of block_size bytes from the decompressor and puts them on a queue of at most
+    QUEUE_BLOCKS blocks. zlib, bz2 and lzma release the GIL while they decompress, so decompression overlaps with
+    parsing in the reading thread. Errors raised by the decompressor are raised by the next read.
+    """
+
+    def __init__(self, source, block_size=DEFAULT_BLOCK_SIZE):
+        super().__init__()
+        self._blocks = queue.Queue(maxsize=QUEUE_BLOCKS)
+        self._closing = threading.Event()
+        self._block, self._position = b"", 0
+        self._thread = threading.Thread(target=self._decompress, args=(source, block_size),
+                                        name="precip-decompress", daemon=True)
+        self._thread.start()
+
+    def _put(self, item):
+        """Puts an item on the queue, waiting while it is full. Returns False if the stream is closed while waiting."""
+
+        while not self._closing.is_set():
+            try:
+                self._blocks.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _decompress(self, source, block_size):
+        """Reads decompressed blocks from the source onto the queue until the end of the source or the stream closes."""
+
+        try:
+            with source:
+                block = source.read(block_size)
+                while block and self._put(block):
+                    block = source.read(block_size)
+        except Exception as exc:
+            self._put(exc)
+            return
+        self._put(_END)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._block is _END:
+            return 0
+        if self._position == len(self._block):
+            self._block, self._position = self._blocks.get(), 0
+            if self._block is _END:
+                return 0
+            if isinstance(self._block, Exception):
+                exc, self._block = self._block, _END
+                raise ValueError("The compressed file could not be read: {}".format(exc)) from exc
+        n = min(len(buffer), len(self._block) - self._position)
+        buffer[:n] = self._block[self._position:self._position + n]
+        self._position += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._closing.set()
+            self._thread.join()
+        super().close()
+
+
+def open_input(filepath, mode="rb", block_size=DEFAULT_BLOCK_SIZE):
+    """Opens a precipitation file for reading, decompressing it in a background thread if it is compressed.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file. It can be plain text, compressed with gzip, bz2 or xz, or a zip archive
+        holding a single .pre file.
+    mode : str, optional
+        'rb' to read bytes or 'r' to read text, as for open.
+    block_size : int, optional
+        The number of bytes decompressed at a time, and the buffer size of the returned stream.
+
+    Returns
+    -------
+    file object
+        A file object that can be used as a context manager. Compressed files cannot be seeked.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the mode is not 'r' or 'rb', or a zip archive does not hold a single precipitation file.
+    """
+
+    if mode not in ("r", "rb"):
+        raise ValueError("The mode must be either 'r' or 'rb'.")
+    compression = detect_compression(filepath)
+    if compression is None:
+        return open(filepath, mode)
+    stream = _open_decompressed(filepath, compression, block_size)
+    return stream if mode == "rb" else io.TextIOWrapper(stream)
+
+
+def _open_decompressed(filepath, compression, block_size=DEFAULT_BLOCK_SIZE):
+    """Opens a binary stream of the decompressed content of a file whose compression is already known."""
+
+    return io.BufferedReader(_DecompressedStream(_OPENERS[compression](filepath), block_size), block_size)
+
+
+def _end_of_rows(mm, start, n_rows):
+    """Returns the offset after the n_rows lines starting at start, or the end of the mapping if the file ends."""
+
+    end = start
+    for _ in range(n_rows):
+        newline = mm.find(b"\n", end)
+        if newline == -1:
+            return len(mm)
+        end = newline + 1
+    return end
+
+
+def _generate_mmap_blocks(f, mm, view, first_grid_ref, n_rows):
+    """Yields (x, y, rows) for each block in a mapped file and releases the mapping when finished."""
+
+    try:
+        match = first_grid_ref
+        while match:
+            line_end = _end_of_rows(mm, match.start(), 1)
+            x, y = get_grid_ref_values(mm[match.start():line_end].decode("ascii"))
+            rows_end = _end_of_rows(mm, line_end, n_rows)
+            yield x, y, view[line_end:rows_end]
+            match = _GRID_REF_LINE.search(mm, rows_end)
+    finally:
+        # The mapping can only be closed once no slices of it are still held by the caller
+        try:
+            view.release()
+            mm.close()
+        except BufferError:
+            pass
+        f.close()
+
+
+def _generate_stream_blocks(f, first_grid_ref, n_rows):
+    """Yields (x, y, rows) for each block in a decompressed stream and closes the stream when finished."""
+
+    with f:
+        line = first_grid_ref
+        while line:
+            if line.startswith(b"Grid-ref"):
+                x, y = get_grid_ref_values(line.decode("ascii"))
+                yield x, y, b"".join(f.readline() for _ in range(n_rows))
+            line = f.readline()
+
+
+def _generate_block_spans(f, mm, first_grid_ref, n_rows):
+    """Yields (x, y, offset, length) for each block in a mapped file and releases the mapping when finished."""
+
+    try:
+        match = first_grid_ref
+        while match:
+            line_end = _end_of_rows(mm, match.start(), 1)
+            x, y = get_grid_ref_values(mm[match.start():line_end].decode("ascii"))
+            rows_end = _end_of_rows(mm, line_end, n_rows)
+            yield x, y, match.start(), rows_end - match.start()
+            match = _GRID_REF_LINE.search(mm, rows_end)
+    finally:
+        mm.close()
+        f.close()
+
+
+def read_header(f):
+    """Reads the header of a precipitation file opened in binary mode.
+
+    Parameters
+    ----------
+    f : file object
+        The precipitation file, opened with mode 'rb' and positioned at the start of the file.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    first_grid_ref : bytes
+        The first 'Grid-ref=' line of the file, or an empty bytes object if the file contains no blocks.
+
+    Raises
+    ------
+    ValueError
+        If the 'Years=' flag could not be found in the header.
+    """
+
+    header_lines = []
+    for line in f:
+        if line.startswith(b"Grid-ref"):
+            break
+        header_lines.append(line)
+    else:
+        line = b""
+    header = get_header_values(b"".join(header_lines).decode("ascii", errors="replace"))
+    return header, line
+
+
+def _open_mmap(filepath):
+    """Maps a precipitation file into memory and parses its header.
+
+    Returns the open file, the mapping, the header values, the match of the first 'Grid-ref=' line (None if the file
+    has no blocks) and the number of data rows in each block. The caller checks that the file is not compressed.
+    """
+
+    if os.path.getsize(filepath) == 0:
+        raise ValueError("The date range for the file could not be found.")
+
+    f = open(filepath, "rb")
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    first_grid_ref = _GRID_REF_LINE.search(mm)
+    header_end = first_grid_ref.start() if first_grid_ref else len(mm)
+    try:
+        header = get_header_values(mm[:header_end].decode("ascii", errors="replace"))
+    except ValueError:
+        mm.close()
+        f.close()
+        raise
+
+    n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+    return f, mm, header, first_grid_ref, n_rows
+
+
+def iter_mmap_blocks(filepath):
+    """Returns the header of a precipitation file and an iterator over its raw blocks, read through mmap.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    blocks : iterator
+        An iterator of (x, y, rows) tuples, where rows is a memoryview of the block's data rows in the mapped file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the header cannot be parsed. Errors in the blocks are raised during iteration.
+
+    Notes
+    -----
+    The rows are only valid until the iterator moves to the next block. Copy them to keep them.
+
+    A compressed file cannot be mapped, so it is decompressed by open_input and each block's rows are returned as
+    bytes instead.
+    """
+
+    compression = detect_compression(filepath)
+    if compression is not None:
+        f = _open_decompressed(filepath, compression)
+        try:
+            header, first_grid_ref = read_header(f)
+        except ValueError:
+            f.close()
+            raise
+        n_rows = calculate_number_of_years(header["start_date"], header["end_date"])
+        return header, _generate_stream_blocks(f, first_grid_ref, n_rows)
+    f, mm, header, first_grid_ref, n_rows = _open_mmap(filepath)
+    return header, _generate_mmap_blocks(f, mm, memoryview(mm), first_grid_ref, n_rows)
+
+
+def iter_block_spans(filepath):
+    """Returns the header of a precipitation file and an iterator over the byte span of each block, read through mmap.
+
+    Only the 'Grid-ref=' lines are decoded and the line endings of the data rows counted, so the spans can be used
+    to index a file without parsing its values.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Returns
+    -------
+    header : dict
+        The header values returned by get_header_values.
+    blocks : iterator
+        An iterator of (x, y, offset, length) tuples, where offset is the position of the block's 'Grid-ref=' line in
+        the file and length is the number of bytes from it to the end of the block's data rows.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the file is compressed, as offsets into the decompressed content cannot be seeked to, or the header
+        cannot be parsed. Errors in the grid references are raised during iteration.
+    """
+
+    if detect_compression(filepath) is not None:
+        raise ValueError("A compressed file cannot be memory-mapped.")
+    f, mm, header, first_grid_ref, n_rows = _open_mmap(filepath)
+    return header, _generate_block_spans(f, mm, first_grid_ref, n_rows)
+
+
+def split_rows(rows):
+    """Splits the raw rows of a block into lines.
+
+    Parameters
+    ----------
+    rows : bytes-like
+        The data rows of one block, as yielded by iter_mmap_blocks.
+
+    Returns
+    -------
+    list
+        A list of bytes objects, one for each line. These can be passed to get_data_values without decoding.
+    """
+
+    return bytes(rows).splitlines()
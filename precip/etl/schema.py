@@ -0,0 +1,105 @@
+"""Managed sqlite schema for precipitation data
+
+This module contains the schema of the precipitation table. Xref and Yref are stored as integers and Date as an
+integer month index (the number of months since January of year 0), so that a cell's series is a contiguous range
+of the (Xref, Yref, Date) primary key.
+
+The module exports the following functions:
+
+    to_month_index      Converts a date to an integer month index
+    from_month_index    Converts an integer month index to a datetime
+    create_precip_table Creates the precipitation table and its primary key if it does not exist
+    create_date_index   Creates the secondary index on the Date column
+"""
+
+from datetime import datetime
+from functools import lru_cache
+
+PRECIP_TABLE = "precip_values"
+
+
+@lru_cache(maxsize=4096)
+def to_month_index(date):
+    """Converts a date to an integer month index.
+
+    Parameters
+    ----------
+    date : datetime.date or datetime.datetime
+        The date to be converted. Only the year and month are used.
+
+    Returns
+    -------
+    int
+        The number of months between January of year 0 and the date, e.g. 23892 for January 1991.
+    """
+
+    return date.year * 12 + date.month - 1
+
+
+def from_month_index(month_index):
+    """Converts an integer month index to a datetime on the first day of the month.
+
+    Parameters
+    ----------
+    month_index : int
+        The month index, as returned by to_month_index.
+
+    Returns
+    -------
+    datetime.datetime
+        The first day of the month.
+    """
+
+    year, month = divmod(month_index, 12)
+    return datetime(year, month + 1, 1)
+
+
+def _quote(identifier):
+    """Quotes a table, index or column name for use in a sqlite statement."""
+
+    return '"{}"'.format(identifier.replace('"', '""'))
+
+
+def create_date_index(connection, table_name=PRECIP_TABLE):
+    """Creates the secondary index on the Date column of a precipitation table if it does not exist.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    table_name : str, optional
+        The name of the precipitation table.
+    """
+
+    index = _quote("idx_{}_date".format(table_name))
+    connection.execute("CREATE INDEX IF NOT EXISTS {} ON {} (Date)".format(index, _quote(table_name)))
+
+
+def create_precip_table(connection, table_name=PRECIP_TABLE, without_rowid=False, date_index=True):
+    """Creates a precipitation table with a (Xref, Yref, Date) primary key if it does not exist.
+
+    Parameters
+    ----------
+    connection : sqlite3.Connection
+        The connection to the database.
+    table_name : str, optional
+        The name of the table to create.
+    without_rowid : bool, optional
+        If True, the table is created WITHOUT ROWID so the rows are stored in primary key order and lookups by cell
+        do not need a second b-tree search.
+    date_index : bool, optional
+        If True, the secondary index on Date is created with the table. Set this to False to create it with
+        create_date_index once a bulk load has finished.
+    """
+
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS {} ("
+        "Xref INTEGER NOT NULL, "
+        "Yref INTEGER NOT NULL, "
+        "Date INTEGER NOT NULL, "
+        "Value INTEGER, "
+        "PRIMARY KEY (Xref, Yref, Date)"
+        "){}".format(_quote(table_name), " WITHOUT ROWID" if without_rowid else "")
+    )
+    if date_index:
+        create_date_index(connection, table_name)
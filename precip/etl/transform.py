@@ -1,21 +1,500 @@
 """Transform precipitation data to pandas dataframe
 
 This module contains functions to transform precipitation information from a text file to a pandas DataFrame.
+pandas is only imported by the functions that build a DataFrame, so that parsing rows for sqlite or json does not
+pay for importing it.
 
 The module exports the following functions:
 
-    transform_data  Transforms raw strings from the precipitation file to a json-like list of dictionaries.
-    convert_to_df   Converts a json-like list of dictionaries to a pandas DataFrame.
+    check_filepath      Raises a FileNotFoundError if the precipitation file does not exist.
+    records_from_block  Yields a record for each monthly value in the data rows of one 'Grid-ref=' block.
+    parse_grid_ref      Returns the X and Y values of a 'Grid-ref=' line.
+    iter_rows           Yields the precipitation data from the text file as (Xref, Yref, Date, Value) tuples.
+    iter_records        Yields the precipitation data from the text file one record at a time.
+    iter_batches        Yields the precipitation data from the text file in fixed-size lists of records.
+    transform_data      Transforms raw strings from the precipitation file to a json-like list of dictionaries.
+    convert_to_df       Converts a json-like list of dictionaries to a pandas DataFrame.
 """
 
-import pandas as pd
 import os
 from datetime import datetime
-from precip.etl.extract import get_year_range, get_missing_data_value, get_grid_ref_values, \
-    get_data_values, calculate_number_of_years
+from functools import lru_cache, partial
+from itertools import chain, repeat
+from precip.etl.extract import get_header_values, get_grid_ref_values, get_data_values, calculate_number_of_years
+from precip.etl.readers import check_backend, iter_mmap_blocks, open_input, split_rows
 
+DEFAULT_BATCH_SIZE = 100000
+COLUMNS = ("Xref", "Yref", "Date", "Value")
 
-def transform_data(filepath):
+
+def check_filepath(filepath):
+    """Raises a FileNotFoundError if the precipitation file does not exist.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    """
+
+    if not os.path.exists(filepath):
+        raise FileNotFoundError("The precipitation file entered could not be found.")
+
+
+@lru_cache(maxsize=1024)
+def _year_dates(year):
+    """Returns the datetimes of the first day of each month of a year.
+
+    Every block covers the same years, so the same twelve objects are shared by every cell in a file rather than a
+    new datetime being created for each value.
+    """
+
+    return tuple(datetime(year, month, 1) for month in range(1, 13))
+
+
+@lru_cache(maxsize=1024)
+def _year_month_indexes(year):
+    """Returns the integer month index (see schema.to_month_index) of each month of a year."""
+
+    return tuple(range(year * 12, year * 12 + 12))
+
+
+def _rows_from_block(x, y, rows, start_date, missing_value, calendar=_year_dates):
+    """Yields an (Xref, Yref, Date, Value) tuple for each monthly value in the rows of one 'Grid-ref=' block.
+
+    The Date of each value is taken from calendar(year), which returns the dates of the twelve months of the year.
+    """
+
+    # Loop through the years
+    for i, current_line in enumerate(rows):
+        # Get the values from the line
+        # If no values, there is a problem with the file and a ValueError is raised
+        data_values = get_data_values(current_line, missing_value)
+        if len(data_values) > 12:
+            raise ValueError("Data values could not be parsed.")
+
+        # Pair the monthly data in the line with the dates of the months
+        for date, value in zip(calendar(start_date + i), data_values):
+            yield x, y, date, value
+
+
+# The same rows with the integer month index stored by the managed sqlite schema in place of the datetime
+_index_rows_from_block = partial(_rows_from_block, calendar=_year_month_indexes)
+
+
+def _rows_from_raw_block(x, y, rows, start_date, missing_value, calendar=_year_dates):
+    """Returns an iterator over the same rows as _rows_from_block for the lines of one raw block read by the mmap
+    backend.
+
+    Each line is split once, and the values of the whole block are converted by map(int) and paired with their
+    dates by zip, so no Python code runs for each value. A block with a line that does not hold twelve values is
+    parsed line by line by _rows_from_block, so short and invalid lines are handled as by the text backend.
+    """
+
+    tokens = [line.split() for line in rows]
+    if any(len(line_tokens) != 12 for line_tokens in tokens):
+        return _rows_from_block(x, y, rows, start_date, missing_value, calendar)
+    try:
+        values = list(map(int, chain.from_iterable(tokens)))
+    except ValueError:
+        raise ValueError("Data values could not be parsed.")
+    if missing_value in values:
+        values = [None if value == missing_value else value for value in values]
+    dates = chain.from_iterable(map(calendar, range(start_date, start_date + len(tokens))))
+    return zip(repeat(x), repeat(y), dates, values)
+
+
+_index_rows_from_raw_block = partial(_rows_from_raw_block, calendar=_year_month_indexes)
+
+
+def _records_from_raw_block(x, y, rows, start_date, missing_value):
+    """Returns an iterator over the same records as records_from_block for the lines of one raw block read by the
+    mmap backend."""
+
+    return ({"Xref": x, "Yref": y, "Date": date, "Value": value}
+            for x, y, date, value in _rows_from_raw_block(x, y, rows, start_date, missing_value))
+
+
+def _rows_from_values(x, y, rows, start_date, missing_value, calendar=_year_dates):
+    """Yields an (Xref, Yref, Date, Value) tuple for each value in the already parsed rows of one block."""
+
+    for i, values in enumerate(rows):
+        for date, value in zip(calendar(start_date + i), values):
+            yield x, y, date, None if value == missing_value else value
+
+
+_index_rows_from_values = partial(_rows_from_values, calendar=_year_month_indexes)
+
+
+def _records_from_values(x, y, rows, start_date, missing_value):
+    """Yields a dictionary for each value in the already parsed rows of one block."""
+
+    for x, y, date, value in _rows_from_values(x, y, rows, start_date, missing_value):
+        yield {"Xref": x, "Yref": y, "Date": date, "Value": value}
+
+
+def records_from_block(x, y, rows, start_date, missing_value):
+    """Yields a record for each monthly value in the data rows of one 'Grid-ref=' block.
+
+    Parameters
+    ----------
+    x : int
+        The Xref of the block.
+    y : int
+        The Yref of the block.
+    rows : iterable
+        The data rows of the block, one year per row, as str or bytes.
+    start_date : int
+        The first year of the file, from the 'Years=' flag.
+    missing_value : int
+        The value of the 'Missing=' flag.
+
+    Yields
+    ------
+    dict
+        A dictionary with the keys Xref, Yref, Date and Value, in the same format as transform_data.
+
+    Raises
+    ------
+    ValueError
+        If a row of values cannot be parsed.
+    """
+
+    for x, y, date, value in _rows_from_block(x, y, rows, start_date, missing_value):
+        yield {
+            "Xref": x,
+            "Yref": y,
+            "Date": date,
+            "Value": value
+        }
+
+
+def _read_text_header(f):
+    """Reads the header of a file opened in text mode, up to and including the first 'Grid-ref=' line.
+
+    The header is parsed once, so the lines that follow are only checked for 'Grid-ref='. Returns the header values
+    and the first 'Grid-ref=' line, or an empty string if the file contains no blocks.
+    """
+
+    header_lines = []
+    line = f.readline()
+    while line and not line.startswith("Grid-ref"):
+        header_lines.append(line)
+        line = f.readline()
+    return get_header_values("".join(header_lines)), line
+
+
+def parse_grid_ref(line):
+    """Returns the X and Y values of a 'Grid-ref=' line, slicing the fixed-width fields where possible.
+
+    Parameters
+    ----------
+    line : str
+        The 'Grid-ref=' line.
+
+    Returns
+    -------
+    tuple
+        The (Xref, Yref) of the block.
+
+    Raises
+    ------
+    ValueError
+        If the line is not a valid grid reference.
+    """
+
+    try:
+        x, y = line[9:].split(",")
+        return int(x), int(y)
+    except ValueError:
+        return get_grid_ref_values(line)
+
+
+def _check_subset(bbox=None, cells=None, years=None):
+    """Checks a bounding box, list of cells and year range used to subset a file and returns them.
+
+    The cells are returned as a set of (Xref, Yref) tuples, so that an iterator of cells is only read once. Raises a
+    ValueError if any of them is not in the documented format.
+    """
+
+    try:
+        if bbox is not None:
+            x_min, x_max, y_min, y_max = bbox
+            if x_min > x_max or y_min > y_max:
+                raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError("The bounding box must be (x_min, x_max, y_min, y_max).") from None
+    try:
+        if cells is not None:
+            cells = {(x, y) for x, y in cells}
+    except (TypeError, ValueError):
+        raise ValueError("The cells must be (Xref, Yref) pairs.") from None
+    try:
+        if years is not None:
+            start_year, end_year = years
+            if start_year > end_year:
+                raise ValueError
+    except (TypeError, ValueError):
+        raise ValueError("The year range must be (start_year, end_year).") from None
+    return bbox, cells, years
+
+
+def _cell_filter(bbox=None, cells=None):
+    """Returns a function that tells whether a grid cell is selected by a bounding box and a set of cells.
+
+    Returns None if every cell is selected, so that readers can skip the check.
+    """
+
+    if bbox is None and cells is None:
+        return None
+    x_min, x_max, y_min, y_max = bbox if bbox is not None else (float("-inf"), float("inf"),) * 2
+    return lambda x, y: x_min <= x <= x_max and y_min <= y <= y_max and (cells is None or (x, y) in cells)
+
+
+def _year_slice(start_date, end_date, years=None):
+    """Returns the slice of a block's rows (one per year from start_date to end_date) covered by a year range."""
+
+    if years is None:
+        return slice(None)
+    return slice(max(years[0] - start_date, 0), max(min(years[1], end_date) - start_date + 1, 0))
+
+
+def _iter_text_blocks(f, line, n_rows, keep=None):
+    """Yields (x, y, rows) for each 'Grid-ref=' block in a file opened in text mode.
+
+    Parameters
+    ----------
+    f : file object
+        The file, positioned after line.
+    line : str
+        The first 'Grid-ref=' line, as returned by _read_text_header.
+    n_rows : int
+        The number of data rows in each block, i.e. the number of years in the file.
+    keep : function, optional
+        A function of (x, y) that returns False for blocks to be skipped, as returned by _cell_filter. The rows of
+        skipped blocks are read past without being kept or parsed.
+    """
+
+    while line:
+        if line.startswith("Grid-ref"):
+            x, y = parse_grid_ref(line)
+            if keep is None or keep(x, y):
+                yield x, y, [f.readline() for _ in range(n_rows)]
+            else:
+                for _ in range(n_rows):
+                    f.readline()
+        line = f.readline()
+
+
+def _generate_records(filepath, from_block=records_from_block, keep=None, years=None):
+    """Reads the precipitation file and yields a record for each monthly value.
+
+    The header is read and parsed once. After it, each line is either a 'Grid-ref=' line, which is followed by one
+    data row for each year, or a blank line, which is skipped. Only the blocks selected by keep and the rows of the
+    years in the year range are parsed.
+    """
+
+    with open_input(filepath, "r") as f:
+        header, line = _read_text_header(f)
+        start_date, missing_value = header["start_date"], header["missing_value"]
+
+        # Calculate the number of years included in the file (e.g 10)
+        date_range = calculate_number_of_years(start_date, header["end_date"])
+        rows_slice = _year_slice(start_date, header["end_date"], years)
+        first_year = start_date + (rows_slice.start or 0)
+        for x, y, rows in _iter_text_blocks(f, line, date_range, keep):
+            yield from from_block(x, y, rows[rows_slice], first_year, missing_value)
+
+
+def _generate_mmap_records(header, blocks, from_block=_records_from_raw_block, keep=None, years=None):
+    """Returns an iterator over a record for each monthly value in the raw blocks read by the mmap backend.
+
+    The iterators of the blocks are chained rather than yielded from, so each value is passed on without resuming
+    a Python generator.
+    """
+
+    rows_slice = _year_slice(header["start_date"], header["end_date"], years)
+    first_year = header["start_date"] + (rows_slice.start or 0)
+
+    def block_records():
+        for x, y, rows in blocks:
+            # The raw rows of a skipped block are never split or copied out of the mapping
+            if keep is None or keep(x, y):
+                yield from_block(x, y, split_rows(rows)[rows_slice], first_year, header["missing_value"])
+
+    return chain.from_iterable(block_records())
+
+
+def _generate_cached_records(header, blocks, from_values=_records_from_values, keep=None, years=None):
+    """Yields a record for each monthly value in the parsed blocks read from the cache."""
+
+    rows_slice = _year_slice(header["start_date"], header["end_date"], years)
+    first_year = header["start_date"] + (rows_slice.start or 0)
+    for x, y, values in blocks:
+        if keep is None or keep(x, y):
+            yield from from_values(x, y, values[rows_slice].tolist(), first_year, header["missing_value"])
+
+
+def _iter_cached_blocks(filepath):
+    """Returns the header and parsed blocks of a file from the cache, importing the cache (and NumPy) on first use."""
+
+    from precip.etl.cache import iter_cached_blocks
+    return iter_cached_blocks(filepath)
+
+
+def iter_rows(filepath, backend="text", month_index=False, bbox=None, cells=None, years=None):
+    """Returns an iterator over the precipitation data in the text file as tuples.
+
+    This is the same data as iter_records without building a dictionary for every value, for loaders which insert
+    rows directly (see load_to_db.load_to_sqlite).
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    backend : str, optional
+        The input backend, as for iter_records.
+    month_index : bool, optional
+        If True, Date is the integer month index stored by the managed sqlite schema (see schema.to_month_index)
+        rather than a datetime, so no date objects are needed between the file and the database.
+    bbox, cells, years : optional
+        The grid cells and years to read, as for iter_records.
+
+    Returns
+    -------
+    iterator
+        An iterator of (Xref, Yref, Date, Value) tuples, in the order of COLUMNS.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the backend or subset is not recognised. Errors in the file are raised during iteration, as for
+        iter_records.
+    """
+
+    check_backend(backend)
+    bbox, cells, years = _check_subset(bbox, cells, years)
+    check_filepath(filepath)
+    keep = _cell_filter(bbox, cells)
+    if backend == "cache":
+        return _generate_cached_records(*_iter_cached_blocks(filepath),
+                                        _index_rows_from_values if month_index else _rows_from_values, keep, years)
+    if backend == "mmap":
+        header, blocks = iter_mmap_blocks(filepath)
+        return _generate_mmap_records(header, blocks, _index_rows_from_raw_block if month_index else
+                                      _rows_from_raw_block, keep, years)
+    return _generate_records(filepath, _index_rows_from_block if month_index else _rows_from_block, keep, years)
+
+
+def iter_records(filepath, backend="text", bbox=None, cells=None, years=None):
+    """Returns an iterator over the precipitation records in the text file.
+
+    Records are produced as each 'Grid-ref=' block is read, so only the current line of the file is held in memory.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    backend : str, optional
+        The input backend: 'text' reads the file line by line, 'mmap' maps it into memory and parses the data rows
+        of each block at once from the mapped bytes without decoding them, and 'cache' reads the rows parsed by the
+        vectorised parser from the persistent cache in etl.cache, parsing and caching them if the file's content is
+        not cached.
+    bbox : tuple, optional
+        Only read the grid cells inside the inclusive bounding box (x_min, x_max, y_min, y_max).
+    cells : iterable, optional
+        Only read the grid cells with these (Xref, Yref). If bbox is also given, the cells must be inside it.
+    years : tuple, optional
+        Only read the values of the inclusive range of years (start_year, end_year).
+
+    Returns
+    -------
+    iterator
+        An iterator of dictionaries, each containing the Xref, Yref, Date and Value of one monthly measurement.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If the backend is not recognised, or the bounding box, cells or year range are not in the formats above.
+
+    Notes
+    -----
+    The file is checked when this function is called but parsed lazily, so a ValueError is raised during iteration
+    if the year range, a grid reference or a line of values cannot be parsed. The mmap backend reads the header
+    when this function is called, so an invalid header raises the ValueError immediately.
+
+    The subset is applied as the file is read: the data rows of blocks outside it are skipped without being parsed,
+    and rows outside the year range are dropped before any records are created. Only the grid references of the
+    skipped blocks are checked.
+    """
+
+    check_backend(backend)
+    bbox, cells, years = _check_subset(bbox, cells, years)
+    check_filepath(filepath)
+    keep = _cell_filter(bbox, cells)
+    if backend == "cache":
+        return _generate_cached_records(*_iter_cached_blocks(filepath), keep=keep, years=years)
+    if backend == "mmap":
+        return _generate_mmap_records(*iter_mmap_blocks(filepath), keep=keep, years=years)
+    return _generate_records(filepath, keep=keep, years=years)
+
+
+def _generate_batches(records, batch_size):
+    """Groups an iterator of records into lists of at most batch_size records."""
+
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_batches(filepath, batch_size=DEFAULT_BATCH_SIZE, backend="text", bbox=None, cells=None, years=None):
+    """Returns an iterator over fixed-size lists of precipitation records from the text file.
+
+    Peak memory depends on batch_size rather than the size of the file. Each batch can be passed to convert_to_df.
+
+    Parameters
+    ----------
+    filepath : str
+        The path of the precipitation file to be transformed.
+    batch_size : int, optional
+        The maximum number of records in each batch. The final batch may be smaller.
+    backend : str, optional
+        The input backend, as for iter_records.
+    bbox, cells, years : optional
+        The grid cells and years to read, as for iter_records.
+
+    Returns
+    -------
+    iterator
+        An iterator of lists of dictionaries in the same format as transform_data.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the filepath cannot be found.
+    ValueError
+        If batch_size is not a positive integer, or the backend or subset is not recognised.
+    """
+
+    if not isinstance(batch_size, int) or batch_size < 1:
+        raise ValueError("The batch size must be a positive integer.")
+    return _generate_batches(iter_records(filepath, backend, bbox, cells, years), batch_size)
+
+
+def transform_data(filepath, backend="text", bbox=None, cells=None, years=None):
     """Returns a list of dictionaries containing precipitation data from the text file.
 
     This function reads the precipitation file passed as an argument and transforms the raw string information
@@ -26,6 +505,14 @@ def transform_data(filepath):
     ----------
     filepath : str
         The path of the precipitation file to be transformed.
+    backend : str, optional
+        The input backend, as for iter_records.
+    bbox : tuple, optional
+        Only return the grid cells inside the inclusive bounding box (x_min, x_max, y_min, y_max).
+    cells : iterable, optional
+        Only return the grid cells with these (Xref, Yref). If bbox is also given, the cells must be inside it.
+    years : tuple, optional
+        Only return the values of the inclusive range of years (start_year, end_year).
 
     Returns
     -------
@@ -36,60 +523,42 @@ def transform_data(filepath):
     ------
     FileNotFoundError
         If the filepath cannot be found.
+    ValueError
+        If the backend is not recognised, or the bounding box, cells or year range are not in the formats above.
+
+    Notes
+    -----
+    The whole subset is held in memory. Use iter_records or iter_batches for large files. Blocks outside the subset
+    are skipped without being parsed, so a regional extract costs little more than reading past the other blocks.
     """
 
-    # Check the file exists
-    if not os.path.exists(filepath):
-        raise FileNotFoundError("The precipitation file entered could not be found.")
+    check_backend(backend)
+    bbox, cells, years = _check_subset(bbox, cells, years)
+    try:
+        values_to_write = list(iter_records(filepath, backend, bbox, cells, years))
+    except ValueError as exc:
+        print(exc)
+        return None
+    return values_to_write
 
-    values_to_write = []
-    with open(filepath, "r") as f:
-        for line in f:
-            # Get the start and end year if 'years' is in the line
-            if "years" in line.lower():
-                try:
-                    start_date, end_date = get_year_range(line)
-                except ValueError as exc:
-                    return None
-
-                # Calculate the number of years included in the file (e.g 10)
-                date_range = calculate_number_of_years(start_date, end_date)
-
-            # Get the missing data value (assumed to be -999 is missing flag not present)
-            if "missing" in line.lower():
-                missing_value = get_missing_data_value(line)
-
-            # If the line is a grid-ref line, use this as a marker for the rainfall data
-            if line.startswith("Grid-ref"):
-                # Get the x and y values first
-                try:
-                    x, y = get_grid_ref_values(line)
-                except ValueError as exc:
-                    print(exc)
-                    return None
-                else:
-                    # Loop through the years
-                    for i in range(date_range):
-                        # Read the next line
-                        current_line = f.readline()
-                        # Get the values from the line
-                        # If no values, there is a problem with the file and the script ends
-                        try:
-                            data_values = get_data_values(current_line, missing_value)
-                        except ValueError as exc:
-                            print(exc)
-                            return None
-                        # Loop through the monthly data in the line and create a record
-                        for month, value in enumerate(data_values):
-                            new_record = {
-                                "Xref": x,
-                                "Yref": y,
-                                "Date": datetime(start_date + i, month + 1, 1),
-                                "Value": value
-                            }
-                            values_to_write.append(new_record)
 
-    return values_to_write
+def _compact_column(series):
+    """Returns a column of whole numbers as the smallest integer dtype that holds it.
+
+    The dtype is nullable (e.g. Int16) if the column has missing values. Other columns are returned unchanged.
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    values = series.dropna()
+    if not (pd.api.types.is_numeric_dtype(series) or values.empty) or (values % 1 != 0).any():
+        return series
+    for dtype in ("int16", "int32", "int64"):
+        limits = np.iinfo(dtype)
+        if values.empty or (values.min() >= limits.min and values.max() <= limits.max):
+            return series.astype(dtype.capitalize() if series.isna().any() else dtype)
+    return series
 
 
 def convert_to_df(data):
@@ -103,7 +572,8 @@ def convert_to_df(data):
     Returns
     -------
     pandas.DataFrame
-        The DataFrame containing the final data.
+        The DataFrame containing the final data. Xref, Yref and Value are stored in the smallest integer dtype that
+        holds them, with a nullable dtype for Value if any values are missing.
 
     Raises
     ------
@@ -111,6 +581,14 @@ def convert_to_df(data):
         If the argument passed a list of dictionaries.
     """
 
+    import pandas as pd
+
     if any(not isinstance(record, dict) for record in data):
         raise TypeError("The data passed must be a list of dictionaries.")
-    return pd.DataFrame(data=data, columns=list(data[0].keys()))
+    df = pd.DataFrame(data=data, columns=list(data[0].keys()))
+
+    # Use compact integer columns rather than the float64 or object columns pandas infers when values are missing
+    for column in ("Xref", "Yref", "Value"):
+        if column in df.columns:
+            df[column] = _compact_column(df[column])
+    return df
@@ -0,0 +1,271 @@
+"""Query the precipitation database
+
+This module contains functions to read precipitation data back from the managed precip_values table as NumPy and
+pandas objects, for analysis code that would otherwise convert the lists returned by etl.queries. The queries are
+those of etl.queries, so a cell's series or a bounding box is a range scan of the (Xref, Yref, Date) primary key
+and annual totals and climatologies are read from the aggregate tables when the table has them. Queries can be run
+on a single connection or on a ConnectionPool, which lets several threads query the database at once. The SQL of
+each query is fixed for a table, so sqlite3 reuses the prepared statement from its per-connection statement cache
+rather than compiling it again on every call.
+
+The module exports the following:
+
+    ConnectionPool       A thread-safe pool of read-only connections to a precipitation database
+    cell_series          Returns the monthly series for one cell
+    bounding_box         Returns the values for every cell in a bounding box and date range
+    monthly_climatology  Returns the mean value of each calendar month for one cell
+    annual_totals        Returns the total of each year for one cell
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from precip.etl.queries import _cell_series_rows, _bounding_box_rows, get_monthly_climatology, get_annual_totals
+from precip.etl.schema import PRECIP_TABLE
+
+# The size of sqlite3's prepared statement cache for each pooled connection
+STATEMENT_CACHE_SIZE = 256
+
+# datetime64[M] counts months from January 1970, while the month index counts from January of year 0
+_EPOCH_MONTH = 1970 * 12
+
+
+class ConnectionPool:
+    """A thread-safe pool of read-only connections to a precipitation database.
+
+    Connections are opened when they are first needed, up to size, and returned to the pool after each query. A
+    thread that asks for a connection while all of them are in use waits for one to be returned.
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the sqlite database.
+    size : int, optional
+        The maximum number of open connections.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the database cannot be opened.
+    ValueError
+        If size is not a positive integer.
+    """
+
+    def __init__(self, db_path, size=4):
+        if not isinstance(size, int) or size < 1:
+            raise ValueError("The pool size must be a positive integer.")
+        self.db_path = db_path
+        self.size = size
+        self._uri = Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        # Open one connection up front so that a missing database is reported straight away
+        self._idle.put(self._open())
+        self._opened = 1
+
+    def _open(self):
+        """Opens a new read-only connection."""
+
+        try:
+            return sqlite3.connect(self._uri, uri=True, check_same_thread=False,
+                                   cached_statements=STATEMENT_CACHE_SIZE)
+        except sqlite3.OperationalError:
+            raise FileNotFoundError("The database {} could not be opened.".format(self.db_path))
+
+    def _acquire(self):
+        """Returns an idle connection, opening a new one if fewer than size are open, or waits for one."""
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_open = self._opened < self.size
+            if can_open:
+                self._opened += 1
+        if not can_open:
+            return self._idle.get()
+        try:
+            return self._open()
+        except FileNotFoundError:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection from the pool for the duration of the context."""
+
+        connection = self._acquire()
+        try:
+            yield connection
+        finally:
+            self._idle.put(connection)
+
+    def close(self):
+        """Closes every idle connection in the pool."""
+
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@contextmanager
+def _borrow(source):
+    """Yields a connection from a ConnectionPool, or the connection itself if source is a sqlite3 connection."""
+
+    if isinstance(source, ConnectionPool):
+        with source.connection() as connection:
+            yield connection
+    else:
+        yield source
+
+
+def _to_dates(month_indexes):
+    """Converts an array of month indexes to datetime64[ns] dates on the first day of each month."""
+
+    months = np.asarray(month_indexes, dtype=np.int64) - _EPOCH_MONTH
+    return months.astype("datetime64[M]").astype("datetime64[ns]")
+
+
+def _values(values):
+    """Converts a sequence of values that may contain None to a nullable Int32 array."""
+
+    return pd.array(values, dtype="Int32")
+
+
+def cell_series(source, x, y, start_date=None, end_date=None, table_name=PRECIP_TABLE):
+    """Returns the monthly precipitation series for one cell.
+
+    Parameters
+    ----------
+    source : ConnectionPool or sqlite3.Connection
+        The pool or connection to query.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_date : datetime.date or datetime.datetime, optional
+        The first month to return. Defaults to the start of the series.
+    end_date : datetime.date or datetime.datetime, optional
+        The last month to return, inclusive. Defaults to the end of the series.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    pandas.Series
+        The values (Int32, with missing values as NA) indexed by the first day of each month.
+    """
+
+    with _borrow(source) as connection:
+        rows = _cell_series_rows(connection, x, y, start_date, end_date, table_name).fetchall()
+    dates, values = zip(*rows) if rows else ((), ())
+    return pd.Series(_values(values), index=pd.DatetimeIndex(_to_dates(dates), name="Date"), name="Value")
+
+
+def bounding_box(source, x_min, x_max, y_min, y_max, start_date=None, end_date=None, table_name=PRECIP_TABLE):
+    """Returns the precipitation values for every cell in a bounding box and date range.
+
+    Parameters
+    ----------
+    source : ConnectionPool or sqlite3.Connection
+        The pool or connection to query.
+    x_min, x_max : int
+        The inclusive range of Xref values.
+    y_min, y_max : int
+        The inclusive range of Yref values.
+    start_date : datetime.date or datetime.datetime, optional
+        The first month to return. Defaults to the start of the series.
+    end_date : datetime.date or datetime.datetime, optional
+        The last month to return, inclusive. Defaults to the end of the series.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame with the columns Xref, Yref (int16), Date and Value (Int32), ordered by cell and date.
+    """
+
+    with _borrow(source) as connection:
+        rows = _bounding_box_rows(connection, x_min, x_max, y_min, y_max, start_date, end_date,
+                                  table_name).fetchall()
+    xs, ys, dates, values = zip(*rows) if rows else ((), (), (), ())
+    return pd.DataFrame({
+        "Xref": np.array(xs, dtype=np.int16),
+        "Yref": np.array(ys, dtype=np.int16),
+        "Date": _to_dates(dates),
+        "Value": _values(values)
+    })
+
+
+def monthly_climatology(source, x, y, start_year=None, end_year=None, table_name=PRECIP_TABLE):
+    """Returns the mean value of each calendar month for one cell.
+
+    Parameters
+    ----------
+    source : ConnectionPool or sqlite3.Connection
+        The pool or connection to query.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_year, end_year : int, optional
+        The inclusive range of years to average over. Defaults to every year in the table.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    pandas.Series
+        The mean of the non-missing values (float64) indexed by month number, 1 to 12. A month with no values is NaN.
+    """
+
+    with _borrow(source) as connection:
+        means = get_monthly_climatology(connection, x, y, start_year, end_year, table_name)
+    means = np.array(means, dtype=np.float64)
+    return pd.Series(means, index=pd.RangeIndex(1, 13, name="Month"), name="Value")
+
+
+def annual_totals(source, x, y, start_year=None, end_year=None, table_name=PRECIP_TABLE):
+    """Returns the total of each year for one cell.
+
+    Parameters
+    ----------
+    source : ConnectionPool or sqlite3.Connection
+        The pool or connection to query.
+    x : int
+        The Xref of the cell.
+    y : int
+        The Yref of the cell.
+    start_year, end_year : int, optional
+        The inclusive range of years to return. Defaults to every year in the table.
+    table_name : str, optional
+        The name of the precipitation table.
+
+    Returns
+    -------
+    pandas.DataFrame
+        A DataFrame indexed by year with the columns Total (the sum of the non-missing values, int64) and Missing
+        (the number of missing months in the table).
+    """
+
+    with _borrow(source) as connection:
+        rows = get_annual_totals(connection, x, y, start_year, end_year, table_name)
+    years, totals, missing = zip(*rows) if rows else ((), (), ())
+    return pd.DataFrame({"Total": np.array(totals, dtype=np.int64), "Missing": np.array(missing, dtype=np.int64)},
+                        index=pd.Index(np.array(years, dtype=np.int64), name="Year"))
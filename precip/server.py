@@ -0,0 +1,426 @@
+"""Local query service for precipitation data
+
+This module contains a long-running asyncio server that answers cell and time range queries, so that programs
+making thousands of lookups do not start Python, import pandas and open precip.db for each one. The server listens
+on a localhost TCP port or a unix socket and speaks newline-delimited json: each request is one json object on a line
+and each response is one json object on a line, in the same order. For example:
+
+    {"op": "cell", "x": 1, "y": 148, "start": "1991-01", "end": "1991-12"}
+    {"ok": true, "result": {"x": 1, "y": 148, "start": "1991-01", "values": [3020, 2820, ...]}}
+
+The data is held in a PrecipCube, either in memory or memory-mapped from a saved .npy file, and read without leaving
+the event loop. Queries for a database are run on a ConnectionPool in a thread pool executor, and the series of
+recently used cells are kept in an LRU cache. If both are given, the cube answers the months it covers. The cache
+is not told when the database is reloaded, so a program that loads new data sends a 'reload' request to clear it.
+
+The service can be run from the command line:
+
+    python -m precip.server --cube precip.npy --db precip.db --port 8765
+
+The module exports the following:
+
+    PrecipService   Answers cell and time range queries from a cube and/or a database
+    start_server    Starts serving a PrecipService on a TCP port or unix socket
+    run_server      Runs a server until it is interrupted
+    ServiceClient   A blocking client for the service
+    main            Parses the command line and runs the server
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import socket
+import sqlite3
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from precip.etl.cube import PrecipCube, transform_cube
+from precip.etl.schema import PRECIP_TABLE, _quote
+from precip.query import ConnectionPool
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_SIZE = 4096
+
+logger = logging.getLogger("precip.server")
+
+# Requests longer than this are rejected rather than buffered
+_MAX_LINE = 1 << 16
+
+
+def _parse_month(month):
+    """Returns the month index (see schema.to_month_index) of a 'YYYY-MM' or 'YYYY-MM-DD' string."""
+
+    try:
+        year, month = int(month[:4]), int(month[5:7])
+    except (TypeError, ValueError):
+        raise ValueError("Invalid month {!r}. Expected 'YYYY-MM'.".format(month))
+    if not 1 <= month <= 12:
+        raise ValueError("Invalid month {!r}. Expected 'YYYY-MM'.".format(month))
+    return year * 12 + month - 1
+
+
+def _format_month(month_index):
+    """Returns a month index as a 'YYYY-MM' string."""
+
+    year, month = divmod(month_index, 12)
+    return "{:04d}-{:02d}".format(year, month + 1)
+
+
+def _cell(request):
+    """Returns the (Xref, Yref) of a request."""
+
+    try:
+        return int(request["x"]), int(request["y"])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("The request must give integer 'x' and 'y' grid references.")
+
+
+class PrecipService:
+    """Answers cell and time range queries from a cube and/or a database.
+
+    Parameters
+    ----------
+    cube : PrecipCube, optional
+        The data held in memory or memory-mapped.
+    db_path : str, optional
+        The path of a sqlite database with the managed precipitation table.
+    table_name : str, optional
+        The name of the precipitation table.
+    pool_size : int, optional
+        The number of database connections and executor threads.
+    cache_size : int, optional
+        The number of cell series read from the database that are kept in the LRU cache.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the database cannot be opened.
+    ValueError
+        If neither a cube nor a database is given.
+    """
+
+    def __init__(self, cube=None, db_path=None, table_name=PRECIP_TABLE, pool_size=4, cache_size=DEFAULT_CACHE_SIZE):
+        if cube is None and db_path is None:
+            raise ValueError("The service needs a cube or a database.")
+        self.cube = cube
+        self.pool = ConnectionPool(db_path, size=pool_size) if db_path is not None else None
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="precip-db") \
+            if db_path is not None else None
+        self._query = "SELECT Date, Value FROM {} WHERE Xref = ? AND Yref = ? ORDER BY Date".format(
+            _quote(table_name))
+        self.read_cell = lru_cache(maxsize=cache_size)(self._read_cell)
+        if cube is not None:
+            self._cube_start = cube.start_date * 12
+            self._cube_end = self._cube_start + cube.values.shape[0] - 1
+
+    def _read_cell(self, x, y):
+        """Reads the month indexes and values of a cell from the database."""
+
+        with self.pool.connection() as connection:
+            rows = connection.execute(self._query, (x, y)).fetchall()
+        return tuple(row[0] for row in rows), tuple(row[1] for row in rows)
+
+    def _cube_covers(self, x, y, start, end):
+        """Returns True if the cube holds the cell and every month from start to end."""
+
+        if self.cube is None:
+            return False
+        n_y, n_x = self.cube.values.shape[1:]
+        return 1 <= x <= n_x and 1 <= y <= n_y and self._cube_start <= start and end <= self._cube_end
+
+    def _cube_series(self, x, y, start, end):
+        """Returns the values of a cell from the cube, with missing values as None."""
+
+        missing_value = self.cube.missing_value
+        values = self.cube.cell(x, y)[start - self._cube_start:end - self._cube_start + 1].tolist()
+        return [None if value == missing_value else value for value in values]
+
+    def _db_series(self, x, y, start, end):
+        """Returns the values of a cell from the cached database series, with months not in the table as None."""
+
+        month_indexes, values = self.read_cell(x, y)
+        series = [None] * (end - start + 1)
+        for i in range(bisect_left(month_indexes, start), bisect_right(month_indexes, end)):
+            series[month_indexes[i] - start] = values[i]
+        return series
+
+    def _range(self, request):
+        """Returns the month index range of a request, defaulting to the range of the cube or the cell."""
+
+        start, end = request.get("start"), request.get("end")
+        if start is not None and end is not None:
+            return _parse_month(start), _parse_month(end)
+        if self.cube is not None:
+            default_start, default_end = self._cube_start, self._cube_end
+        else:
+            month_indexes = self.read_cell(*_cell(request))[0]
+            default_start, default_end = (month_indexes[0], month_indexes[-1]) if month_indexes else (0, -1)
+        return (_parse_month(start) if start is not None else default_start,
+                _parse_month(end) if end is not None else default_end)
+
+    async def _run(self, function, *args):
+        """Runs a database read in the executor."""
+
+        if self.pool is None:
+            raise ValueError("The request is outside the range of the cube.")
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def cell(self, request):
+        """Returns the monthly series of a cell between the optional 'start' and 'end' months, inclusive."""
+
+        x, y = _cell(request)
+        if self.cube is not None or "start" in request and "end" in request:
+            start, end = self._range(request)
+        else:
+            start, end = await self._run(self._range, request)
+        if end < start:
+            values = []
+        elif self._cube_covers(x, y, start, end):
+            values = self._cube_series(x, y, start, end)
+        else:
+            values = await self._run(self._db_series, x, y, start, end)
+        return {"x": x, "y": y, "start": _format_month(start), "values": values}
+
+    async def value(self, request):
+        """Returns the value of a cell in the 'date' month, or None if it is missing."""
+
+        x, y = _cell(request)
+        month_index = _parse_month(request.get("date"))
+        if self._cube_covers(x, y, month_index, month_index):
+            return self._cube_series(x, y, month_index, month_index)[0]
+        return (await self._run(self._db_series, x, y, month_index, month_index))[0]
+
+    async def ping(self, request):
+        """Returns 'pong'."""
+
+        return "pong"
+
+    async def reload(self, request):
+        """Clears the LRU cache, so that cells are read again from the database, and returns the number cleared."""
+
+        cleared = self.read_cell.cache_info().currsize
+        self.read_cell.cache_clear()
+        return cleared
+
+    async def info(self, request):
+        """Returns the sources of the service and the state of the cache."""
+
+        cache = self.read_cell.cache_info()
+        info = {"database": self.pool.db_path if self.pool is not None else None,
+                "cache": {"hits": cache.hits, "misses": cache.misses, "size": cache.currsize}}
+        if self.cube is not None:
+            info["cube"] = {"start": _format_month(self._cube_start), "end": _format_month(self._cube_end),
+                            "shape": list(self.cube.values.shape)}
+        return info
+
+    async def handle(self, request):
+        """Answers one request.
+
+        Parameters
+        ----------
+        request : dict
+            The request, with the operation in 'op': 'ping', 'info', 'reload', 'cell' or 'value'.
+
+        Returns
+        -------
+        dict
+            The response: {'ok': True, 'result': ...} or {'ok': False, 'error': message}. An unexpected error is
+            logged and answered with an error response, so that it does not close the client's connection.
+        """
+
+        operations = {"ping": self.ping, "info": self.info, "reload": self.reload, "cell": self.cell,
+                      "value": self.value}
+        try:
+            if not isinstance(request, dict) or request.get("op") not in operations:
+                raise ValueError("Unknown operation. Choose from: {}.".format(", ".join(operations)))
+            return {"ok": True, "result": await operations[request["op"]](request)}
+        except (ValueError, sqlite3.Error) as exc:
+            return {"ok": False, "error": str(exc)}
+        except Exception as exc:
+            logger.exception("The request %r could not be answered.", request)
+            return {"ok": False, "error": "The request could not be answered: {}".format(exc)}
+
+    def close(self):
+        """Closes the database connections and the executor."""
+
+        if self.pool is not None:
+            self.executor.shutdown(wait=True)
+            self.pool.close()
+
+
+async def _serve_connection(service, reader, writer):
+    """Answers the requests on one connection until the client closes it."""
+
+    try:
+        while True:
+            try:
+                line = await reader.readline()
+            except (asyncio.LimitOverrunError, ValueError):
+                response = {"ok": False, "error": "The request is too long."}
+                writer.write(json.dumps(response).encode() + b"\n")
+                break
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": "The request is not valid json."}
+            else:
+                response = await service.handle(request)
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+    """Starts serving a PrecipService on a TCP port or unix socket.
+
+    Parameters
+    ----------
+    service : PrecipService
+        The service that answers the requests.
+    host : str, optional
+        The address to listen on. Defaults to localhost only.
+    port : int, optional
+        The TCP port. Use 0 to choose a free port, which can be read from the server's sockets.
+    path : str, optional
+        The path of a unix socket to listen on instead of a TCP port.
+
+    Returns
+    -------
+    asyncio.Server
+        The server, which is already accepting connections.
+    """
+
+    def handler(reader, writer):
+        return _serve_connection(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path=path, limit=_MAX_LINE)
+    return await asyncio.start_server(handler, host=host, port=port, limit=_MAX_LINE)
+
+
+def run_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+    """Runs a server for a PrecipService until it is interrupted, then closes the service.
+
+    Parameters are as for start_server.
+    """
+
+    async def serve():
+        server = await start_server(service, host, port, path)
+        print("Serving precipitation data on {}.".format(path or "{}:{}".format(host, port)))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+
+class ServiceClient:
+    """A blocking client for the service, which keeps one connection open for many requests.
+
+    Parameters
+    ----------
+    host : str, optional
+        The address of the server.
+    port : int, optional
+        The TCP port of the server.
+    path : str, optional
+        The path of a unix socket to connect to instead of a TCP port.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(path)
+        else:
+            self._socket = socket.create_connection((host, port))
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._socket.makefile("rwb")
+
+    def request(self, op, **params):
+        """Sends a request and returns its result.
+
+        Parameters
+        ----------
+        op : str
+            The operation: 'ping', 'info', 'reload', 'cell' or 'value'.
+        **params
+            The parameters of the operation, e.g. x=1, y=148, start='1991-01'.
+
+        Returns
+        -------
+        object
+            The result of the request.
+
+        Raises
+        ------
+        ValueError
+            If the server could not answer the request.
+        ConnectionError
+            If the server closed the connection.
+        """
+
+        self._file.write(json.dumps(dict(params, op=op)).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The server closed the connection.")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise ValueError(response["error"])
+        return response["result"]
+
+    def close(self):
+        """Closes the connection."""
+
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main(argv=None):
+    """Parses the command line and runs the server."""
+
+    parser = argparse.ArgumentParser(prog="python -m precip.server",
+                                     description="Serve precipitation queries on a local socket.")
+    parser.add_argument("--cube", help="A cube saved with PrecipCube.save (memory-mapped) or a .pre file (parsed "
+                                       "into memory).")
+    parser.add_argument("--db", help="A precip.db database with the managed precipitation table.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="The address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="The TCP port to listen on.")
+    parser.add_argument("--socket", help="Listen on a unix socket at this path instead of a TCP port.")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help="The number of database cells kept in the LRU cache.")
+    args = parser.parse_args(argv)
+    if args.cube is None and args.db is None:
+        parser.error("a cube or a database is required")
+
+    try:
+        cube = None
+        if args.cube is not None:
+            cube = transform_cube(args.cube, backend="mmap") if args.cube.endswith(".pre") else \
+                PrecipCube.load(args.cube)
+        service = PrecipService(cube, args.db, cache_size=args.cache_size)
+    except (FileNotFoundError, ValueError) as exc:
+        print(exc)
+        return
+    run_server(service, args.host, args.port, args.socket)
+
+
+if __name__ == "__main__":
+    main()
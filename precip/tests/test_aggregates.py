@@ -0,0 +1,161 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime
+import pandas as pd
+from precip.etl.aggregates import aggregate_tables, create_aggregate_tables, has_aggregate_tables, \
+    cell_ranges, aggregate_rows, delete_cell_aggregates
+from precip.etl.load_to_db import load_to_sqlite, write_to_db
+from precip.etl.schema import to_month_index
+
+
+def _rows(cells, years, offset=0):
+    return [(x, y, to_month_index(datetime(year, month, 1)), x * 100 + month + offset)
+            for x, y in cells for year in years for month in range(1, 13)]
+
+
+class TestAggregates(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "precip.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _load(self, rows):
+        load_to_sqlite(self.db_path, "precip_values", rows, batch_size=50, managed_schema=True, without_rowid=True,
+                       month_index=True, aggregates=True)
+
+    def _aggregates(self):
+        """Returns the aggregate tables and the same aggregates computed from precip_values."""
+
+        connection = sqlite3.connect(self.db_path)
+        try:
+            stored = [connection.execute("SELECT * FROM {} ORDER BY 1, 2, 3".format(table)).fetchall()
+                      for table in aggregate_tables()]
+            expected = [connection.execute(
+                "SELECT Xref, Yref, {}, CAST(TOTAL(Value) AS INTEGER), COUNT(Value), COUNT(*) - COUNT(Value) "
+                "FROM precip_values GROUP BY 1, 2, 3 ORDER BY 1, 2, 3".format(period)).fetchall()
+                for period in ("Date / 12", "Date % 12 + 1")]
+        finally:
+            connection.close()
+        return stored, expected
+
+    def test_aggregate_tables_valid(self):
+        self.assertEqual(("precip_values_annual", "precip_values_monthly"), aggregate_tables())
+
+    def test_create_aggregate_tables_valid(self):
+        connection = sqlite3.connect(":memory:")
+        self.assertFalse(has_aggregate_tables(connection))
+        create_aggregate_tables(connection)
+        self.assertTrue(has_aggregate_tables(connection))
+        connection.close()
+
+    def test_cell_ranges_valid(self):
+        rows = _rows([(1, 1), (1, 2)], (2000, 2001))
+        self.assertEqual([(1, 1, 24000, 24023), (1, 2, 24000, 24023)], cell_ranges(rows))
+
+    def test_cell_ranges_boundary_no_rows(self):
+        self.assertEqual([], cell_ranges([]))
+
+    def test_aggregate_rows_valid(self):
+        rows = [(1, 2, "2000-01-01 00:00:00", 5), (1, 2, datetime(2000, 2, 1), None),
+                (1, 2, "2001-01-01 00:00:00", 7)]
+        annual, monthly = aggregate_rows(rows)
+        self.assertEqual({(1, 2, 2000): [5, 1, 1], (1, 2, 2001): [7, 1, 0]}, dict(annual))
+        self.assertEqual({(1, 2, 1): [12, 2, 0], (1, 2, 2): [0, 0, 1]}, dict(monthly))
+
+    def test_load_to_sqlite_valid_aggregates(self):
+        rows = _rows([(1, 1), (1, 2), (2, 1)], range(2000, 2010))
+        rows[5] = rows[5][:3] + (None,)
+        self._load(rows)
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+        self.assertEqual(30, len(stored[0]))
+        self.assertEqual((1, 1, 2000, sum(100 + month for month in range(1, 13)) - 106, 11, 1), stored[0][0])
+
+    def test_load_to_sqlite_valid_aggregates_appended_years(self):
+        self._load(_rows([(1, 1), (2, 1)], range(2000, 2005)))
+        self._load(_rows([(1, 1), (3, 1)], range(2005, 2010)))
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+        self.assertEqual((1, 1, 1, 10 * 101, 10, 0), stored[1][0])
+
+    def test_load_to_sqlite_valid_aggregates_replaced_rows(self):
+        self._load(_rows([(1, 1), (2, 1)], range(2000, 2005)))
+        replacement = _rows([(2, 1)], range(2003, 2007), offset=1000)
+        replacement[0] = replacement[0][:3] + (None,)
+        self._load(replacement)
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+
+    def test_load_to_sqlite_valid_existing_aggregates_are_updated(self):
+        self._load(_rows([(1, 1)], range(2000, 2005)))
+        load_to_sqlite(self.db_path, "precip_values", _rows([(1, 1)], range(2005, 2007)), managed_schema=True,
+                       without_rowid=True, month_index=True)
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+
+    def test_load_to_sqlite_valid_aggregates_added_to_existing_rows(self):
+        load_to_sqlite(self.db_path, "precip_values", _rows([(1, 1), (2, 2)], range(2000, 2003)),
+                       managed_schema=True, without_rowid=True, month_index=True)
+        # The aggregates are turned on while reloading one cell, and the other cell is filled from its rows
+        self._load(_rows([(1, 1)], range(2000, 2003), offset=5))
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+        self.assertEqual(2 * 3, len(stored[0]))
+
+    def test_write_to_db_valid_aggregates_added_to_existing_rows(self):
+        df = pd.DataFrame({"Xref": [1, 1], "Yref": [2, 2], "Date": pd.to_datetime(["2000-01-01", "2000-02-01"]),
+                           "Value": [5, None]})
+        self.assertTrue(write_to_db(self.db_path, "precip", df))
+        self.assertTrue(write_to_db(self.db_path, "precip", df.iloc[:1], aggregates=True))
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual([(1, 2, 2000, 10, 2, 1)], connection.execute("SELECT * FROM precip_annual").fetchall())
+        self.assertEqual([(1, 2, 1, 10, 2, 0), (1, 2, 2, 0, 0, 1)],
+                         connection.execute("SELECT * FROM precip_monthly ORDER BY Month").fetchall())
+        connection.close()
+
+    def test_load_to_sqlite_invalid_aggregates_columns(self):
+        with self.assertRaises(ValueError):
+            load_to_sqlite(self.db_path, "precip", [(1, 2)], columns=("Xref", "Yref"), aggregates=True)
+
+    def test_write_to_db_valid_aggregates(self):
+        df = pd.DataFrame({"Xref": [1, 1, 1], "Yref": [2, 2, 2],
+                           "Date": pd.to_datetime(["2000-01-01", "2000-02-01", "2001-01-01"]),
+                           "Value": pd.array([5, None, 7], dtype="Int16")})
+        self.assertTrue(write_to_db(self.db_path, "precip", df, aggregates=True))
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual([(1, 2, 2000, 5, 1, 1), (1, 2, 2001, 7, 1, 0)],
+                         connection.execute("SELECT * FROM precip_annual ORDER BY Year").fetchall())
+        self.assertEqual((1, 2, 1, 12, 2, 0),
+                         connection.execute("SELECT * FROM precip_monthly WHERE Month = 1").fetchone())
+        connection.close()
+
+    def test_write_to_db_valid_aggregates_nan(self):
+        df = pd.DataFrame({"Xref": [1, 1], "Yref": [2, 2], "Date": pd.to_datetime(["2000-01-01", "2000-02-01"]),
+                           "Value": [5.0, float("nan")]})
+        self.assertTrue(write_to_db(self.db_path, "precip", df, aggregates=True))
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual([(1, 2, 2000, 5, 1, 1)], connection.execute("SELECT * FROM precip_annual").fetchall())
+        connection.close()
+
+    def test_delete_cell_aggregates_valid(self):
+        self._load(_rows([(1, 1), (2, 1)], range(2000, 2002)))
+        connection = sqlite3.connect(self.db_path)
+        ranges = [(1, 1, to_month_index(datetime(2001, 1, 1)), to_month_index(datetime(2001, 12, 1)))]
+        delete_cell_aggregates(connection, ranges)
+        connection.executemany("DELETE FROM precip_values WHERE Xref = ? AND Yref = ? AND Date BETWEEN ? AND ?",
+                               ranges)
+        connection.commit()
+        connection.close()
+        # The aggregates of the cell's other year are kept
+        stored, expected = self._aggregates()
+        self.assertEqual(expected, stored)
+        self.assertEqual([(1, 1, 2000), (2, 1, 2000), (2, 1, 2001)], [row[:3] for row in stored[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+import numpy as np
+from datetime import datetime
+from precip.etl.arrays import parse_block, iter_blocks, transform_arrays, arrays_to_df
+from precip.etl.transform import transform_data
+from precip.config import TEST_FILE
+
+# Cells in the test file with a row where two five digit values touch (e.g. ' 1044 262413385 2892 ...'). The
+# whitespace-splitting reference parser reads these rows as eleven values, the fixed-width parser as twelve.
+FUSED_CELLS = {(48, 222), (49, 221), (49, 222), (50, 221), (107, 280)}
+
+
+class TestParseBlock(unittest.TestCase):
+
+    def test_parse_block_valid(self):
+        rows = b" 3020 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630\n" \
+               b"  490  290  280  230  200  250  440  530  460  420  530  450\n"
+        expected = [[3020, 2820, 3040, 2880, 1740, 1360, 980, 990, 1410, 1770, 2580, 2630],
+                    [490, 290, 280, 230, 200, 250, 440, 530, 460, 420, 530, 450]]
+        self.assertEqual(expected, parse_block(rows, 2).tolist())
+
+    def test_parse_block_valid_with_missing_value(self):
+        rows = b" -999 2820 3040 2880 1740 1360  980  990 1410 1770 2580 -999"
+        self.assertEqual([-999, 2820, 3040, 2880, 1740, 1360, 980, 990, 1410, 1770, 2580, -999],
+                         parse_block(rows, 1)[0].tolist())
+
+    def test_parse_block_boundary_fused_values(self):
+        rows = b" 1044 262413385 2892 1305 1228  824 1858 1220 3491 1648 1547\n"
+        self.assertEqual([1044, 2624, 13385, 2892, 1305, 1228, 824, 1858, 1220, 3491, 1648, 1547],
+                         parse_block(rows, 1)[0].tolist())
+
+    def test_parse_block_invalid_not_fixed_width_integers(self):
+        rows = b"3020;2820;3040;2880;1740;1360;980;990;1410;1770;2580;2630\n"
+        with self.assertRaises(ValueError):
+            parse_block(rows, 1)
+
+    def test_parse_block_invalid_wrong_number_of_rows(self):
+        rows = b" 3020 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630\n"
+        with self.assertRaises(ValueError):
+            parse_block(rows, 2)
+
+
+class TestIterBlocks(unittest.TestCase):
+
+    def test_iter_blocks_valid(self):
+        header, blocks = iter_blocks(TEST_FILE)
+        self.assertEqual({"start_date": 1991, "end_date": 2000, "missing_value": -999,
+                          "grid_size": (720, 360), "multiplier": 0.1}, header)
+        x, y, values = next(blocks)
+        blocks.close()
+        self.assertEqual((1, 148), (x, y))
+        self.assertEqual((10, 12), values.shape)
+
+    def test_iter_blocks_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            iter_blocks("C:\\test_path")
+
+
+class TestTransformArrays(unittest.TestCase):
+
+    def test_transform_arrays_valid(self):
+        arrays = transform_arrays(TEST_FILE)
+        self.assertEqual(5226 * 120, len(arrays["Value"]))
+        self.assertTrue(all(len(column) == len(arrays["Value"]) for column in arrays.values()))
+        self.assertEqual(np.datetime64("2000-12"), arrays["Date"][119])
+
+    def test_transform_arrays_matches_reference(self):
+        arrays = transform_arrays(TEST_FILE)
+        records = zip(arrays["Xref"].tolist(), arrays["Yref"].tolist(), arrays["Date"].tolist(),
+                      arrays["Value"].tolist(), arrays["Missing"].tolist())
+        actual = [(x, y, datetime(date.year, date.month, 1), None if missing else value)
+                  for x, y, date, value, missing in records if (x, y) not in FUSED_CELLS]
+        expected = [(record["Xref"], record["Yref"], record["Date"], record["Value"])
+                    for record in transform_data(TEST_FILE) if (record["Xref"], record["Yref"]) not in FUSED_CELLS]
+        self.assertEqual(expected, actual)
+
+    def test_transform_arrays_valid_mmap_backend_matches_text(self):
+        expected = transform_arrays(TEST_FILE)
+        actual = transform_arrays(TEST_FILE, backend="mmap")
+        for key, column in expected.items():
+            np.testing.assert_array_equal(column, actual[key])
+
+    def test_transform_arrays_valid_compact_dtypes(self):
+        arrays = transform_arrays(TEST_FILE)
+        self.assertEqual(np.int16, arrays["Xref"].dtype)
+        self.assertEqual(np.int16, arrays["Yref"].dtype)
+        self.assertEqual(np.int16, arrays["Value"].dtype)
+
+    def test_transform_arrays_valid_mm_units(self):
+        raw = transform_arrays(TEST_FILE)
+        arrays = transform_arrays(TEST_FILE, units="mm")
+        self.assertEqual(np.float32, arrays["Value"].dtype)
+        self.assertEqual(3020, raw["Value"][0])
+        self.assertAlmostEqual(302.0, arrays["Value"][0], places=3)
+        np.testing.assert_array_equal(raw["Missing"], np.isnan(arrays["Value"]))
+
+    def test_transform_arrays_invalid_units(self):
+        with self.assertRaises(ValueError):
+            transform_arrays(TEST_FILE, units="inches")
+
+    def test_transform_arrays_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            transform_arrays("C:\\test_path")
+
+
+class TestArraysToDf(unittest.TestCase):
+
+    def test_arrays_to_df_valid(self):
+        arrays = {
+            "Xref": np.array([1, 1], dtype=np.int32),
+            "Yref": np.array([148, 148], dtype=np.int32),
+            "Date": np.array(["2000-01", "2000-02"], dtype="datetime64[M]"),
+            "Value": np.array([300, -999], dtype=np.int32),
+            "Missing": np.array([False, True])
+        }
+        df = arrays_to_df(arrays)
+        self.assertEqual(["Xref", "Yref", "Date", "Value"], list(df.columns))
+        self.assertEqual(1, df["Value"].isna().sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
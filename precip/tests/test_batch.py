@@ -0,0 +1,163 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from datetime import date
+import numpy as np
+from precip.etl.batch import find_files, batch_root, array_rows, ingest_batch
+from precip.etl.ledger import ingest_file
+from precip.config import TEST_FILE
+
+
+class TestFindFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        for name in ("b.pre", "a.pre", "c.pre.gz", "notes.txt", "notes.zip"):
+            open(os.path.join(self.directory.name, name), "w").close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_find_files_valid_directory(self):
+        self.assertEqual(["a.pre", "b.pre", "c.pre.gz"],
+                         [os.path.basename(path) for path in find_files(self.directory.name)])
+
+    def test_find_files_valid_glob(self):
+        paths = find_files(os.path.join(self.directory.name, "b*"))
+        self.assertEqual(["b.pre"], [os.path.basename(path) for path in paths])
+
+    def test_find_files_invalid_no_files(self):
+        with self.assertRaises(FileNotFoundError):
+            find_files(os.path.join(self.directory.name, "*.csv"))
+
+    def test_batch_root_valid(self):
+        self.assertEqual(self.directory.name, batch_root(self.directory.name))
+        self.assertEqual(self.directory.name, batch_root(os.path.join(self.directory.name, "**", "*.pre")))
+        self.assertEqual(os.curdir, batch_root("*.pre"))
+
+
+class TestArrayRows(unittest.TestCase):
+
+    def test_array_rows_valid(self):
+        arrays = {
+            "Xref": np.array([1, 1], dtype=np.int16),
+            "Yref": np.array([148, 148], dtype=np.int16),
+            "Date": np.array(["2000-01", "2000-02"], dtype="datetime64[M]"),
+            "Value": np.array([300, -999], dtype=np.int16),
+            "Missing": np.array([False, True])
+        }
+        self.assertEqual([(1, 148, date(2000, 1, 1), 300), (1, 148, date(2000, 2, 1), None)],
+                         list(array_rows(arrays)))
+        self.assertEqual([(1, 148, 2000 * 12, 300), (1, 148, 2000 * 12 + 1, None)],
+                         list(array_rows(arrays, month_index=True)))
+
+
+class TestIngestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        with open(TEST_FILE) as f:
+            lines = f.readlines()
+        # Two small files with different cells, and one that cannot be parsed
+        self.paths = [os.path.join(self.directory.name, name) for name in ("first.pre", "second.pre", "bad.pre")]
+        with open(self.paths[0], "w") as f:
+            f.writelines(lines[:5 + 2 * 11])
+        with open(self.paths[1], "w") as f:
+            f.writelines(lines[:5] + lines[5 + 2 * 11:5 + 5 * 11])
+        with open(self.paths[2], "w") as f:
+            f.write("No header here\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_ingest_batch_valid(self):
+        messages = []
+        summary = ingest_batch(self.paths, self.directory.name, workers=2, report=messages.append)
+        self.assertEqual(2, summary["files_loaded"])
+        self.assertEqual([self.paths[2]], [path for path, _ in summary["files_failed"]])
+        self.assertEqual(5 * 120, summary["rows_written"])
+        self.assertEqual(3, len(messages))
+
+        connection = sqlite3.connect(os.path.join(self.directory.name, "precip.db"))
+        self.assertEqual(5 * 120, connection.execute("SELECT COUNT(*) FROM precip_values").fetchone()[0])
+        connection.close()
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, "first.zip")))
+
+    def test_ingest_batch_valid_reload_skips_unchanged_files(self):
+        ingest_batch(self.paths[:1], self.directory.name, workers=1, json=False, report=lambda message: None)
+        summary = ingest_batch(self.paths[:1], self.directory.name, workers=1, json=False,
+                               report=lambda message: None)
+        self.assertEqual((0, 1, 0), (summary["files_loaded"], summary["files_unchanged"], summary["rows_written"]))
+        connection = sqlite3.connect(os.path.join(self.directory.name, "precip.db"))
+        self.assertEqual(2 * 120, connection.execute("SELECT COUNT(*) FROM precip_values").fetchone()[0])
+        connection.close()
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, "first.zip")))
+
+    def test_ingest_batch_valid_matches_ingest_file(self):
+        ingest_batch(self.paths[:2], self.directory.name, workers=1, json=False, report=lambda message: None)
+        db_path = os.path.join(self.directory.name, "interactive.db")
+        for path in self.paths[:2]:
+            ingest_file(db_path, path)
+        tables = []
+        for path in (os.path.join(self.directory.name, "precip.db"), db_path):
+            connection = sqlite3.connect(path)
+            tables.append([connection.execute("SELECT * FROM precip_values ORDER BY Xref, Yref, Date").fetchall(),
+                           connection.execute("SELECT Source, FileHash, Cells, Parser FROM ingest_files "
+                                              "ORDER BY Source").fetchall()])
+            connection.close()
+        self.assertEqual(tables[0], tables[1])
+
+    def test_ingest_batch_valid_same_name_in_different_folders(self):
+        root = os.path.join(self.directory.name, "data")
+        paths = []
+        for folder, path in (("north", self.paths[0]), ("south", self.paths[1])):
+            os.makedirs(os.path.join(root, folder))
+            paths.append(os.path.join(root, folder, "x.pre"))
+            with open(path) as source, open(paths[-1], "w") as f:
+                f.write(source.read())
+        output_path = os.path.join(self.directory.name, "output")
+        os.mkdir(output_path)
+        paths = find_files(os.path.join(root, "**", "*.pre"))
+        for _ in range(2):
+            summary = ingest_batch(paths, output_path, workers=1, report=lambda message: None,
+                                   root=batch_root(os.path.join(root, "**", "*.pre")))
+        # The second run finds both files unchanged rather than each replacing the other's cells
+        self.assertEqual((0, 2), (summary["files_loaded"], summary["files_unchanged"]))
+        connection = sqlite3.connect(os.path.join(output_path, "precip.db"))
+        self.assertEqual(5 * 120, connection.execute("SELECT COUNT(*) FROM precip_values").fetchone()[0])
+        self.assertEqual(["north/x.pre", "south/x.pre"], [source for source, in connection.execute(
+            "SELECT Source FROM ingest_files ORDER BY Source")])
+        connection.close()
+        self.assertTrue(os.path.exists(os.path.join(output_path, "north", "x.zip")))
+        self.assertTrue(os.path.exists(os.path.join(output_path, "south", "x.zip")))
+        # The temporary files of rows are removed
+        self.assertEqual(["north", "precip.db", "south"], sorted(name for name in os.listdir(output_path)
+                                                                 if not name.startswith("precip.db-")))
+
+    def test_ingest_batch_valid_json_layout_cells(self):
+        ingest_batch(self.paths[:1], self.directory.name, workers=1, report=lambda message: None,
+                     json_layout="cells")
+        with zipfile.ZipFile(os.path.join(self.directory.name, "first.zip")) as archive:
+            cells = json.loads(archive.read("first.json"))
+        self.assertEqual([(1, 148), (1, 311)], [(cell["x"], cell["y"]) for cell in cells])
+        self.assertEqual(120, len(cells[0]["values"]))
+
+    def test_ingest_batch_invalid_json_layout(self):
+        with self.assertRaises(ValueError):
+            ingest_batch(self.paths, self.directory.name, json_layout="columns")
+
+    def test_ingest_batch_invalid_output_path(self):
+        with self.assertRaises(FileNotFoundError):
+            ingest_batch(self.paths, os.path.join(self.directory.name, "missing"))
+
+    def test_ingest_batch_invalid_workers(self):
+        for workers in (-1, 0):
+            with self.assertRaises(ValueError):
+                ingest_batch(self.paths, self.directory.name, workers=workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from precip.benchmarks.generate import generate_pre
+from precip.benchmarks.bench import run_benchmark, run_benchmarks, run_startup_benchmark, main
+from precip.etl.extract import get_header_values
+from precip.etl.transform import transform_data
+
+
+class TestGeneratePre(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "synthetic.pre")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_generate_pre_valid(self):
+        generate_pre(self.path, boxes=20, start_year=1991, end_year=1995)
+        with open(self.path) as f:
+            header = get_header_values("".join(f.readline() for _ in range(5)))
+        self.assertEqual((1991, 1995, -999, (720, 360), 0.1),
+                         (header["start_date"], header["end_date"], header["missing_value"], header["grid_size"],
+                          header["multiplier"]))
+        records = transform_data(self.path)
+        self.assertEqual(20 * 5 * 12, len(records))
+        cells = [(record["Xref"], record["Yref"]) for record in records[::60]]
+        self.assertEqual(sorted(set(cells)), cells)
+
+    def test_generate_pre_valid_same_seed_same_file(self):
+        other = os.path.join(self.directory.name, "other.pre")
+        generate_pre(self.path, boxes=5, seed=1)
+        generate_pre(other, boxes=5, seed=1)
+        with open(self.path) as f, open(other) as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_generate_pre_boundary_all_missing(self):
+        generate_pre(self.path, boxes=3, start_year=2000, end_year=2000, missing_density=1.0)
+        self.assertTrue(all(record["Value"] is None for record in transform_data(self.path)))
+
+    def test_generate_pre_invalid_too_many_boxes(self):
+        with self.assertRaises(ValueError):
+            generate_pre(self.path, boxes=11, grid_size=(2, 5))
+
+    def test_generate_pre_invalid_missing_density(self):
+        with self.assertRaises(ValueError):
+            generate_pre(self.path, missing_density=1.5)
+
+
+class TestRunBenchmarks(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output_path = os.path.join(self.directory.name, "results.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_run_benchmarks_valid(self):
+        run_benchmarks(self.output_path, stages=("transform_data", "write_to_db"), boxes=10)
+        with open(self.output_path) as f:
+            report = json.load(f)
+        self.assertEqual(10, report["input"]["boxes"])
+        self.assertEqual(["transform_data", "write_to_db"], [result["stage"] for result in report["results"]])
+        self.assertTrue(all(result["records"] == 1200 for result in report["results"]))
+
+    def test_run_benchmarks_valid_text_blocks(self):
+        report = run_benchmarks(stages=("text_blocks", "text_blocks_per_line"), boxes=10)
+        # Both tokenizers read the same ten years of data rows for each box
+        self.assertEqual([100, 100], [result["records"] for result in report["results"]])
+
+    def test_run_benchmarks_invalid_stage(self):
+        with self.assertRaises(ValueError):
+            run_benchmarks(stages=("parse_everything",))
+
+    def test_run_benchmark_invalid_name(self):
+        with self.assertRaises(ValueError):
+            run_benchmark("parse_everything", "synthetic.pre")
+
+    def test_main_invalid_years(self):
+        # argparse reports the error and exits rather than raising a traceback
+        for years in ("1991", "1991-x", "1991-1995-2000"):
+            with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+                main(["--years", years])
+
+
+class TestRunStartupBenchmark(unittest.TestCase):
+
+    def test_run_startup_benchmark_valid(self):
+        result = run_startup_benchmark(repeat=2)
+        self.assertEqual("python -m precip --help", result["command"])
+        self.assertEqual(2, len(result["seconds"]))
+        self.assertLessEqual(result["min_seconds"], result["median_seconds"])
+
+    def test_run_startup_benchmark_valid_no_heavy_modules(self):
+        self.assertEqual([], run_startup_benchmark(repeat=1)["heavy_modules"])
+
+    def test_run_startup_benchmark_invalid_repeat(self):
+        with self.assertRaises(ValueError):
+            run_startup_benchmark(repeat=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
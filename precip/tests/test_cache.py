@@ -0,0 +1,130 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from precip.config import TEST_FILE
+from precip.etl.arrays import transform_arrays
+from precip.etl.cache import cache_key, load_cached, iter_cached_blocks, evict, cache_info, clear_cache, \
+    PARSER_VERSION
+from precip.etl.transform import iter_rows
+
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.directory.name, "cache")
+        # The default cache directory is redirected so that nothing is written to the home directory
+        self.environ = os.environ.get("PRECIP_CACHE_DIR")
+        os.environ["PRECIP_CACHE_DIR"] = self.cache_dir
+
+    def tearDown(self):
+        if self.environ is None:
+            del os.environ["PRECIP_CACHE_DIR"]
+        else:
+            os.environ["PRECIP_CACHE_DIR"] = self.environ
+        self.directory.cleanup()
+
+    def _copy_test_file(self, name):
+        path = os.path.join(self.directory.name, name)
+        shutil.copyfile(TEST_FILE, path)
+        return path
+
+    def test_cache_key_valid(self):
+        key = cache_key(TEST_FILE)
+        self.assertTrue(key.endswith("-v{}".format(PARSER_VERSION)))
+        self.assertEqual(key, cache_key(self._copy_test_file("copy.pre")))
+
+    def test_cache_key_invalid_not_valid_path(self):
+        with self.assertRaises(FileNotFoundError):
+            cache_key("not_a_file.pre")
+
+    def test_load_cached_valid_miss_then_hit(self):
+        header, cells, values = load_cached(TEST_FILE)
+        self.assertEqual({"entries": 1, "bytes": cache_info()["bytes"]}, cache_info())
+        self.assertEqual((5226, 2), cells.shape)
+        self.assertEqual((5226, 10, 12), values.shape)
+        self.assertEqual(np.int16, values.dtype)
+        self.assertEqual([1, 148], cells[0].tolist())
+        self.assertEqual(3020, values[0, 0, 0])
+
+        # A copy of the file under another name has the same content, so it is read from the same entry
+        hit_header, hit_cells, hit_values = load_cached(self._copy_test_file("copy.pre"))
+        self.assertEqual(header, hit_header)
+        self.assertIsInstance(hit_values, np.memmap)
+        np.testing.assert_array_equal(values, hit_values)
+        self.assertEqual(1, cache_info()["entries"])
+
+    def test_load_cached_valid_damaged_entry(self):
+        load_cached(TEST_FILE, self.cache_dir)
+        entry = os.path.join(self.cache_dir, cache_key(TEST_FILE))
+        with open(os.path.join(entry, "values.npy"), "wb") as f:
+            f.write(b"damaged")
+        _, _, values = load_cached(TEST_FILE, self.cache_dir)
+        self.assertEqual((5226, 10, 12), values.shape)
+
+    def test_load_cached_invalid_not_valid_path(self):
+        with self.assertRaises(FileNotFoundError):
+            load_cached("not_a_file.pre", self.cache_dir)
+
+    def test_iter_cached_blocks_valid(self):
+        header, blocks = iter_cached_blocks(TEST_FILE, self.cache_dir)
+        x, y, values = next(blocks)
+        self.assertEqual((1, 148), (x, y))
+        self.assertEqual((10, 12), values.shape)
+        self.assertEqual((1991, 2000), (header["start_date"], header["end_date"]))
+
+    def test_evict_boundary(self):
+        load_cached(TEST_FILE, self.cache_dir)
+        size = cache_info(self.cache_dir)["bytes"]
+        self.assertEqual([], evict(self.cache_dir, size))
+        self.assertEqual(1, len(evict(self.cache_dir, size - 1)))
+        self.assertEqual(0, cache_info(self.cache_dir)["entries"])
+
+    def test_evict_valid_keeps_new_entry(self):
+        load_cached(TEST_FILE, self.cache_dir)
+        changed = self._copy_test_file("changed.pre")
+        with open(changed, "a") as f:
+            f.write("\n")
+        # The older entry is removed, but the entry just added is kept even though it is larger than the limit
+        _, _, values = load_cached(changed, self.cache_dir, max_bytes=0)
+        self.assertEqual(1, cache_info(self.cache_dir)["entries"])
+        self.assertTrue(os.path.isdir(os.path.join(self.cache_dir, cache_key(changed))))
+        self.assertEqual((5226, 10, 12), values.shape)
+
+    def test_evict_valid_removes_stale_temporary_directories(self):
+        stale = os.path.join(self.cache_dir, ".tmp-stale")
+        recent = os.path.join(self.cache_dir, ".tmp-recent")
+        for path in (stale, recent):
+            os.makedirs(path)
+            with open(os.path.join(path, "values.npy"), "wb") as f:
+                f.write(b"0" * 100)
+        os.utime(stale, (0, 0))
+        self.assertEqual([stale], evict(self.cache_dir, 1024))
+        # A temporary directory that may still be being written is kept
+        self.assertTrue(os.path.isdir(recent))
+
+    def test_clear_cache_valid(self):
+        load_cached(TEST_FILE, self.cache_dir)
+        clear_cache(self.cache_dir)
+        self.assertEqual({"entries": 0, "bytes": 0}, cache_info(self.cache_dir))
+
+    def test_cache_backend_valid_matches_mmap(self):
+        expected = transform_arrays(TEST_FILE, backend="mmap")
+        for _ in range(2):
+            arrays = transform_arrays(TEST_FILE, backend="cache")
+            for column in expected:
+                np.testing.assert_array_equal(expected[column], arrays[column])
+        # The cache follows the vectorised parser, which separates fused values by their columns
+        rows = list(iter_rows(TEST_FILE, "cache", month_index=True))
+        self.assertEqual(len(expected["Value"]) - expected["Missing"].sum(), len(rows))
+        self.assertEqual((1, 148, 1991 * 12, 3020), rows[0])
+
+    def test_cache_backend_valid_subset(self):
+        expected = list(iter_rows(TEST_FILE, "mmap", cells=[(1, 148), (1, 311)], years=(1993, 1994)))
+        self.assertEqual(expected, list(iter_rows(TEST_FILE, "cache", cells=[(1, 148), (1, 311)], years=(1993, 1994))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+import numpy as np
+from datetime import datetime
+from precip.etl.cube import PrecipCube, transform_cube
+from precip.etl.arrays import transform_arrays
+from precip.etl.load_to_db import write_to_db
+from precip.config import TEST_FILE
+
+
+class TestPrecipCube(unittest.TestCase):
+
+    def setUp(self):
+        values = np.full((24, 3, 4), -999, dtype=np.int16)
+        values[:, 1, 2] = np.arange(24)
+        values[5, 0, 0] = 70
+        self.cube = PrecipCube(values, 2000, -999, [(3, 2), (1, 1)])
+
+    def test_cell_valid(self):
+        self.assertEqual(list(range(24)), self.cube.cell(3, 2).tolist())
+
+    def test_cell_invalid_outside_grid(self):
+        for x, y in ((0, 0), (0, 1), (1, 0), (5, 1), (1, 4), (-1, -1)):
+            with self.assertRaises(IndexError):
+                self.cube.cell(x, y)
+
+    def test_time_slice_valid(self):
+        grid = self.cube.time_slice(datetime(2000, 6, 1))
+        self.assertEqual((3, 4), grid.shape)
+        self.assertEqual(70, grid[0, 0])
+
+    def test_time_slice_invalid_date_out_of_range(self):
+        with self.assertRaises(IndexError):
+            self.cube.time_slice(datetime(2002, 1, 1))
+
+    def test_value_valid(self):
+        self.assertEqual(13, self.cube.value(3, 2, datetime(2001, 2, 1)))
+
+    def test_value_invalid_outside_grid(self):
+        with self.assertRaises(IndexError):
+            self.cube.value(0, 1, datetime(2000, 1, 1))
+
+    def test_value_boundary_missing_value(self):
+        self.assertIsNone(self.cube.value(1, 1, datetime(2000, 1, 1)))
+
+    def test_to_df_valid(self):
+        df = self.cube.to_df()
+        self.assertEqual(48, len(df))
+        self.assertEqual([3, 2, 23], df[["Xref", "Yref", "Value"]].iloc[23].tolist())
+        self.assertEqual(23, df["Value"].isna().sum())
+
+    def test_to_df_valid_write_to_db(self):
+        with tempfile.TemporaryDirectory() as directory:
+            db_path = os.path.join(directory, "cube.db")
+            self.assertTrue(write_to_db(db_path, "test", self.cube.to_df()))
+            connection = sqlite3.connect(db_path)
+            self.assertEqual(23, connection.execute("SELECT COUNT(*) FROM test WHERE Value IS NULL").fetchone()[0])
+            connection.close()
+
+    def test_save_and_load_valid(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cube.npy")
+            self.cube.save(path)
+            loaded = PrecipCube.load(path)
+            self.assertIsInstance(loaded.values, np.memmap)
+            np.testing.assert_array_equal(self.cube.values, loaded.values)
+            np.testing.assert_array_equal(self.cube.cells, loaded.cells)
+            self.assertEqual(2000, loaded.start_date)
+            del loaded
+
+
+class TestTransformCube(unittest.TestCase):
+
+    def test_transform_cube_valid(self):
+        cube = transform_cube(TEST_FILE)
+        self.assertEqual((120, 360, 720), cube.values.shape)
+        self.assertEqual(np.int16, cube.values.dtype)
+        self.assertEqual(3020, cube.value(1, 148, datetime(1991, 1, 1)))
+
+    def test_transform_cube_valid_matches_arrays(self):
+        expected = transform_arrays(TEST_FILE)
+        actual = transform_cube(TEST_FILE, backend="mmap").to_arrays()
+        for key, column in expected.items():
+            np.testing.assert_array_equal(column, actual[key])
+
+    def test_transform_cube_boundary_missing_value_outside_int16(self):
+        with open(TEST_FILE) as f:
+            lines = f.readlines()
+        lines[3] = lines[3].replace("[Grid X,Y= 720, 360]", "[Grid X,Y=   2, 148]")
+        lines[4] = lines[4].replace("[Missing=-999]", "[Missing=-99999]")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "wide.pre")
+            with open(path, "w") as f:
+                f.writelines(lines[:5 + 11])
+            cube = transform_cube(path)
+        self.assertEqual(np.int32, cube.values.dtype)
+        self.assertEqual(-99999, cube.values[0, 0, 1])
+        self.assertEqual(3020, cube.value(1, 148, datetime(1991, 1, 1)))
+
+    def test_transform_cube_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            transform_cube("C:\\test_path")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 import unittest
 from precip.etl.extract import remove_whitespace, calculate_number_of_years, get_year_range, get_missing_data_value, \
-    get_grid_ref_values, get_data_values
+    get_grid_ref_values, get_data_values, get_grid_size, get_multiplier, get_header_values
 
 
 class TestRemoveWhitespace(unittest.TestCase):
@@ -94,5 +94,42 @@ class TestGetDataValues(unittest.TestCase):
             get_data_values(test_line, -999)
 
 
+class TestGetGridSize(unittest.TestCase):
+
+    def test_get_grid_size_valid(self):
+        test_line = "[Long=-180.00, 180.00] [Lati= -90.00,  90.00] [Grid X,Y= 720, 360]"
+        self.assertEqual((720, 360), get_grid_size(test_line))
+
+    def test_get_grid_size_boundary_no_grid_flag(self):
+        self.assertEqual((720, 360), get_grid_size("test string"))
+
+
+class TestGetMultiplier(unittest.TestCase):
+
+    def test_get_multiplier_valid(self):
+        test_line = "[Boxes=   67420] [Years=1991-2000] [Multi=    0.1000] [Missing=-999]"
+        self.assertEqual(0.1, get_multiplier(test_line))
+
+    def test_get_multiplier_boundary_lower_case_integer(self):
+        self.assertEqual(10.0, get_multiplier("[multi=10]"))
+
+    def test_get_multiplier_boundary_no_multi_flag(self):
+        self.assertEqual(1.0, get_multiplier("test string"))
+
+
+class TestGetHeaderValues(unittest.TestCase):
+
+    def test_get_header_values_valid(self):
+        header = "[Long=-180.00, 180.00] [Lati= -90.00,  90.00] [Grid X,Y= 96, 73]\n" \
+                 "[Boxes=   67420] [Years=1991-2000] [Multi=    0.1000] [Missing=-999]\n"
+        expected = {"start_date": 1991, "end_date": 2000, "missing_value": -999, "grid_size": (96, 73),
+                    "multiplier": 0.1}
+        self.assertEqual(expected, get_header_values(header))
+
+    def test_get_header_values_invalid_no_years_flag(self):
+        with self.assertRaises(ValueError):
+            get_header_values("[Missing=-999]")
+
+
 if __name__ == '__main__':
     unittest.main()
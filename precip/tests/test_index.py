@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from precip.config import TEST_FILE
+from precip.etl.index import index_path, build_index, load_index, read_cells, read_bbox, _read_blocks
+from precip.etl.transform import transform_data
+
+
+class TestIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.records = transform_data(TEST_FILE)
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = os.path.join(self.directory.name, "test.pre")
+        shutil.copyfile(TEST_FILE, self.filepath)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_index_path_valid(self):
+        self.assertEqual("data/cru.pre.idx", index_path("data/cru.pre"))
+
+    def test_build_index_valid(self):
+        index = build_index(self.filepath)
+        self.assertTrue(os.path.exists(index_path(self.filepath)))
+        self.assertEqual(10, index["rows"])
+        self.assertEqual((720, 360), index["header"]["grid_size"])
+        self.assertEqual(5226, len(index["blocks"]))
+        offset, length = index["blocks"][(1, 148)]
+        with open(self.filepath, "rb") as f:
+            f.seek(offset)
+            self.assertTrue(f.read(length).startswith(b"Grid-ref=   1, 148"))
+
+    def test_build_index_boundary_sidecar_cannot_be_written(self):
+        # The sidecar's directory does not exist, as if the data directory were read-only
+        path = os.path.join(self.directory.name, "missing", "test.pre.idx")
+        self.assertEqual(5226, len(build_index(self.filepath, path)["blocks"]))
+        self.assertEqual(self.records[:120], read_cells(self.filepath, [(1, 148)], path))
+        self.assertEqual(["test.pre"], os.listdir(self.directory.name))
+
+    def test_build_index_valid_leaves_no_temporary_file(self):
+        build_index(self.filepath)
+        self.assertEqual(["test.pre", "test.pre.idx"], sorted(os.listdir(self.directory.name)))
+
+    def test_build_index_invalid_not_valid_path(self):
+        with self.assertRaises(FileNotFoundError):
+            build_index("not_a_file.pre")
+
+    def test_load_index_valid_reads_sidecar(self):
+        built = build_index(self.filepath)
+        self.assertEqual(built, load_index(self.filepath, build=False))
+
+    def test_load_index_invalid_no_sidecar(self):
+        with self.assertRaises(ValueError):
+            load_index(self.filepath, build=False)
+
+    def test_load_index_boundary_file_changed(self):
+        build_index(self.filepath)
+        with open(self.filepath, "a") as f:
+            f.write("\n")
+        with self.assertRaises(ValueError):
+            load_index(self.filepath, build=False)
+        # The index is rebuilt for the new version of the file
+        self.assertEqual(5226, len(load_index(self.filepath)["blocks"]))
+        self.assertIsNotNone(load_index(self.filepath, build=False))
+
+    def test_read_cells_valid(self):
+        records = read_cells(self.filepath, [(1, 311), (1, 148), (999, 999)])
+        expected = [record for record in self.records if (record["Xref"], record["Yref"]) in ((1, 148), (1, 311))]
+        self.assertEqual(expected, records)
+        self.assertEqual({"Xref": 1, "Yref": 148, "Date": datetime(1991, 1, 1), "Value": 3020}, records[0])
+
+    def test_read_cells_boundary_no_cells(self):
+        self.assertEqual([], read_cells(self.filepath, []))
+
+    def test__read_blocks_invalid_index_does_not_match(self):
+        index = build_index(self.filepath)
+        shifted = {cell: (offset + 1, length) for cell, (offset, length) in index["blocks"].items()}
+        with self.assertRaises(ValueError):
+            _read_blocks(self.filepath, dict(index, blocks=shifted), [(1, 148)])
+
+    def test_read_bbox_valid(self):
+        records = read_bbox(self.filepath, 1, 50, 100, 300)
+        expected = [record for record in self.records if 1 <= record["Xref"] <= 50 and 100 <= record["Yref"] <= 300]
+        self.assertEqual(expected, records)
+
+    def test_read_bbox_boundary_empty(self):
+        self.assertEqual([], read_bbox(self.filepath, 1000, 1001, 1000, 1001))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+from precip.etl.instrument import Instrumentation, peak_rss_mb
+
+
+class TestPeakRssMb(unittest.TestCase):
+
+    def test_peak_rss_mb_valid(self):
+        peak = peak_rss_mb()
+        self.assertTrue(peak is None or peak > 0)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_stage_valid(self):
+        metrics = Instrumentation()
+        with metrics.stage("parse") as stage:
+            stage["records"] = 10
+        self.assertEqual(["parse"], [stage["name"] for stage in metrics.stages])
+        self.assertEqual(10, metrics.stages[0]["records"])
+        self.assertGreaterEqual(metrics.stages[0]["wall_seconds"], 0)
+        self.assertNotIn("peak_traced_mb", metrics.stages[0])
+
+    def test_stage_valid_recorded_on_error(self):
+        metrics = Instrumentation()
+        with self.assertRaises(ValueError):
+            with metrics.stage("parse"):
+                raise ValueError("Cannot parse.")
+        self.assertEqual(1, len(metrics.stages))
+
+    def test_track_valid(self):
+        metrics = Instrumentation(progress_interval=0)
+        with metrics.stage("json") as stage:
+            with self.assertLogs("precip.metrics") as logs:
+                self.assertEqual(list(range(25000)), list(metrics.track(range(25000), stage, block_size=120)))
+        self.assertEqual(25000, metrics.stages[0]["records"])
+        self.assertIn("blocks/sec", logs.output[0])
+
+    def test_track_valid_item_size(self):
+        metrics = Instrumentation(progress_interval=0)
+        with metrics.stage("parquet") as stage:
+            with self.assertLogs("precip.metrics") as logs:
+                list(metrics.track(range(100), stage, block_size=120, item_size=120))
+        self.assertEqual(12000, metrics.stages[0]["records"])
+        self.assertIn("9960 records", logs.output[0])
+
+    def test_track_boundary_empty(self):
+        metrics = Instrumentation()
+        with metrics.stage("json") as stage:
+            list(metrics.track([], stage))
+        self.assertEqual(0, metrics.stages[0]["records"])
+
+    def test_write_report_valid(self):
+        metrics = Instrumentation(trace_memory=True)
+        with metrics.stage("parse") as stage:
+            stage["records"] = len([0] * 1000)
+        metrics.close()
+        path = os.path.join(self.directory.name, "metrics.json")
+        metrics.write_report(path)
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(1000, report["stages"][0]["records"])
+        self.assertIn("peak_traced_mb", report["stages"][0])
+
+    def test_write_profile_valid(self):
+        metrics = Instrumentation(profile=True)
+        with metrics.stage("parse"):
+            sorted(range(1000), reverse=True)
+        path = os.path.join(self.directory.name, "profile.prof")
+        metrics.write_profile(path)
+        self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    def test_write_profile_invalid_not_enabled(self):
+        with self.assertRaises(ValueError):
+            Instrumentation().write_profile(os.path.join(self.directory.name, "profile.prof"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+import unittest
+import os
+import sqlite3
+import tempfile
+from precip.etl.ledger import file_fingerprint, block_fingerprints, ingest_file
+from precip.config import TEST_FILE
+
+
+class TestFingerprints(unittest.TestCase):
+
+    def test_file_fingerprint_valid(self):
+        self.assertEqual(64, len(file_fingerprint(TEST_FILE)))
+        self.assertEqual(file_fingerprint(TEST_FILE), file_fingerprint(TEST_FILE))
+
+    def test_file_fingerprint_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            file_fingerprint("C:\\test_path")
+
+    def test_block_fingerprints_valid(self):
+        header, fingerprints = block_fingerprints(TEST_FILE)
+        self.assertEqual(1991, header["start_date"])
+        self.assertEqual(5226, len(fingerprints))
+        # Blocks with different values have different hashes
+        self.assertNotEqual(fingerprints[(1, 148)], fingerprints[(1, 311)])
+
+
+class TestIngestFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "precip.db")
+        self.pre_path = os.path.join(self.directory.name, "test.pre")
+        with open(TEST_FILE) as f:
+            lines = f.readlines()
+        # Keep the header and the first three blocks so that each test loads a small file
+        with open(self.pre_path, "w") as f:
+            f.writelines(lines[:5 + 3 * 11])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _count_rows(self):
+        connection = sqlite3.connect(self.db_path)
+        count = connection.execute("SELECT COUNT(*) FROM precip_values").fetchone()[0]
+        connection.close()
+        return count
+
+    def test_ingest_file_valid(self):
+        summary = ingest_file(self.db_path, self.pre_path)
+        self.assertEqual("loaded", summary["status"])
+        self.assertEqual(3, summary["cells_changed"])
+        self.assertEqual(360, summary["rows_written"])
+        self.assertEqual(360, self._count_rows())
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual(0.1, connection.execute("SELECT Multi FROM ingest_files").fetchone()[0])
+        connection.close()
+
+    def test_ingest_file_valid_progress(self):
+        counted = []
+
+        def progress(rows):
+            for row in rows:
+                counted.append(row)
+                yield row
+
+        summary = ingest_file(self.db_path, self.pre_path, progress=progress)
+        self.assertEqual(360, len(counted))
+        self.assertEqual(360, summary["rows_written"])
+
+    def test_ingest_file_valid_ledger_without_added_columns(self):
+        # A ledger written before the Multi and Parser columns were added
+        connection = sqlite3.connect(self.db_path)
+        connection.execute("CREATE TABLE ingest_files (Source TEXT PRIMARY KEY, FileHash TEXT NOT NULL, "
+                           "StartYear INTEGER NOT NULL, EndYear INTEGER NOT NULL, Cells INTEGER NOT NULL, "
+                           "LoadedAt TEXT NOT NULL)")
+        connection.execute("INSERT INTO ingest_files VALUES ('old.pre', 'hash', 1991, 2000, 0, '')")
+        connection.commit()
+        connection.close()
+        ingest_file(self.db_path, self.pre_path)
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual([("old.pre", 1.0, "reference"), ("test.pre", 0.1, "reference")], connection.execute(
+            "SELECT Source, Multi, Parser FROM ingest_files ORDER BY Source").fetchall())
+        connection.close()
+
+    def test_ingest_file_valid_unchanged_file_is_skipped(self):
+        ingest_file(self.db_path, self.pre_path)
+        summary = ingest_file(self.db_path, self.pre_path)
+        self.assertEqual("unchanged", summary["status"])
+        self.assertEqual(360, self._count_rows())
+
+    def test_ingest_file_valid_only_changed_cells_are_loaded(self):
+        ingest_file(self.db_path, self.pre_path)
+        with open(self.pre_path) as f:
+            lines = f.readlines()
+        lines[6] = " 9999 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630\n"
+        # Remove the third block
+        with open(self.pre_path, "w") as f:
+            f.writelines(lines[:5 + 2 * 11])
+
+        summary = ingest_file(self.db_path, self.pre_path)
+
+        self.assertEqual((1, 1, 120), (summary["cells_changed"], summary["cells_removed"], summary["rows_written"]))
+        self.assertEqual(240, self._count_rows())
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual(9999, connection.execute(
+            "SELECT Value FROM precip_values WHERE Xref = 1 AND Yref = 148 ORDER BY Date").fetchone()[0])
+        connection.close()
+
+    def test_ingest_file_valid_aggregates_follow_changed_cells(self):
+        ingest_file(self.db_path, self.pre_path, aggregates=True)
+        with open(self.pre_path) as f:
+            lines = f.readlines()
+        lines[6] = " 9999 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630\n"
+        with open(self.pre_path, "w") as f:
+            f.writelines(lines[:5 + 2 * 11])
+
+        ingest_file(self.db_path, self.pre_path)
+
+        connection = sqlite3.connect(self.db_path)
+        stored = connection.execute("SELECT Xref, Yref, Year, Total, Missing FROM precip_values_annual "
+                                    "ORDER BY 1, 2, 3").fetchall()
+        expected = connection.execute("SELECT Xref, Yref, Date / 12, TOTAL(Value), COUNT(*) - COUNT(Value) "
+                                      "FROM precip_values GROUP BY 1, 2, 3 ORDER BY 1, 2, 3").fetchall()
+        connection.close()
+        self.assertEqual(20, len(stored))
+        self.assertEqual(expected, stored)
+
+    def test_block_fingerprints_boundary_header_changed(self):
+        _, before = block_fingerprints(self.pre_path)
+        with open(self.pre_path) as f:
+            lines = f.readlines()
+        lines[4] = lines[4].replace("Multi=    0.1000", "Multi=    0.0100")
+        with open(self.pre_path, "w") as f:
+            f.writelines(lines)
+        _, after = block_fingerprints(self.pre_path)
+        # The data rows are the same, but they no longer describe the same values
+        self.assertTrue(all(before[cell] != after[cell] for cell in before))
+
+    def test_ingest_file_valid_sources_sharing_cells(self):
+        with open(self.pre_path) as f:
+            lines = f.readlines()
+        # Two sources covering 1991-1995 and 1996-2000 of the same three cells
+        paths = {}
+        for name, years, rows in (("early.pre", "1991-1995", slice(0, 5)), ("late.pre", "1996-2000", slice(5, 10))):
+            paths[name] = os.path.join(self.directory.name, name)
+            with open(paths[name], "w") as f:
+                f.writelines(lines[:4] + [lines[4].replace("Years=1991-2000", "Years=" + years)])
+                for block in range(3):
+                    start = 5 + block * 11
+                    f.writelines([lines[start]] + lines[start + 1:start + 11][rows])
+        for path in paths.values():
+            ingest_file(self.db_path, path, aggregates=True)
+        self.assertEqual(360, self._count_rows())
+
+        with open(paths["early.pre"]) as f:
+            early = f.readlines()
+        early[6] = " 9999 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630\n"
+        with open(paths["early.pre"], "w") as f:
+            f.writelines(early[:5 + 2 * 6])
+        summary = ingest_file(self.db_path, paths["early.pre"])
+
+        # The changed and removed cells of the early source are replaced, and the late source's rows are kept
+        self.assertEqual((1, 1), (summary["cells_changed"], summary["cells_removed"]))
+        connection = sqlite3.connect(self.db_path)
+        counts = connection.execute("SELECT Date / 12 >= 1996, COUNT(*) FROM precip_values GROUP BY 1").fetchall()
+        value = connection.execute("SELECT Value FROM precip_values WHERE Xref = 1 AND Yref = 148 "
+                                   "ORDER BY Date").fetchone()[0]
+        stored = connection.execute("SELECT Xref, Yref, Year, Total, Missing FROM precip_values_annual "
+                                    "ORDER BY 1, 2, 3").fetchall()
+        expected = connection.execute("SELECT Xref, Yref, Date / 12, TOTAL(Value), COUNT(*) - COUNT(Value) "
+                                      "FROM precip_values GROUP BY 1, 2, 3 ORDER BY 1, 2, 3").fetchall()
+        connection.close()
+        self.assertEqual([(0, 120), (1, 180)], counts)
+        self.assertEqual(9999, value)
+        # The aggregates of the late source's years are kept for the reloaded cells
+        self.assertEqual(25, len(stored))
+        self.assertEqual(expected, stored)
+
+    def test_ingest_file_valid_cache_backend(self):
+        directory = os.path.join(self.directory.name, "cache")
+        environ = os.environ.get("PRECIP_CACHE_DIR")
+        os.environ["PRECIP_CACHE_DIR"] = directory
+        try:
+            ingest_file(self.db_path, self.pre_path)
+            # Loading with another parser reloads every cell with that parser's values
+            summary = ingest_file(self.db_path, self.pre_path, backend="cache")
+        finally:
+            if environ is None:
+                del os.environ["PRECIP_CACHE_DIR"]
+            else:
+                os.environ["PRECIP_CACHE_DIR"] = environ
+        self.assertEqual((3, 360), (summary["cells_changed"], summary["rows_written"]))
+        self.assertEqual(360, self._count_rows())
+
+    def test_ingest_file_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            ingest_file(self.db_path, self.pre_path, backend="unknown")
+
+    def test_ingest_file_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            ingest_file(self.db_path, "C:\\test_path")
+
+
+if __name__ == '__main__':
+    unittest.main()
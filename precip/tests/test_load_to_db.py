@@ -1,12 +1,26 @@
 import unittest
 import os
+import sqlite3
+import zipfile
+import gzip
+import json
+import importlib.util
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from precip.etl.load_to_db import _create_connection, write_to_db, dump_to_json
+from precip.etl.load_to_db import _create_connection, load_to_sqlite, write_to_db, dump_to_json, export_json, \
+    write_to_parquet
 from precip.config import RESOURCES
 
 MOCK_DB = os.path.join(RESOURCES, "temp.db")
 MOCK_JSON = os.path.join(RESOURCES, "temp.zip")
+MOCK_PARQUET = os.path.join(RESOURCES, "temp.parquet")
+MOCK_ROWS = [
+    (1, 1, datetime(2022, 1, 1), 320),
+    (1, 1, datetime(2022, 2, 1), None),
+    (1, 1, datetime(2022, 4, 1), 110),
+    (2, 2, datetime(2022, 2, 1), 493)
+]
 
 
 class TestCreateConnection(unittest.TestCase):
@@ -20,6 +34,71 @@ class TestCreateConnection(unittest.TestCase):
             _create_connection("ZZ:\\test")
 
 
+class TestLoadToSqlite(unittest.TestCase):
+
+    def test_load_to_sqlite_valid(self):
+        rows = ((x, 1, datetime(2022, month, 1), 100 * month) for x in range(1, 4) for month in range(1, 13))
+
+        result = load_to_sqlite(MOCK_DB, "test", rows, batch_size=5, build_indexes=True)
+
+        self.assertEqual(36, result)
+        connection = sqlite3.connect(MOCK_DB)
+        self.assertEqual((3, 1, "2022-12-01 00:00:00", 1200),
+                         connection.execute("SELECT * FROM test ORDER BY Xref DESC, Date DESC").fetchone())
+        self.assertEqual("wal", connection.execute("PRAGMA journal_mode").fetchone()[0])
+        indexes = connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+        self.assertEqual([("idx_test_xref_yref_date",)], indexes)
+        connection.close()
+
+        os.remove(MOCK_DB)
+
+    def test_load_to_sqlite_valid_does_not_register_adapter(self):
+        # Dates are formatted in the rows, so importing the package leaves sqlite3's own datetime adapter in place
+        self.assertEqual("sqlite3.dbapi2", sqlite3.adapters[(datetime, sqlite3.PrepareProtocol)].__module__)
+
+    def test_load_to_sqlite_valid_with_missing_value(self):
+        result = load_to_sqlite(MOCK_DB, "test", [(1, 1, datetime(2022, 1, 1), None)], synchronous="OFF")
+
+        self.assertEqual(1, result)
+        connection = sqlite3.connect(MOCK_DB)
+        self.assertIsNone(connection.execute("SELECT Value FROM test").fetchone()[0])
+        connection.close()
+
+        os.remove(MOCK_DB)
+
+    def test_load_to_sqlite_valid_managed_schema(self):
+        rows = [(1, 1, datetime(2022, 1, 1), 320), (1, 1, datetime(2022, 2, 1), 493)]
+
+        load_to_sqlite(MOCK_DB, "test", rows, managed_schema=True, without_rowid=True)
+        result = load_to_sqlite(MOCK_DB, "test", rows[1:], managed_schema=True, without_rowid=True)
+
+        self.assertEqual(1, result)
+        connection = sqlite3.connect(MOCK_DB)
+        self.assertEqual([(1, 1, 2022 * 12, 320), (1, 1, 2022 * 12 + 1, 493)],
+                         connection.execute("SELECT * FROM test").fetchall())
+        connection.close()
+
+        os.remove(MOCK_DB)
+
+    def test_load_to_sqlite_valid_month_index(self):
+        rows = [(1, 1, 2022 * 12, 320), (1, 1, 2022 * 12 + 1, None)]
+
+        self.assertEqual(2, load_to_sqlite(MOCK_DB, "test", rows, managed_schema=True, month_index=True))
+        connection = sqlite3.connect(MOCK_DB)
+        self.assertEqual(rows, connection.execute("SELECT * FROM test").fetchall())
+        connection.close()
+
+        os.remove(MOCK_DB)
+
+    def test_load_to_sqlite_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            load_to_sqlite(MOCK_DB, "test", [], batch_size=0)
+
+    def test_load_to_sqlite_invalid_synchronous_mode(self):
+        with self.assertRaises(ValueError):
+            load_to_sqlite(MOCK_DB, "test", [], synchronous="SOMETIMES")
+
+
 class TestWriteToDb(unittest.TestCase):
 
     def test_write_to_db_valid(self):
@@ -45,9 +124,27 @@ class TestWriteToDb(unittest.TestCase):
 
         os.remove(MOCK_DB)
 
+    def test_write_to_db_valid_batches(self):
+        mock_batches = [
+            [{"Xref": 1, "Yref": 1, "Date": datetime(2022, 1, 1), "Value": 320}],
+            [{"Xref": 2, "Yref": 2, "Date": datetime(2022, 2, 1), "Value": 493}]
+        ]
+
+        result = write_to_db(MOCK_DB, "test", iter(mock_batches))
+
+        self.assertTrue(result)
+        connection = sqlite3.connect(MOCK_DB)
+        self.assertEqual(2, connection.execute("SELECT COUNT(*) FROM test").fetchone()[0])
+        connection.close()
+
+        os.remove(MOCK_DB)
+
     def test_write_to_db_invalid_cannot_read_db(self):
         self.assertFalse(write_to_db("ZZ:\\test", "test", []))
 
+    def test_write_to_db_invalid_missing_directory(self):
+        self.assertFalse(write_to_db(os.path.join(RESOURCES, "missing", "temp.db"), "test", []))
+
 
 class TestDumpToJSON(unittest.TestCase):
 
@@ -72,6 +169,19 @@ class TestDumpToJSON(unittest.TestCase):
 
         os.remove(MOCK_JSON)
 
+    def test_dump_to_json_valid_batches(self):
+        mock_batches = [
+            [{"Xref": 1, "Yref": 1, "Date": datetime(2022, 1, 1), "Value": 320}],
+            [{"Xref": 2, "Yref": 2, "Date": datetime(2022, 2, 1), "Value": 493}]
+        ]
+        dump_to_json(MOCK_JSON, iter(mock_batches))
+
+        with zipfile.ZipFile(MOCK_JSON) as archive:
+            records = json.loads(archive.read("temp"))
+        self.assertEqual([320, 493], [record["Value"] for record in records])
+
+        os.remove(MOCK_JSON)
+
     def test_dump_to_json_invalid_not_df_input(self):
         mock_data = [
             {
@@ -91,5 +201,115 @@ class TestDumpToJSON(unittest.TestCase):
             dump_to_json(MOCK_JSON, mock_data)
 
 
+class TestExportJSON(unittest.TestCase):
+
+    def tearDown(self):
+        if os.path.exists(MOCK_JSON):
+            os.remove(MOCK_JSON)
+
+    def test_export_json_valid_records(self):
+        self.assertEqual(4, export_json(MOCK_JSON, iter(MOCK_ROWS)))
+        with zipfile.ZipFile(MOCK_JSON) as archive:
+            records = json.loads(archive.read("temp.json"))
+        self.assertEqual({"Xref": 1, "Yref": 1, "Date": "2022-01-01", "Value": 320}, records[0])
+        self.assertIsNone(records[1]["Value"])
+
+    def test_export_json_boundary_missing_last_value(self):
+        # The last object of a cell is closed after its value, so a missing value there is also written as null
+        rows = MOCK_ROWS[:2] + [(2, 2, datetime(2022, 2, 1), None)]
+        self.assertEqual(3, export_json(MOCK_JSON, iter(rows), lines=True, compression=None))
+        with open(MOCK_JSON) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([320, None, None], [record["Value"] for record in records])
+
+    def test_export_json_valid_cells(self):
+        self.assertEqual(2, export_json(MOCK_JSON, iter(MOCK_ROWS), layout="cells"))
+        with zipfile.ZipFile(MOCK_JSON) as archive:
+            cells = json.loads(archive.read("temp.json"))
+        self.assertEqual({"x": 1, "y": 1, "start": "2022-01-01", "values": [320, None, None, 110]}, cells[0])
+        self.assertEqual({"x": 2, "y": 2, "start": "2022-02-01", "values": [493]}, cells[1])
+
+    def test_export_json_valid_month_index_dates(self):
+        rows = [(x, y, date.year * 12 + date.month - 1, value) for x, y, date, value in MOCK_ROWS]
+        export_json(MOCK_JSON, iter(rows), layout="cells")
+        with zipfile.ZipFile(MOCK_JSON) as archive:
+            cells = json.loads(archive.read("temp.json"))
+        self.assertEqual({"x": 1, "y": 1, "start": "2022-01-01", "values": [320, None, None, 110]}, cells[0])
+
+    def test_export_json_valid_ndjson_gzip(self):
+        export_json(MOCK_JSON, iter(MOCK_ROWS), lines=True, compression="gzip", compresslevel=1)
+        with gzip.open(MOCK_JSON, "rt") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(4, len(records))
+        self.assertEqual(493, records[-1]["Value"])
+
+    def test_export_json_valid_millimetres(self):
+        export_json(MOCK_JSON, iter(MOCK_ROWS), lines=True, compression=None, multiplier=0.1)
+        with open(MOCK_JSON) as f:
+            lines = f.read().splitlines()
+        self.assertIn('"Value":32.0}', lines[0])
+        self.assertIn('"Value":null}', lines[1])
+
+    def test_export_json_boundary_no_rows(self):
+        self.assertEqual(0, export_json(MOCK_JSON, iter([]), compression=None))
+        with open(MOCK_JSON) as f:
+            self.assertEqual([], json.load(f))
+
+    def test_export_json_invalid_layout(self):
+        with self.assertRaises(ValueError):
+            export_json(MOCK_JSON, iter(MOCK_ROWS), layout="table")
+
+    def test_export_json_invalid_compression(self):
+        with self.assertRaises(ValueError):
+            export_json(MOCK_JSON, iter(MOCK_ROWS), compression="rar")
+
+    def test_export_json_valid_epoch_dates(self):
+        # The layout of the archives written with DataFrame.to_json before export_json was added
+        export_json(MOCK_JSON, iter(MOCK_ROWS), date_format="epoch", member_name="temp")
+        with zipfile.ZipFile(MOCK_JSON) as archive:
+            self.assertEqual(["temp"], archive.namelist())
+            records = json.loads(archive.read("temp"))
+        self.assertEqual({"Xref": 1, "Yref": 1, "Date": 1640995200000, "Value": 320}, records[0])
+
+    def test_export_json_invalid_date_format(self):
+        with self.assertRaises(ValueError):
+            export_json(MOCK_JSON, iter(MOCK_ROWS), date_format="unix")
+
+
+@unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+class TestWriteToParquet(unittest.TestCase):
+
+    def setUp(self):
+        self.header = {"start_date": 2000, "end_date": 2001, "missing_value": -999}
+        self.blocks = [(x, 1, np.arange(24, dtype=np.int32).reshape(2, 12) + x) for x in (1, 2, 11, 12)]
+        self.blocks[0][2][0, 0] = -999
+
+    def tearDown(self):
+        if os.path.exists(MOCK_PARQUET):
+            os.remove(MOCK_PARQUET)
+
+    def test_write_to_parquet_valid_xref_partition(self):
+        import pyarrow.parquet as pq
+
+        self.assertEqual(96, write_to_parquet(MOCK_PARQUET, self.header, iter(self.blocks), xref_bin_size=10))
+        self.assertEqual(2, pq.ParquetFile(MOCK_PARQUET).metadata.num_row_groups)
+        df = pd.read_parquet(MOCK_PARQUET)
+        self.assertEqual(96, len(df))
+        self.assertTrue(pd.isna(df["Value"][0]))
+        self.assertEqual(13, df["Value"][12])
+
+    def test_write_to_parquet_valid_year_partition(self):
+        import pyarrow.parquet as pq
+
+        write_to_parquet(MOCK_PARQUET, self.header, iter(self.blocks), partition="year")
+        self.assertEqual(2, pq.ParquetFile(MOCK_PARQUET).metadata.num_row_groups)
+        df = pd.read_parquet(MOCK_PARQUET, filters=[("Xref", "==", 12)])
+        self.assertEqual(24, len(df))
+
+    def test_write_to_parquet_invalid_partition(self):
+        with self.assertRaises(ValueError):
+            write_to_parquet(MOCK_PARQUET, self.header, iter(self.blocks), partition="month")
+
+
 if __name__ == '__main__':
     unittest.main()
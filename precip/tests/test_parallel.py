@@ -0,0 +1,78 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from precip.etl.parallel import scan_block_offsets, split_chunks, transform_parallel
+from precip.etl.arrays import transform_arrays
+from precip.etl.transform import transform_data
+from precip.config import TEST_FILE
+
+
+class TestScanBlockOffsets(unittest.TestCase):
+
+    def test_scan_block_offsets_valid(self):
+        offsets = scan_block_offsets(TEST_FILE)
+        self.assertEqual(5226, len(offsets))
+        with open(TEST_FILE, "rb") as f:
+            f.seek(offsets[1])
+            self.assertEqual(b"Grid-ref=   1, 311\n", f.readline())
+
+    def test_scan_block_offsets_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            scan_block_offsets("C:\\test_path")
+
+
+class TestSplitChunks(unittest.TestCase):
+
+    def test_split_chunks_valid(self):
+        self.assertEqual([(10, 30), (30, 100)], split_chunks([10, 20, 30, 40], 100, 2))
+
+    def test_split_chunks_boundary_more_chunks_than_blocks(self):
+        self.assertEqual([(10, 20), (20, 100)], split_chunks([10, 20], 100, 8))
+
+    def test_split_chunks_boundary_no_blocks(self):
+        self.assertEqual([], split_chunks([], 100, 2))
+
+    def test_split_chunks_invalid_number_of_chunks(self):
+        with self.assertRaises(ValueError):
+            split_chunks([10, 20], 100, 0)
+
+
+class TestTransformParallel(unittest.TestCase):
+
+    def test_transform_parallel_valid_matches_serial_records(self):
+        self.assertEqual(transform_data(TEST_FILE), transform_parallel(TEST_FILE, workers=2))
+
+    def test_transform_parallel_valid_matches_serial_arrays(self):
+        expected = transform_arrays(TEST_FILE)
+        actual = transform_parallel(TEST_FILE, workers=2, parser="arrays")
+        for key, column in expected.items():
+            np.testing.assert_array_equal(column, actual[key])
+
+    def test_transform_parallel_valid_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.pre.gz")
+            with open(TEST_FILE, "rb") as f, gzip.open(path, "wb", compresslevel=1) as compressed:
+                shutil.copyfileobj(f, compressed)
+            self.assertEqual(transform_data(TEST_FILE), transform_parallel(path, workers=2))
+            with self.assertRaises(ValueError):
+                scan_block_offsets(path)
+
+    def test_transform_parallel_invalid_parser(self):
+        with self.assertRaises(ValueError):
+            transform_parallel(TEST_FILE, parser="unknown")
+
+    def test_transform_parallel_invalid_workers(self):
+        for workers in (0, -1, 1.5):
+            with self.assertRaises(ValueError):
+                transform_parallel(TEST_FILE, workers=workers)
+
+    def test_transform_parallel_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            transform_parallel("C:\\test_path", workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from precip.etl.pipeline import run_pipeline, pipeline_file
+from precip.config import TEST_FILE
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def test_run_pipeline_valid(self):
+        summary = run_pipeline(iter(range(25)), {"total": sum, "count": lambda rows: len(list(rows))},
+                               batch_size=4, queue_size=1)
+        self.assertEqual({"total": 300, "count": 25}, summary["results"])
+        self.assertEqual({"parse", "total", "count"}, set(summary["timings"]))
+
+    def test_run_pipeline_boundary_no_rows(self):
+        summary = run_pipeline(iter([]), {"count": lambda rows: len(list(rows))})
+        self.assertEqual({"count": 0}, summary["results"])
+
+    def test_run_pipeline_invalid_writer_error(self):
+        def fail(rows):
+            next(rows)
+            raise TypeError("Cannot write.")
+
+        with self.assertRaises(TypeError):
+            run_pipeline(iter(range(1000)), {"fail": fail, "count": lambda rows: len(list(rows))},
+                         batch_size=10, queue_size=1)
+
+    def test_run_pipeline_invalid_writers_do_not_finish(self):
+        finished = []
+
+        def rows():
+            yield from range(10)
+            raise ValueError("Cannot parse.")
+
+        def write(rows):
+            total = sum(rows)
+            finished.append(total)
+            return total
+
+        with self.assertRaises(ValueError):
+            run_pipeline(rows(), {"write": write}, batch_size=1)
+        self.assertEqual([], finished)
+
+    def test_run_pipeline_boundary_writer_returns_early(self):
+        summary = run_pipeline(iter(range(1000)), {"first": next, "count": lambda rows: len(list(rows))},
+                               batch_size=1, queue_size=1)
+        self.assertEqual({"first": 0, "count": 1000}, summary["results"])
+
+    def test_run_pipeline_invalid_rows_error(self):
+        def rows():
+            yield 1
+            raise ValueError("Cannot parse.")
+
+        with self.assertRaises(ValueError):
+            run_pipeline(rows(), {"count": lambda rows: len(list(rows))}, batch_size=1)
+
+    def test_run_pipeline_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            run_pipeline(iter([]), {}, batch_size=0)
+
+
+class TestPipelineFile(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.pre_path = os.path.join(self.directory.name, "test.pre")
+        self.sql_path = os.path.join(self.directory.name, "precip.db")
+        self.json_path = os.path.join(self.directory.name, "precip.zip")
+        with open(TEST_FILE) as f:
+            lines = f.readlines()
+        with open(self.pre_path, "w") as f:
+            f.writelines(lines[:5 + 3 * 11])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pipeline_file_valid(self):
+        summary = pipeline_file(self.pre_path, self.sql_path, self.json_path, batch_size=50, queue_size=2)
+        self.assertEqual({"sqlite": 360, "json": 360}, summary["results"])
+        connection = sqlite3.connect(self.sql_path)
+        self.assertEqual(360, connection.execute("SELECT COUNT(*) FROM precip_values").fetchone()[0])
+        connection.close()
+        with zipfile.ZipFile(self.json_path) as archive:
+            self.assertEqual(["precip.json"], archive.namelist())
+
+    def test_pipeline_file_valid_progress(self):
+        counted = []
+
+        def progress(rows):
+            for row in rows:
+                counted.append(row)
+                yield row
+
+        summary = pipeline_file(self.pre_path, json_path=self.json_path, progress=progress)
+        self.assertEqual({"json": 360}, summary["results"])
+        self.assertEqual(360, len(counted))
+
+    def test_pipeline_file_valid_json_only(self):
+        summary = pipeline_file(self.pre_path, json_path=self.json_path)
+        self.assertEqual({"json": 360}, summary["results"])
+        self.assertFalse(os.path.exists(self.sql_path))
+
+    def test_pipeline_file_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            pipeline_file("C:\\test_path", self.sql_path, self.json_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
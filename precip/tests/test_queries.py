@@ -0,0 +1,71 @@
+import unittest
+import sqlite3
+from datetime import datetime
+from precip.etl.schema import create_precip_table, to_month_index
+from precip.etl.aggregates import create_aggregate_tables
+from precip.etl.queries import get_value, get_cell_series, get_bounding_box, get_monthly_climatology, \
+    get_annual_totals
+
+
+class TestQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+        create_precip_table(self.connection, "test", without_rowid=True)
+        rows = [(x, y, to_month_index(datetime(2000, month, 1)), x * 1000 + y * 10 + month)
+                for x in range(1, 4) for y in range(1, 4) for month in range(1, 13)]
+        rows[0] = rows[0][:3] + (None,)
+        self.connection.executemany("INSERT INTO test VALUES (?, ?, ?, ?)", rows)
+        self.rows = rows
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_get_value_valid(self):
+        self.assertEqual(2035, get_value(self.connection, 2, 3, datetime(2000, 5, 1), "test"))
+
+    def test_get_value_boundary_missing_value(self):
+        self.assertIsNone(get_value(self.connection, 1, 1, datetime(2000, 1, 1), "test"))
+
+    def test_get_value_boundary_not_in_table(self):
+        self.assertIsNone(get_value(self.connection, 9, 9, datetime(2000, 1, 1), "test"))
+
+    def test_get_cell_series_valid(self):
+        series = get_cell_series(self.connection, 3, 1, table_name="test")
+        self.assertEqual(12, len(series))
+        self.assertEqual((datetime(2000, 12, 1), 3022), series[-1])
+
+    def test_get_cell_series_valid_date_range(self):
+        series = get_cell_series(self.connection, 3, 1, datetime(2000, 3, 1), datetime(2000, 4, 1), "test")
+        self.assertEqual([(datetime(2000, 3, 1), 3013), (datetime(2000, 4, 1), 3014)], series)
+
+    def test_get_bounding_box_valid(self):
+        rows = get_bounding_box(self.connection, 2, 3, 1, 2, datetime(2000, 6, 1), datetime(2000, 6, 1), "test")
+        self.assertEqual([(2, 1, datetime(2000, 6, 1), 2016), (2, 2, datetime(2000, 6, 1), 2026),
+                          (3, 1, datetime(2000, 6, 1), 3016), (3, 2, datetime(2000, 6, 1), 3026)], rows)
+
+
+    def test_get_monthly_climatology_valid(self):
+        self.assertEqual([2030.0 + month for month in range(1, 13)],
+                         get_monthly_climatology(self.connection, 2, 3, table_name="test"))
+
+    def test_get_monthly_climatology_boundary_missing_value(self):
+        means = get_monthly_climatology(self.connection, 1, 1, 2000, 2000, "test")
+        self.assertEqual([None, 1012.0], means[:2])
+        self.assertEqual([None] * 12, get_monthly_climatology(self.connection, 1, 1, 2001, 2001, "test"))
+
+    def test_get_annual_totals_valid(self):
+        self.assertEqual([(2000, 24438, 0)], get_annual_totals(self.connection, 2, 3, table_name="test"))
+        self.assertEqual([(2000, 11187, 1)], get_annual_totals(self.connection, 1, 1, table_name="test"))
+        self.assertEqual([], get_annual_totals(self.connection, 1, 1, 2001, table_name="test"))
+
+    def test_get_annual_totals_valid_aggregate_tables(self):
+        expected = [get_annual_totals(self.connection, 1, 1, table_name="test"),
+                    get_monthly_climatology(self.connection, 1, 1, table_name="test")]
+        create_aggregate_tables(self.connection, "test")
+        self.assertEqual(expected, [get_annual_totals(self.connection, 1, 1, table_name="test"),
+                                    get_monthly_climatology(self.connection, 1, 1, table_name="test")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from precip.etl.aggregates import create_aggregate_tables
+from precip.etl.schema import create_precip_table, to_month_index
+from precip.query import ConnectionPool, cell_series, bounding_box, monthly_climatology, annual_totals
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "precip.db")
+        connection = sqlite3.connect(self.db_path)
+        create_precip_table(connection, without_rowid=True)
+        rows = [(x, y, to_month_index(datetime(year, month, 1)), x * 1000 + y * 10 + month)
+                for x in range(1, 4) for y in range(1, 4) for year in (2000, 2001) for month in range(1, 13)]
+        rows[0] = rows[0][:3] + (None,)
+        connection.executemany("INSERT INTO precip_values VALUES (?, ?, ?, ?)", rows)
+        connection.commit()
+        connection.close()
+        self.pool = ConnectionPool(self.db_path, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.directory.cleanup()
+
+    def test_cell_series_valid(self):
+        series = cell_series(self.pool, 3, 1, datetime(2000, 3, 1), datetime(2000, 4, 1))
+        self.assertEqual([3013, 3014], series.tolist())
+        self.assertEqual(np.datetime64("2000-03-01"), series.index[0].to_datetime64())
+
+    def test_cell_series_boundary_missing_value(self):
+        series = cell_series(self.pool, 1, 1)
+        self.assertEqual(24, len(series))
+        self.assertTrue(series.isna().iloc[0])
+
+    def test_cell_series_boundary_not_in_table(self):
+        self.assertEqual(0, len(cell_series(self.pool, 9, 9)))
+
+    def test_bounding_box_valid(self):
+        df = bounding_box(self.pool, 2, 3, 1, 2, datetime(2000, 6, 1), datetime(2000, 6, 1))
+        self.assertEqual([2016, 2026, 3016, 3026], df["Value"].tolist())
+        self.assertEqual(["Xref", "Yref", "Date", "Value"], list(df.columns))
+        self.assertEqual(np.int16, df["Xref"].dtype)
+
+    def test_monthly_climatology_valid(self):
+        climatology = monthly_climatology(self.pool, 1, 1)
+        self.assertEqual(12, len(climatology))
+        self.assertEqual(1011, climatology[1])
+        self.assertEqual(1022, climatology[12])
+
+    def test_annual_totals_valid(self):
+        totals = annual_totals(self.pool, 2, 2, start_year=2001)
+        self.assertEqual([2001], totals.index.tolist())
+        self.assertEqual(sum(2020 + month for month in range(1, 13)), totals.loc[2001, "Total"])
+        self.assertEqual(0, totals.loc[2001, "Missing"])
+
+    def test_annual_totals_boundary_missing_value(self):
+        self.assertEqual(1, annual_totals(self.pool, 1, 1).loc[2000, "Missing"])
+
+    def test_query_valid_aggregate_tables(self):
+        expected = (monthly_climatology(self.pool, 1, 1), annual_totals(self.pool, 2, 2))
+        connection = sqlite3.connect(self.db_path)
+        create_aggregate_tables(connection)
+        connection.commit()
+        # Change a value behind the aggregates' back to show that they are read from the side tables
+        connection.execute("UPDATE precip_values SET Value = 0 WHERE Xref = 2 AND Yref = 2")
+        connection.commit()
+        connection.close()
+
+        self.assertTrue(expected[0].equals(monthly_climatology(self.pool, 1, 1)))
+        self.assertTrue(expected[1].equals(annual_totals(self.pool, 2, 2)))
+        self.assertEqual([2000], annual_totals(self.pool, 2, 2, 2000, 2000).index.tolist())
+
+    def test_query_valid_sqlite_connection(self):
+        connection = sqlite3.connect(self.db_path)
+        self.assertEqual(24, len(cell_series(connection, 2, 2)))
+        connection.close()
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.directory.name, "precip.db")
+        connection = sqlite3.connect(self.db_path)
+        create_precip_table(connection)
+        connection.close()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_connection_pool_valid_concurrent_queries(self):
+        with ConnectionPool(self.db_path, size=2) as pool:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                results = list(executor.map(lambda x: len(cell_series(pool, x, 1)), range(20)))
+            self.assertEqual([0] * 20, results)
+            self.assertLessEqual(pool._opened, 2)
+
+    def test_connection_pool_valid_read_only(self):
+        with ConnectionPool(self.db_path) as pool, pool.connection() as connection:
+            with self.assertRaises(sqlite3.OperationalError):
+                connection.execute("DELETE FROM precip_values")
+
+    def test_connection_pool_invalid_database_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            ConnectionPool(os.path.join(self.directory.name, "missing.db"))
+
+    def test_connection_pool_invalid_size(self):
+        with self.assertRaises(ValueError):
+            ConnectionPool(self.db_path, size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
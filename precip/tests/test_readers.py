@@ -0,0 +1,174 @@
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+import unittest
+import zipfile
+from precip.etl.readers import check_backend, detect_compression, open_input, iter_mmap_blocks, iter_block_spans, \
+    split_rows
+from precip.config import TEST_FILE
+
+
+def write_compressed(directory, compression, data):
+    """Writes data to a file in the directory with the given compression and returns its path."""
+
+    path = os.path.join(directory, "test.pre." + compression)
+    if compression == "zip":
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("test.pre", data)
+    else:
+        with {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}[compression](path, "wb") as f:
+            f.write(data)
+    return path
+
+
+class TestCheckBackend(unittest.TestCase):
+
+    def test_check_backend_valid(self):
+        self.assertIsNone(check_backend("mmap"))
+
+    def test_check_backend_invalid_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            check_backend("unknown")
+
+
+class TestOpenInput(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # The header and the first 50 blocks of the test file
+        with open(TEST_FILE, "rb") as f:
+            cls.data = b"".join(f.readlines()[:5 + 11 * 50])
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.paths = {compression: write_compressed(cls.directory.name, compression, cls.data)
+                     for compression in ("gz", "bz2", "xz", "zip")}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def test_detect_compression_valid(self):
+        self.assertIsNone(detect_compression(TEST_FILE))
+        self.assertEqual({"gz": "gzip", "bz2": "bz2", "xz": "xz", "zip": "zip"},
+                         {key: detect_compression(path) for key, path in self.paths.items()})
+
+    def test_detect_compression_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            detect_compression("C:\\test_path")
+
+    def test_open_input_valid(self):
+        for path in self.paths.values():
+            with open_input(path) as f:
+                self.assertEqual(self.data, f.read())
+            with open_input(path, "r") as f:
+                self.assertTrue(f.readline().startswith("Tyndall Centre"))
+
+    def test_open_input_boundary_small_blocks(self):
+        with open_input(self.paths["gz"], block_size=7) as f:
+            lines = f.readlines()
+        self.assertEqual(self.data.splitlines(keepends=True), lines)
+
+    def test_open_input_boundary_closed_early(self):
+        # Closing the stream part way through stops the decompression thread rather than waiting for the file
+        f = open_input(self.paths["bz2"], block_size=1024)
+        f.readline()
+        f.close()
+        self.assertTrue(f.closed)
+
+    def test_open_input_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            open_input(TEST_FILE, "w")
+
+    def test_open_input_invalid_truncated(self):
+        path = os.path.join(self.directory.name, "truncated.pre.gz")
+        with open(self.paths["gz"], "rb") as f, open(path, "wb") as truncated:
+            truncated.write(f.read(500))
+        with self.assertRaises(ValueError):
+            with open_input(path) as f:
+                f.read()
+
+    def test_open_input_invalid_zip_members(self):
+        path = os.path.join(self.directory.name, "members.zip")
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("a.pre", b"")
+            archive.writestr("b.pre", b"")
+        with self.assertRaises(ValueError):
+            open_input(path)
+
+
+    def test_open_input_invalid_damaged_zip(self):
+        # A file that starts like a zip archive but has no central directory
+        path = os.path.join(self.directory.name, "damaged.pre.zip")
+        with open(self.paths["zip"], "rb") as f, open(path, "wb") as damaged:
+            damaged.write(f.read(500))
+        with self.assertRaises(ValueError):
+            open_input(path)
+
+
+class TestIterMmapBlocks(unittest.TestCase):
+
+    def test_iter_mmap_blocks_valid(self):
+        header, blocks = iter_mmap_blocks(TEST_FILE)
+        self.assertEqual({"start_date": 1991, "end_date": 2000, "missing_value": -999,
+                          "grid_size": (720, 360), "multiplier": 0.1}, header)
+        x, y, rows = next(blocks)
+        self.assertEqual((1, 148), (x, y))
+        self.assertIsInstance(rows, memoryview)
+        self.assertEqual(10 * 61, len(rows))
+        del rows
+        blocks.close()
+
+    def test_iter_mmap_blocks_valid_block_count(self):
+        _, blocks = iter_mmap_blocks(TEST_FILE)
+        self.assertEqual(5226, sum(1 for _ in blocks))
+
+    def test_iter_mmap_blocks_valid_compressed(self):
+        with open(TEST_FILE, "rb") as f:
+            data = f.read()
+        with tempfile.TemporaryDirectory() as directory:
+            header, blocks = iter_mmap_blocks(write_compressed(directory, "gz", data))
+            expected_header, expected = iter_mmap_blocks(TEST_FILE)
+            self.assertEqual(expected_header, header)
+            self.assertEqual([(x, y, bytes(rows)) for x, y, rows in expected], list(blocks))
+
+    def test_iter_mmap_blocks_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            iter_mmap_blocks("C:\\test_path")
+
+
+class TestIterBlockSpans(unittest.TestCase):
+
+    def test_iter_block_spans_valid(self):
+        _, blocks = iter_block_spans(TEST_FILE)
+        spans = list(blocks)
+        self.assertEqual(5226, len(spans))
+        x, y, offset, length = spans[0]
+        with open(TEST_FILE, "rb") as f:
+            f.seek(offset)
+            block = f.read(length)
+        self.assertEqual((1, 148), (x, y))
+        self.assertTrue(block.startswith(b"Grid-ref=   1, 148"))
+        self.assertEqual(11, len(block.splitlines()))
+        self.assertEqual(offset + length, spans[1][2])
+
+    def test_iter_block_spans_invalid_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_compressed(directory, "xz", b"Years=1991-2000")
+            with self.assertRaises(ValueError):
+                iter_block_spans(path)
+
+    def test_iter_block_spans_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            iter_block_spans("C:\\test_path")
+
+
+class TestSplitRows(unittest.TestCase):
+
+    def test_split_rows_valid(self):
+        rows = memoryview(b" 3020 2820\n  490  290\n")
+        self.assertEqual([b" 3020 2820", b"  490  290"], split_rows(rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import sqlite3
+from datetime import date, datetime
+from precip.etl.schema import to_month_index, from_month_index, create_precip_table, create_date_index
+
+
+class TestMonthIndex(unittest.TestCase):
+
+    def test_to_month_index_valid(self):
+        self.assertEqual(1991 * 12, to_month_index(datetime(1991, 1, 1)))
+
+    def test_to_month_index_boundary_ignores_day(self):
+        self.assertEqual(to_month_index(date(2000, 12, 1)), to_month_index(date(2000, 12, 31)))
+
+    def test_from_month_index_valid(self):
+        self.assertEqual(datetime(2000, 12, 1), from_month_index(to_month_index(datetime(2000, 12, 1))))
+
+
+class TestCreatePrecipTable(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = sqlite3.connect(":memory:")
+
+    def tearDown(self):
+        self.connection.close()
+
+    def test_create_precip_table_valid(self):
+        create_precip_table(self.connection, "test", without_rowid=True)
+        self.connection.execute("INSERT INTO test VALUES (1, 148, 23892, 3020)")
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.connection.execute("INSERT INTO test VALUES (1, 148, 23892, 2820)")
+        indexes = self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+        self.assertIn(("idx_test_date",), indexes)
+
+    def test_create_precip_table_valid_deferred_date_index(self):
+        create_precip_table(self.connection, "test", date_index=False)
+        self.assertEqual(0, self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_test_date'").fetchone()[0])
+        create_date_index(self.connection, "test")
+        self.assertEqual(1, self.connection.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE name = 'idx_test_date'").fetchone()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
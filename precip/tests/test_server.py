@@ -0,0 +1,155 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from precip.config import TEST_FILE
+from precip.etl.cube import transform_cube
+from precip.etl.ledger import ingest_file
+from precip.etl.queries import get_cell_series
+from precip.etl.load_to_db import _create_connection
+from precip.server import PrecipService, ServiceClient, start_server
+
+
+class TestPrecipService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.db_path = os.path.join(cls.directory.name, "precip.db")
+        ingest_file(cls.db_path, TEST_FILE)
+        cls.cube = transform_cube(TEST_FILE)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def _handle(self, service, request):
+        return asyncio.run(service.handle(request))
+
+    def test_cell_valid_cube(self):
+        service = PrecipService(self.cube)
+        response = self._handle(service, {"op": "cell", "x": 1, "y": 148, "start": "1991-01", "end": "1991-03"})
+        self.assertEqual({"ok": True, "result": {"x": 1, "y": 148, "start": "1991-01", "values": [3020, 2820, 3040]}},
+                         response)
+
+    def test_cell_valid_database_matches_cube(self):
+        service = PrecipService(db_path=self.db_path)
+        try:
+            from_db = self._handle(service, {"op": "cell", "x": 1, "y": 148})["result"]
+            from_cube = self._handle(PrecipService(self.cube), {"op": "cell", "x": 1, "y": 148})["result"]
+            self.assertEqual(from_cube, from_db)
+            self.assertEqual(120, len(from_db["values"]))
+        finally:
+            service.close()
+
+    def test_cell_valid_cached(self):
+        service = PrecipService(db_path=self.db_path)
+        try:
+            for _ in range(3):
+                self._handle(service, {"op": "cell", "x": 1, "y": 148, "start": "1995-01", "end": "1995-12"})
+            self.assertEqual((2, 1), service.read_cell.cache_info()[:2])
+        finally:
+            service.close()
+
+    def test_reload_valid_clears_cache(self):
+        service = PrecipService(db_path=self.db_path)
+        try:
+            request = {"op": "cell", "x": 1, "y": 148, "start": "1995-01", "end": "1995-12"}
+            self._handle(service, request)
+            self.assertEqual({"ok": True, "result": 1}, self._handle(service, {"op": "reload"}))
+            # The cell is read again from the database after the cache is cleared
+            self._handle(service, request)
+            self.assertEqual((0, 1), service.read_cell.cache_info()[:2])
+        finally:
+            service.close()
+
+    def test_handle_invalid_unexpected_error(self):
+        service = PrecipService(db_path=self.db_path)
+        service.close()
+        # The executor refuses new reads once it is shut down, which is answered with an error rather than raised
+        with self.assertLogs("precip.server", level="ERROR"):
+            response = self._handle(service, {"op": "value", "x": 1, "y": 148, "date": "1991-01"})
+        self.assertFalse(response["ok"])
+        self.assertIn("error", response)
+
+    def test_cell_boundary_outside_cube_uses_database(self):
+        service = PrecipService(self.cube, self.db_path)
+        try:
+            response = self._handle(service, {"op": "cell", "x": 1, "y": 148, "start": "1990-12", "end": "1991-01"})
+            self.assertEqual([None, 3020], response["result"]["values"])
+        finally:
+            service.close()
+
+    def test_value_valid(self):
+        service = PrecipService(db_path=self.db_path)
+        try:
+            connection = _create_connection(self.db_path)
+            expected = get_cell_series(connection, 1, 311)[4][1]
+            connection.close()
+            self.assertEqual(expected, self._handle(service, {"op": "value", "x": 1, "y": 311,
+                                                              "date": "1991-05"})["result"])
+        finally:
+            service.close()
+
+    def test_handle_invalid_requests(self):
+        service = PrecipService(self.cube)
+        for request in ({"op": "unknown"}, {"op": "cell", "x": "a", "y": 1}, [1, 2],
+                        {"op": "value", "x": 1, "y": 148, "date": "1991-13"},
+                        {"op": "value", "x": 1, "y": 148, "date": "2050-01"}):
+            response = self._handle(service, request)
+            self.assertFalse(response["ok"])
+            self.assertIn("error", response)
+
+    def test_precip_service_invalid_no_source(self):
+        with self.assertRaises(ValueError):
+            PrecipService()
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.service = PrecipService(transform_cube(TEST_FILE))
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(start_server(self.service, port=0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.service.close()
+
+    def test_service_client_valid(self):
+        with ServiceClient(port=self.port) as client:
+            self.assertEqual("pong", client.request("ping"))
+            self.assertEqual(3020, client.request("value", x=1, y=148, date=datetime(1991, 1, 1).isoformat()))
+            self.assertEqual("1991-01", client.request("info")["cube"]["start"])
+
+    def test_service_client_invalid_request(self):
+        with ServiceClient(port=self.port) as client:
+            with self.assertRaises(ValueError):
+                client.request("cell", x=1)
+            # The connection can still be used after an error
+            self.assertEqual("pong", client.request("ping"))
+
+    def test_service_client_valid_concurrent_clients(self):
+        clients = [ServiceClient(port=self.port) for _ in range(3)]
+        try:
+            results = [client.request("cell", x=1, y=148, start="1991-01", end="1991-01") for client in clients]
+            self.assertEqual([[3020]] * 3, [result["values"] for result in results])
+        finally:
+            for client in clients:
+                client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,10 @@
+import bz2
+import os
+import shutil
+import tempfile
 import unittest
 from datetime import datetime
-from precip.etl.transform import transform_data, convert_to_df
+from precip.etl.transform import iter_rows, iter_records, iter_batches, transform_data, convert_to_df
 from precip.config import TEST_FILE
 
 
@@ -11,10 +15,142 @@ class TestTransformData(unittest.TestCase):
         self.assertIsInstance(output, list)
         self.assertEqual(627115, len(output))
 
+    def test_transform_data_boundary_blank_lines_and_no_missing_flag(self):
+        with open(TEST_FILE) as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.pre")
+            with open(path, "w") as f:
+                f.write(lines[4].replace("[Missing=-999]", ""))
+                f.writelines(lines[5:16] + ["\n"] + lines[16:27])
+            output = transform_data(path)
+        self.assertEqual(240, len(output))
+        self.assertEqual({"Xref": 1, "Yref": 311, "Date": datetime(1991, 1, 1), "Value": 490}, output[120])
+
+    def test_transform_data_invalid_no_year_range(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.pre")
+            open(path, "w").close()
+            self.assertIsNone(transform_data(path))
+
     def test_transform_data_invalid_file_not_found(self):
         with self.assertRaises(FileNotFoundError):
             transform_data("C:\\test_path")
 
+    def test_transform_data_valid_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.pre.bz2")
+            with open(TEST_FILE, "rb") as f, bz2.open(path, "wb", compresslevel=1) as compressed:
+                shutil.copyfileobj(f, compressed)
+            self.assertEqual(transform_data(TEST_FILE, cells=[(1, 148), (50, 200)]),
+                             transform_data(path, cells=[(1, 148), (50, 200)]))
+            self.assertEqual(627115, len(transform_data(path, backend="mmap")))
+
+    def test_transform_data_valid_subset(self):
+        expected = [record for record in transform_data(TEST_FILE)
+                    if 1 <= record["Xref"] <= 50 and 100 <= record["Yref"] <= 300
+                    and 1994 <= record["Date"].year <= 1995]
+        for backend in ("text", "mmap"):
+            output = transform_data(TEST_FILE, backend, bbox=(1, 50, 100, 300), years=(1994, 1995))
+            self.assertEqual(expected, output)
+
+    def test_transform_data_valid_cells(self):
+        output = transform_data(TEST_FILE, cells=[(1, 311), (1, 148), (999, 999)], bbox=(1, 1, 0, 200))
+        self.assertEqual(120, len(output))
+        self.assertEqual({"Xref": 1, "Yref": 148, "Date": datetime(1991, 1, 1), "Value": 3020}, output[0])
+
+    def test_transform_data_valid_cells_iterator(self):
+        self.assertEqual(transform_data(TEST_FILE, cells=[(1, 148)]),
+                         transform_data(TEST_FILE, cells=((1, y) for y in (148,))))
+
+    def test_transform_data_boundary_years_outside_file(self):
+        self.assertEqual([], transform_data(TEST_FILE, years=(1980, 1990)))
+        output = transform_data(TEST_FILE, cells=[(1, 148)], years=(2000, 2010))
+        self.assertEqual([datetime(2000, month, 1) for month in range(1, 13)], [record["Date"] for record in output])
+
+    def test_transform_data_invalid_subset(self):
+        for subset in ({"bbox": (1, 2, 3)}, {"bbox": (50, 1, 100, 300)}, {"bbox": ("a", 1, 2, 3)},
+                       {"cells": [(1, 148, 1)]}, {"cells": [1, 2]}, {"years": (1995, 1991)}, {"years": 1995}):
+            with self.assertRaises(ValueError):
+                transform_data(TEST_FILE, **subset)
+
+
+class TestIterRows(unittest.TestCase):
+
+    def test_iter_rows_valid(self):
+        self.assertEqual((1, 148, datetime(1991, 1, 1), 3020), next(iter_rows(TEST_FILE)))
+
+    def test_iter_rows_valid_matches_records(self):
+        expected = [tuple(record.values()) for record in iter_records(TEST_FILE, backend="mmap")]
+        self.assertEqual(expected, list(iter_rows(TEST_FILE, backend="mmap")))
+
+    def test_iter_rows_valid_month_index(self):
+        expected = [(x, y, date.year * 12 + date.month - 1, value) for x, y, date, value in iter_rows(TEST_FILE)]
+        self.assertEqual(expected, list(iter_rows(TEST_FILE, month_index=True)))
+
+    def test_iter_rows_valid_subset_month_index(self):
+        rows = list(iter_rows(TEST_FILE, month_index=True, cells=[(1, 148)], years=(1991, 1991)))
+        self.assertEqual([(1, 148, 1991 * 12, 3020), (1, 148, 1991 * 12 + 1, 2820)], rows[:2])
+        self.assertEqual(12, len(rows))
+
+    def test_iter_rows_valid_mmap_backend_matches_text(self):
+        for month_index in (False, True):
+            self.assertEqual(list(iter_rows(TEST_FILE, month_index=month_index)),
+                             list(iter_rows(TEST_FILE, backend="mmap", month_index=month_index)))
+
+    def test_iter_rows_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            iter_rows("C:\\test_path")
+
+    def test_iter_rows_invalid_data_values(self):
+        with open(TEST_FILE) as f:
+            lines = f.readlines()[:5 + 11]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "test.pre")
+            # A line with a value that is not an integer, and a line with too many values
+            for line in (" 3020 2820 30x0 2880 1740 1360  980  990 1410 1770 2580 2630\n",
+                         " 3020 2820 3040 2880 1740 1360  980  990 1410 1770 2580 2630    1\n"):
+                with open(path, "w") as f:
+                    f.writelines(lines[:6] + [line] + lines[7:])
+                for backend in ("text", "mmap"):
+                    with self.assertRaises(ValueError):
+                        list(iter_rows(path, backend))
+
+
+class TestIterRecords(unittest.TestCase):
+
+    def test_iter_records_valid(self):
+        records = iter_records(TEST_FILE)
+        self.assertNotIsInstance(records, list)
+        self.assertEqual({"Xref": 1, "Yref": 148, "Date": datetime(1991, 1, 1), "Value": 3020}, next(records))
+
+    def test_iter_records_valid_matches_transform_data(self):
+        self.assertEqual(transform_data(TEST_FILE), list(iter_records(TEST_FILE)))
+
+    def test_iter_records_valid_mmap_backend_matches_text(self):
+        self.assertEqual(list(iter_records(TEST_FILE)), list(iter_records(TEST_FILE, backend="mmap")))
+
+    def test_iter_records_invalid_backend(self):
+        with self.assertRaises(ValueError):
+            iter_records(TEST_FILE, backend="unknown")
+
+    def test_iter_records_invalid_file_not_found(self):
+        with self.assertRaises(FileNotFoundError):
+            iter_records("C:\\test_path")
+
+
+class TestIterBatches(unittest.TestCase):
+
+    def test_iter_batches_valid(self):
+        batches = list(iter_batches(TEST_FILE, batch_size=100000))
+        self.assertEqual(7, len(batches))
+        self.assertEqual(100000, len(batches[0]))
+        self.assertEqual(27115, len(batches[-1]))
+
+    def test_iter_batches_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            iter_batches(TEST_FILE, batch_size=0)
+
 
 class TestConvertToDf(unittest.TestCase):
 
@@ -31,6 +167,17 @@ class TestConvertToDf(unittest.TestCase):
         ]
         self.assertEqual(2, len(convert_to_df(data)))
 
+    def test_convert_to_df_valid_compact_dtypes(self):
+        data = [
+            {"Xref": 1, "Yref": 148, "Date": datetime(2000, 1, 1), "Value": 300},
+            {"Xref": 1, "Yref": 148, "Date": datetime(2000, 2, 1), "Value": None}
+        ]
+        df = convert_to_df(data)
+        self.assertEqual("int16", str(df["Xref"].dtype))
+        self.assertEqual("int16", str(df["Yref"].dtype))
+        self.assertEqual("Int16", str(df["Value"].dtype))
+        self.assertTrue(df["Value"].isna()[1])
+
     def test_convert_to_df_invalid_not_dict(self):
         data = [1, 2, 3, 4]
         with self.assertRaises(TypeError):